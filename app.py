@@ -1,14 +1,39 @@
-from flask import Flask, render_template, redirect, url_for, request, session, jsonify
-from datetime import datetime
+from jinja2 import FileSystemBytecodeCache
+from flask import Flask, render_template, redirect, url_for, request, session, jsonify, Response, g, stream_with_context
+from datetime import datetime, timedelta, timezone
 import os
+import json
+import math
+import csv
+import io
+import queue
+import gzip
+import uuid
 from bson import ObjectId
-import bcrypt
 from dotenv import load_dotenv
-from pymongo import MongoClient
-import random
+from pymongo import MongoClient, UpdateOne, ASCENDING, DESCENDING
+from pymongo.errors import OperationFailure, DuplicateKeyError
 import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait
+import zlib
+import re
+import atexit
+import tempfile
 import time
 from zoneinfo import ZoneInfo
+from price_engine import PriceEngine, load_checkpoint
+from price_models import ModelRegistry, MODELS
+from metrics import registry as metrics
+from order_book import OrderBook, ORDER_TYPES
+from portfolio_book import PortfolioBook
+from market_state import Lease, LocalMarketState, MongoMarketState, ShmMarketState
+from price_board import PriceBoard, TICKER_BYTES
+from price_history import BarRecorder, TickLog, INTERVALS, bar_start
+from request_tracing import RequestTracer, TimedLock, TraceMongoListener
+from password_hasher import PasswordHasher, HasherBusy
+from fragment_cache import FragmentCacheExtension
+from db_monitor import SlowQueryListener, CommandMetricsListener, PoolMetricsListener
 
 # ----------------------------
 # Mongo setup
@@ -19,11 +44,94 @@ MONGO_URI = os.getenv("MONGO_URI")
 if not MONGO_URI:
     raise ValueError("MONGO_URI is not set. Check your .env file.")
 
-client = MongoClient(MONGO_URI)
-db = client["stock_trading_app_401"]
+# Pool sizing, timeouts and concerns; unset variables keep the driver defaults
+MONGO_CLIENT_OPTIONS = {
+    "maxPoolSize": ("MONGO_MAX_POOL_SIZE", int),
+    "minPoolSize": ("MONGO_MIN_POOL_SIZE", int),
+    "maxIdleTimeMS": ("MONGO_MAX_IDLE_TIME_MS", int),
+    "waitQueueTimeoutMS": ("MONGO_WAIT_QUEUE_TIMEOUT_MS", int),
+    "connectTimeoutMS": ("MONGO_CONNECT_TIMEOUT_MS", int),
+    "socketTimeoutMS": ("MONGO_SOCKET_TIMEOUT_MS", int),
+    "serverSelectionTimeoutMS": ("MONGO_SERVER_SELECTION_TIMEOUT_MS", int),
+    "w": ("MONGO_WRITE_CONCERN", lambda v: int(v) if v.isdigit() else v),
+    "journal": ("MONGO_JOURNAL", lambda v: v.lower() in ("1", "true", "on")),
+    "readConcernLevel": ("MONGO_READ_CONCERN", str),
+    "readPreference": ("MONGO_READ_PREFERENCE", str),
+}
+
+def mongo_client_options() -> dict:
+    options = {}
+    for option, (env, parse) in MONGO_CLIENT_OPTIONS.items():
+        value = os.getenv(env)
+        if value:
+            options[option] = parse(value)
+    return options
+
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "100"))
+slow_queries = SlowQueryListener(SLOW_QUERY_MS)
+command_metrics = CommandMetricsListener(metrics)
+pool_metrics = PoolMetricsListener(metrics)
+
+client = MongoClient(
+    MONGO_URI,
+    event_listeners=[slow_queries, command_metrics, pool_metrics, TraceMongoListener()],
+    **mongo_client_options(),
+)
+slow_queries.bind(client)
+db = client[os.getenv("MONGO_DB", "stock_trading_app_401")]
 users_col = db["users"]
 stocks_col = db["stocks"]
 trades_col = db["trades"]
+price_bars_col = db["price_bars"]
+
+# ----------------------------
+# Indexes
+# ----------------------------
+# Every index the queries below rely on, created at startup if missing.
+# collection -> [(name, keys, options)]
+INDEXES = {
+    "users": [
+        ("username_unique", [("username", ASCENDING)], {"unique": True}),
+        ("email_unique", [("email", ASCENDING)], {"unique": True}),
+        # orders whose settlement moved this user's money but has not finished
+        ("settling_order_ids", [("settling_orders.order_id", ASCENDING)], {"sparse": True}),
+        ("settling_orders_at", [("settling_orders.at", ASCENDING)], {"sparse": True}),
+    ],
+    "stocks": [
+        ("ticker_unique", [("ticker", ASCENDING)], {"unique": True}),
+    ],
+    "price_bars": [
+        ("ticker_interval_start", [("ticker", ASCENDING), ("interval", ASCENDING), ("start", ASCENDING)], {"unique": True}),
+    ],
+    "trades": [
+        # trade history pages and exports
+        ("user_created_at", [("user_id", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)], {}),
+        # settlement scan of queued market orders
+        ("pending_by_created_at", [("status", ASCENDING), ("created_at", ASCENDING)],
+         {"partialFilterExpression": {"status": "pending"}}),
+        # orders claimed by a settlement job that has not finished yet
+        ("claimed_at", [("claimed_at", ASCENDING)],
+         {"partialFilterExpression": {"claimed_at": {"$exists": True}}}),
+        # resting limit/stop orders loaded into the order book
+        ("open_by_created_at", [("created_at", ASCENDING)],
+         {"partialFilterExpression": {"status": "open"}}),
+    ],
+}
+
+def ensure_indexes():
+    for collection_name, indexes in INDEXES.items():
+        collection = db[collection_name]
+        existing = collection.index_information()
+        existing_keys = {tuple(info["key"]) for info in existing.values()}
+        for name, keys, options in indexes:
+            if name in existing or (tuple(keys) in existing_keys and "partialFilterExpression" not in options):
+                continue
+            try:
+                collection.create_index(keys, name=name, **options)
+                app.logger.info("Created index %s on %s", name, collection_name)
+            except OperationFailure as e:
+                # e.g. duplicate usernames already stored; the app still runs without it
+                app.logger.error("Could not create index %s on %s: %s", name, collection_name, e)
 
 # ----------------------------
 # Flask app
@@ -31,6 +139,124 @@ trades_col = db["trades"]
 app = Flask(__name__)
 app.secret_key = os.getenv("SECRET_KEY", "dev_only_change_me")
 
+# Compiled templates are kept on disk so new workers skip the Jinja compile
+# step; {% cache %} blocks reuse markup shared by every user (e.g. the stock
+# list, keyed by the catalog_version it was read with). The cache folder holds
+# code Jinja will load, so it must be private to the app's user: unset uses
+# Jinja's own per-user folder, empty turns the cache off.
+JINJA_CACHE_DIR = os.getenv("JINJA_CACHE_DIR")
+
+def private_cache_dir(path: str) -> bool:
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    info = os.stat(path)
+    return info.st_uid == os.getuid() and not info.st_mode & 0o077
+
+if JINJA_CACHE_DIR is None:
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache()
+elif JINJA_CACHE_DIR:
+    if private_cache_dir(JINJA_CACHE_DIR):
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(JINJA_CACHE_DIR)
+    else:
+        app.logger.warning("JINJA_CACHE_DIR %s is not private to this user; template bytecode cache disabled", JINJA_CACHE_DIR)
+app.jinja_env.add_extension(FragmentCacheExtension)
+
+# Per-route timing, Mongo calls and ticker lock waits at /metrics; a sample of
+# requests (and every slow one) is logged as JSON lines off the request thread
+REQUEST_LOG_SAMPLE = float(os.getenv("REQUEST_LOG_SAMPLE", "0.01"))
+REQUEST_LOG_SLOW_MS = float(os.getenv("REQUEST_LOG_SLOW_MS", "500"))
+request_tracer = RequestTracer(
+    metrics, sample_rate=REQUEST_LOG_SAMPLE, slow_ms=REQUEST_LOG_SLOW_MS,
+    log_path=os.getenv("REQUEST_LOG_FILE") or None,
+)
+request_tracer.init_app(app)
+
+# bcrypt runs in a process pool; BCRYPT_ROUNDS changes are applied to stored
+# hashes as users log in
+password_hasher = PasswordHasher(
+    metrics,
+    rounds=int(os.getenv("BCRYPT_ROUNDS", "12")),
+    workers=int(os.getenv("PASSWORD_HASH_WORKERS", "2")),
+    max_pending=int(os.getenv("PASSWORD_HASH_MAX_PENDING", "16")),
+    timeout=float(os.getenv("PASSWORD_HASH_TIMEOUT", "10")),
+)
+BUSY_MESSAGE = "Too many sign-in attempts right now. Please try again in a moment."
+
+# ----------------------------
+# Stock catalog cache
+# ----------------------------
+# The stocks collection rarely changes, so pages read it from memory: a sorted
+# list for tables and a ticker -> doc dict for lookups. The admin routes
+# invalidate it on write; other workers pick changes up after
+# CATALOG_TTL_SECONDS, or immediately with CATALOG_CHANGE_STREAM=on (needs a
+# replica set). Cached docs are shared, so callers must not mutate them.
+CATALOG_TTL_SECONDS = float(os.getenv("CATALOG_TTL_SECONDS", "60"))
+CATALOG_CHANGE_STREAM = os.getenv("CATALOG_CHANGE_STREAM", "off").lower() in ("1", "true", "on")
+
+class StockCatalog:
+    def __init__(self, collection, ttl: float):
+        self._collection = collection
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._stocks = None
+        self._by_ticker = {}
+        self._loaded_at = 0.0
+        self.version = 0
+
+    def _stale(self):
+        if self._stocks is None:
+            return True
+        return self._ttl > 0 and time.monotonic() - self._loaded_at > self._ttl
+
+    def _load_locked(self):
+        stocks = list(self._collection.find({}, {"_id": 0}).sort("ticker", 1))
+        if stocks != self._stocks:
+            self.version += 1
+        self._stocks = stocks
+        self._by_ticker = {stock["ticker"]: stock for stock in stocks if stock.get("ticker")}
+        self._loaded_at = time.monotonic()
+
+    def reload(self):
+        with self._lock:
+            self._load_locked()
+            return self._stocks
+
+    def _ensure(self):
+        # One lock for the check and the reload: concurrent misses share a
+        # single find, and callers get lists an invalidate() cannot pull away
+        with self._lock:
+            if self._stale():
+                self._load_locked()
+            return self.version, self._stocks, self._by_ticker
+
+    def invalidate(self):
+        with self._lock:
+            self._stocks = None
+
+    def snapshot(self):
+        # (version, stocks) from the same load, for caches keyed by the version
+        version, stocks, _ = self._ensure()
+        return version, stocks
+
+    def all(self) -> list:
+        return self._ensure()[1]
+
+    def get(self, ticker: str):
+        return self._ensure()[2].get(ticker)
+
+    def watch(self):
+        try:
+            with self._collection.watch() as stream:
+                for _ in stream:
+                    self.invalidate()
+        except Exception:
+            app.logger.exception("Stock catalog change stream stopped; relying on TTL")
+
+stock_catalog = StockCatalog(stocks_col, CATALOG_TTL_SECONDS)
+
+def start_catalog_watch():
+    if CATALOG_CHANGE_STREAM:
+        threading.Thread(target=stock_catalog.watch, daemon=True, name="catalog-watch").start()
+
 # ----------------------------
 # Market Hours
 # ----------------------------
@@ -45,171 +271,1086 @@ def is_market_open():
 # ----------------------------
 # Stock Ticker System
 # ----------------------------
-ticker_state = {}
-ticker_lock = threading.Lock()
+# PRICE_MODEL picks the default model; a stock doc can override it with
+# "model" / "model_params". Set PRICE_SEED for a reproducible market.
+PRICE_MODEL = os.getenv("PRICE_MODEL", "uniform")
+PRICE_SEED = int(os.getenv("PRICE_SEED")) if os.getenv("PRICE_SEED") else None
+PRICE_TICK_SECONDS = 5
+
+price_models = ModelRegistry(
+    default=PRICE_MODEL,
+    seed=PRICE_SEED,
+    options={
+        "gbm": {"tick_seconds": PRICE_TICK_SECONDS},
+        "mean_reversion": {"tick_seconds": PRICE_TICK_SECONDS},
+        "replay": {"path": os.getenv("PRICE_REPLAY_PATH")},
+    },
+)
+ticker_lock = TimedLock()
+market = PriceEngine(ticker_lock, models=price_models)
+
+# MARKET_STATE_BACKEND=mongo (any hosts) or shm (one host) lets several workers
+# share one market: the elected worker ticks, matches and settles, the others
+# follow its state.
+MARKET_STATE_BACKEND = os.getenv("MARKET_STATE_BACKEND", "local").lower()
+MARKET_LEASE_SECONDS = float(os.getenv("MARKET_LEASE_SECONDS", "15"))
+PRICE_BOARD_PATH = os.getenv(
+    "PRICE_BOARD_PATH",
+    "/dev/shm/stock_trading_app_401.board" if os.path.isdir("/dev/shm") else os.path.join(tempfile.gettempdir(), "stock_trading_app_401.board"),
+)
+# Initial size; the producer lays the board out again, bigger, when the catalog outgrows it
+PRICE_BOARD_CAPACITY = int(os.getenv("PRICE_BOARD_CAPACITY", "4096"))
+price_board = None
+
+def create_market_state():
+    global price_board
+    if MARKET_STATE_BACKEND == "shm":
+        price_board = PriceBoard(PRICE_BOARD_PATH, PRICE_BOARD_CAPACITY)
+        return ShmMarketState(price_board)
+    if MARKET_STATE_BACKEND == "mongo":
+        lease = Lease(db["leases"], "market_producer", ttl=MARKET_LEASE_SECONDS)
+        return MongoMarketState(db["market_state"], lease)
+    if MARKET_STATE_BACKEND != "local":
+        raise ValueError(f"Unknown MARKET_STATE_BACKEND: {MARKET_STATE_BACKEND}")
+    return LocalMarketState()
+
+market_state = create_market_state()
+
+# Tickers must fit the shared price board's fixed-width ASCII column
+TICKER_PATTERN = re.compile(rf"[A-Z0-9.\-]{{1,{TICKER_BYTES}}}")
+
+def finite_number(value):
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    return number if math.isfinite(number) else None
 
-def initialize_ticker_state():
-    stocks = list(stocks_col.find({}, {"_id": 0}))
+def model_params(params):
+    # {name: float} from a stock doc's model_params, or None if any value is not a number
+    if not isinstance(params, dict):
+        return None
+    numbers = {str(name): finite_number(value) for name, value in params.items()}
+    return None if None in numbers.values() else numbers
+
+def catalog_entries(stocks):
+    # Sorted so a seeded run assigns random draws to the same tickers every
+    # time. Stock docs are edited by hand too, so anything the price models
+    # cannot use is skipped or dropped with a warning rather than raising
+    # inside tick() on every loop.
+    entries = []
     for stock in stocks:
-        ticker = stock.get("ticker")
-        if ticker and ticker not in ticker_state:
-            price = stock.get("price", 0.0)
-            ticker_state[ticker] = {
-                "ticker": ticker,
-                "current_price": price,
-                "opening_price": price,
-                "daily_high": price,
-                "daily_low": price,
-                "daily_change": 0.0,
-                "daily_change_percent": 0.0,
-            }
+        if not stock.get("ticker"):
+            continue
+        if not TICKER_PATTERN.fullmatch(stock["ticker"]):
+            app.logger.warning("Skipping stock with invalid ticker %r", stock["ticker"])
+            continue
+        price = finite_number(stock.get("price", 0.0))
+        if price is None or price < 0:
+            app.logger.warning("Skipping stock %s with invalid price %r", stock["ticker"], stock.get("price"))
+            continue
+        if stock.get("model") and stock["model"] not in MODELS:
+            app.logger.warning("Unknown price model %r for %s, using %s", stock["model"], stock["ticker"], PRICE_MODEL)
+        params = stock.get("model_params")
+        if params is not None:
+            params = model_params(params)
+            if params is None:
+                app.logger.warning("Invalid model_params %r for %s, using the model defaults", stock["model_params"], stock["ticker"])
+        entries.append({
+            "ticker": stock["ticker"],
+            "price": price,
+            "model": stock.get("model") if stock.get("model") in MODELS else None,
+            "model_params": params,
+        })
+    return entries
+
+def initialize_ticker_state():
+    global market_catalog_version
+    stock_catalog.reload()
+    market_catalog_version = None
+    sync_market_with_catalog()
+    restore_market_checkpoint()
+
+# Only the producer lists and delists tickers; followers take whatever it
+# publishes. It re-reads the catalog every tick (a no-op until the catalog
+# version moves), so an admin edit made on any worker reaches the market
+# once the producer's catalog reloads.
+market_catalog_version = None
+
+def sync_market_with_catalog() -> bool:
+    global market_catalog_version
+    version, stocks = stock_catalog.snapshot()
+    if version == market_catalog_version:
+        return False
+    added, removed = market.sync(catalog_entries(stocks))
+    market_catalog_version = version
+    return bool(added or removed)
+
+def refresh_market_catalog():
+    # After an admin edit: applied at once on the producer, by the next publish elsewhere
+    stock_catalog.invalidate()
+    if market_state.is_producer() and sync_market_with_catalog():
+        publish_ticker_update()
 
 def update_ticker_prices():
-    with ticker_lock:
-        for ticker in ticker_state:
-            state = ticker_state[ticker]
-            current_price = state["current_price"]
-            change_percent = random.uniform(-2, 2) / 100
-            new_price = max(0.01, round(current_price * (1 + change_percent), 2))
-            state["current_price"] = new_price
-            state["daily_high"] = max(state["daily_high"], new_price)
-            state["daily_low"] = min(state["daily_low"], new_price)
-            state["daily_change"] = round(new_price - state["opening_price"], 2)
-            if state["opening_price"] > 0:
-                state["daily_change_percent"] = round(
-                    ((new_price - state["opening_price"]) / state["opening_price"]) * 100, 2
-                )
+    market.tick()
 
 def reset_opening_prices():
-    with ticker_lock:
-        for ticker in ticker_state:
-            state = ticker_state[ticker]
-            price = state["current_price"]
-            state["opening_price"] = price
-            state["daily_high"] = price
-            state["daily_low"] = price
-            state["daily_change"] = 0.0
-            state["daily_change_percent"] = 0.0
+    market.reset_opens()
+
+def get_ticker(ticker):
+    # A quote on a shared-memory follower comes straight off the board, so it
+    # can be a tick ahead of the snapshot /api/ticker serves from the local copy
+    if price_board is not None and not price_board.writer:
+        return price_board.get(ticker)
+    return market.get(ticker)
+
+def get_quote(ticker):
+    row = get_ticker(ticker)
+    if row is None:
+        return None
+    return {**row, "market_open": get_ticker_snapshot().market_open}
+
+# ----------------------------
+# Market checkpoints
+# ----------------------------
+# The producer saves the whole market (prices, opens, highs, lows) every
+# MARKET_CHECKPOINT_SECONDS, so a restart resumes the trading day instead of
+# resetting every ticker to stocks.price. Empty MARKET_CHECKPOINT_PATH disables it.
+MARKET_CHECKPOINT_PATH = os.getenv("MARKET_CHECKPOINT_PATH", os.path.join("data", "market_checkpoint.npz"))
+MARKET_CHECKPOINT_SECONDS = float(os.getenv("MARKET_CHECKPOINT_SECONDS", "60"))
+last_checkpoint_at = 0.0
+
+def trading_day() -> str:
+    return datetime.now(ET).date().isoformat()
+
+def checkpoint_market(force: bool = False):
+    global last_checkpoint_at
+    # An empty engine (not started yet, or a process that only imported this
+    # module) must never overwrite a real checkpoint
+    if not MARKET_CHECKPOINT_PATH or not market_state.is_producer() or not len(market):
+        return
+    now = time.monotonic()
+    if not force and now - last_checkpoint_at < MARKET_CHECKPOINT_SECONDS:
+        return
+    last_checkpoint_at = now
+    try:
+        market.save(MARKET_CHECKPOINT_PATH, trading_day=trading_day(), market_open=is_market_open())
+    except OSError:
+        app.logger.exception("Could not write market checkpoint to %s", MARKET_CHECKPOINT_PATH)
+
+def restore_market_checkpoint():
+    if not MARKET_CHECKPOINT_PATH:
+        return
+    checkpoint = load_checkpoint(MARKET_CHECKPOINT_PATH)
+    if not checkpoint:
+        return
+    restored = market.restore(
+        checkpoint["tickers"], checkpoint["prices"], checkpoint["opens"], checkpoint["highs"], checkpoint["lows"])
+    # The session opened while we were down: start it from the restored prices
+    if is_market_open() and (checkpoint.get("trading_day") != trading_day() or not checkpoint.get("market_open")):
+        reset_opening_prices()
+    app.logger.info("Restored %d tickers from market checkpoint %s", restored, MARKET_CHECKPOINT_PATH)
+
+# ----------------------------
+# Price history
+# ----------------------------
+# The producer records every tick: raw ticks go to a binary file per day under
+# PRICE_HISTORY_DIR (empty disables it) and 1m / 5m / 1d OHLC bars go to
+# price_bars, written once a minute.
+PRICE_HISTORY_DIR = os.getenv("PRICE_HISTORY_DIR", os.path.join("data", "price_history"))
+HISTORY_MAX_BARS = 5000
+
+price_history = BarRecorder(price_bars_col, TickLog(PRICE_HISTORY_DIR) if PRICE_HISTORY_DIR else None)
+
+def record_price_history():
+    tickers, prices, _, _, _ = market.export_state()
+    price_history.record(datetime.utcnow(), tickers, prices)
+
+def parse_history_time(value):
+    # ISO 8601 -> naive UTC, as bars are stored; a time without an offset is
+    # taken as UTC. Raises ValueError for anything else.
+    if not value:
+        return None
+    when = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if when.tzinfo is not None:
+        when = when.astimezone(timezone.utc).replace(tzinfo=None)
+    return when
+
+def get_price_bars(ticker: str, interval: str, start=None, end=None, limit: int = 500):
+    query = {"ticker": ticker, "interval": interval}
+    if start or end:
+        query["start"] = {}
+        if start:
+            query["start"]["$gte"] = bar_start(start, interval)
+        if end:
+            query["start"]["$lt"] = end
+    # Newest `limit` bars in the range, returned oldest first
+    bars = list(price_bars_col.find(query, {"_id": 0, "start": 1, "open": 1, "high": 1, "low": 1, "close": 1})
+                .sort("start", -1).limit(limit))
+    bars.reverse()
+
+    # Fold in the minute that has not been written yet
+    current = price_history.current(ticker)
+    if current and (not end or current["start"] < end):
+        bucket = bar_start(current["start"], interval)
+        if bars and bars[-1]["start"] == bucket:
+            last = bars[-1]
+            last["high"] = max(last["high"], current["high"])
+            last["low"] = min(last["low"], current["low"])
+            last["close"] = current["close"]
+        elif not bars or bars[-1]["start"] < bucket:
+            bars.append({**current, "start": bucket})
+            bars = bars[-limit:]
+    return bars
+
+# ----------------------------
+# Ticker stream (Server-Sent Events)
+# ----------------------------
+STREAM_QUEUE_SIZE = int(os.getenv("STREAM_QUEUE_SIZE", "2"))
+STREAM_KEEPALIVE_SECONDS = 15
+# Each open stream holds a sync WSGI worker for as long as the tab stays open,
+# so pages only subscribe when asked to or when asgi.py serves the stream
+# ("auto"); otherwise they poll /api/ticker with its ETag.
+TICKER_STREAM = os.getenv("TICKER_STREAM", "auto").lower()
+app.jinja_env.globals["ticker_stream"] = TICKER_STREAM in ("1", "true", "on")
+
+class TickerBroadcaster:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self.latest = None
+
+    def subscribe(self):
+        return self.attach(queue.Queue(maxsize=STREAM_QUEUE_SIZE))
+
+    def attach(self, subscriber):
+        # Anything with queue.Queue's put_nowait/get_nowait can subscribe
+        with self._lock:
+            self._subscribers.add(subscriber)
+            latest = self.latest
+        if latest is not None:
+            subscriber.put_nowait(latest)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscribers)
+
+    def publish(self, payload: bytes):
+        with self._lock:
+            self.latest = payload
+            subscribers = list(self._subscribers)
+
+        for subscriber in subscribers:
+            # Every frame is a full snapshot, so a slow client only needs the newest one:
+            # drop whatever it has not read yet instead of blocking the price thread.
+            while True:
+                try:
+                    subscriber.put_nowait(payload)
+                    break
+                except queue.Full:
+                    try:
+                        subscriber.get_nowait()
+                    except queue.Empty:
+                        pass
+
+ticker_broadcaster = TickerBroadcaster()
+
+# ----------------------------
+# Published ticker snapshot
+# ----------------------------
+# Built once per tick and never mutated afterwards, so request handlers can
+# serve it without touching ticker_lock.
+TICKER_SNAPSHOT_MAX_AGE = 10
+TICKER_CHANGELOG_SIZE = int(os.getenv("TICKER_CHANGELOG_SIZE", "120"))
+BOOT_ID = uuid.uuid4().hex[:8]
+
+class TickerSnapshot:
+    __slots__ = ("version", "cursor", "market_open", "created_at", "rows", "deltas", "body", "gzip_body", "etag", "gzip_etag", "event")
+
+    def __init__(self, version: int, stocks: list, market_open: bool):
+        self.version = version
+        # Versions only mean something to the process that issued them, so
+        # the ?since= cursor carries BOOT_ID like the ETag does
+        self.cursor = f"{BOOT_ID}-{version}"
+        self.market_open = market_open
+        self.created_at = time.monotonic()
+        self.rows = {stock["ticker"]: stock for stock in stocks}
+        self.deltas = {}
+        self.body = json.dumps(
+            {"version": version, "cursor": self.cursor, "full": True, "market_open": market_open, "stocks": stocks},
+            separators=(",", ":"),
+        ).encode("utf-8")
+        self.gzip_body = gzip.compress(self.body, compresslevel=6)
+        self.etag = self.cursor
+        # The two encodings are different bytes, so they need different strong tags
+        self.gzip_etag = f"{self.etag}-gz"
+        self.event = b"id: %d\ndata: %s\n\n" % (version, self.body)
+
+ticker_snapshot = None
+snapshot_lock = threading.Lock()
+# Seeded from the wall clock so versions keep increasing across restarts
+snapshot_version = int(time.time() * 1000)
+ticker_changelog = deque(maxlen=TICKER_CHANGELOG_SIZE)
+
+def publish_ticker_update():
+    global ticker_snapshot, snapshot_version
+    with snapshot_lock:
+        stocks, changed, removed = market.snapshot()
+        snapshot_version += 1
+        snapshot = TickerSnapshot(snapshot_version, stocks, is_market_open())
+        ticker_changelog.append((snapshot.version, changed, removed))
+        ticker_snapshot = snapshot
+    ticker_broadcaster.publish(snapshot.event)
+    return snapshot
+
+def published_ticker_snapshot():
+    # The current snapshot, or None when it is missing or stale; never builds
+    # one, so callers on an event loop can check it without blocking
+    snapshot = ticker_snapshot
+    if snapshot is None or time.monotonic() - snapshot.created_at > TICKER_SNAPSHOT_MAX_AGE:
+        return None
+    return snapshot
+
+def get_ticker_snapshot():
+    # Rebuild if nothing is publishing (e.g. price thread not started) so market_open stays fresh
+    return published_ticker_snapshot() or publish_ticker_update()
+
+def get_ticker_delta(snapshot, cursor: str):
+    # Encoded changes between the `cursor` snapshot and `snapshot`, or None when
+    # the client needs the full snapshot: the cursor was issued by another
+    # worker (or an earlier run of this one), or the change log no longer
+    # reaches back that far.
+    boot_id, _, version = cursor.rpartition("-")
+    if boot_id != BOOT_ID or not version.isdigit():
+        return None
+    since = int(version)
+    cached = snapshot.deltas.get(since)
+    if cached is not None:
+        return cached
 
-def get_ticker_data():
-    with ticker_lock:
-        return list(ticker_state.values())
+    entries = [entry for entry in list(ticker_changelog) if since < entry[0] <= snapshot.version]
+    if since > snapshot.version or len(entries) != snapshot.version - since:
+        return None
+
+    changed, removed = set(), set()
+    for _, entry_changed, entry_removed in entries:
+        changed |= entry_changed
+        removed |= entry_removed
+
+    body = json.dumps({
+        "version": snapshot.version,
+        "cursor": snapshot.cursor,
+        "since": cursor,
+        "full": False,
+        "market_open": snapshot.market_open,
+        "stocks": [snapshot.rows[t] for t in sorted(changed) if t in snapshot.rows],
+        "removed": sorted(t for t in removed if t not in snapshot.rows),
+    }, separators=(",", ":")).encode("utf-8")
+    snapshot.deltas[since] = body
+    return body
 
 # ----------------------------
 # Background price update thread (runs 24/7)
 # ----------------------------
 last_market_state = None
 
+price_loop_errors_total = metrics.counter(
+    "price_loop_errors_total", "Price loop iterations that raised")
+
 def price_update_loop():
-    global last_market_state
+    producing = False
     while True:
-        if not ticker_state:
-            initialize_ticker_state()
-
+        try:
+            producing = price_update_tick(producing)
+        except Exception:
+            # A Mongo error must not kill the thread: log it, back off and try
+            # again. A producer that could not publish has resigned and re-elects.
+            price_loop_errors_total.inc()
+            app.logger.exception("Price update failed; retrying in %ss", PRICE_TICK_SECONDS)
+            producing = producing and market_state.is_producer()
+            time.sleep(PRICE_TICK_SECONDS)
+            continue
+        if producing:
+            time.sleep(PRICE_TICK_SECONDS)
+        else:
+            market_state.wait(PRICE_TICK_SECONDS)
+
+def price_update_tick(producing: bool) -> bool:
+    global last_market_state, market_catalog_version
+    if not len(market):
+        initialize_ticker_state()
+
+    was_producing, producing = producing, market_state.elect()
+    if producing and not was_producing:
+        # Newly elected (or single process): own the order book and
+        # re-check market hours so pending orders get a startup settlement
+        initialize_order_book()
+        last_market_state = None
+        market_catalog_version = None
+
+    if producing:
+        sync_market_with_catalog()
         # Reset opening prices when market transitions closed -> open
         open_now = is_market_open()
         if open_now and last_market_state is False:
             reset_opening_prices()
-            process_pending_orders()
+            enqueue_settlement("market_open")
         elif open_now and last_market_state is None:
-            process_pending_orders()
+            enqueue_settlement("startup")
         last_market_state = open_now
 
         # Always update prices regardless of market hours
         update_ticker_prices()
-        time.sleep(5)
+        try:
+            market_state.publish(market)
+        except Exception:
+            market_state.resign()
+            raise
+        record_price_history()
+        checkpoint_market()
+    else:
+        market_state.pull(market)
+
+    portfolio_book.apply_prices(market.get_quotes(portfolio_book.tickers()))
+    if producing and last_market_state:
+        sync_order_book()
+        match_open_orders()
+    publish_ticker_update()
+    return producing
 
 def start_price_thread():
     t = threading.Thread(target=price_update_loop, daemon=True)
     t.start()
 
-def process_pending_orders():
-    pending_orders = list(trades_col.find({"status": "pending"}).sort("created_at", 1))
-    if not pending_orders:
+# ----------------------------
+# Limit / stop orders
+# ----------------------------
+order_book = OrderBook()
+
+order_book_synced_at = None
+ORDER_SYNC_OVERLAP = 30
+
+# A claim this old belongs to a settlement job that died (a previous
+# producer may still be finishing younger ones, so those are left alone)
+SETTLEMENT_CLAIM_TIMEOUT = float(os.getenv("SETTLEMENT_CLAIM_TIMEOUT", "300"))
+
+def release_claims(query):
+    # Resolves claimed orders matching `query` whose settlement job is gone.
+    # An order its user was already charged or paid for (the user still lists
+    # it in settling_orders) is completed from that record; the rest go back
+    # to pending / open and are settled again.
+    orders = list(trades_col.find({**query, "status": {"$in": ["settling", "triggered"]}}))
+    if not orders:
+        return
+    applied = {}
+    affected_users = set()
+    for user in users_col.find({"settling_orders.order_id": {"$in": [order["_id"] for order in orders]}}, {"settling_orders": 1}):
+        affected_users.add(str(user["_id"]))
+        for record in user["settling_orders"]:
+            applied[record["order_id"]] = record
+
+    trade_ops = []
+    reopened = []
+    for order in orders:
+        claim = {"_id": order["_id"], "status": order["status"], "claim_id": order.get("claim_id")}
+        record = applied.get(order["_id"])
+        if record:
+            trade_ops.append(UpdateOne(claim, {
+                "$set": {"status": "completed", "price": record["price"], "total_proceeds": record["total"], "executed_at": record["at"]},
+                "$unset": {"claimed_at": ""},
+            }))
+        elif order["status"] == "triggered":
+            trade_ops.append(UpdateOne(claim, {"$set": {"status": "open"}, "$unset": {"claimed_at": "", "claim_id": ""}}))
+            reopened.append(order["_id"])
+        else:
+            trade_ops.append(UpdateOne(claim, {"$set": {"status": "pending"}, "$unset": {"claimed_at": "", "claim_id": ""}}))
+    trades_col.bulk_write(trade_ops, ordered=False)
+
+    if applied:
+        order_ids = list(applied)
+        users_col.update_many(
+            {"settling_orders.order_id": {"$in": order_ids}},
+            {"$pull": {"settling_orders": {"order_id": {"$in": order_ids}}}}
+        )
+        # Cached totals may predate the settlement; reload them from the account
+        for user_id in affected_users:
+            portfolio_book.discard(user_id)
+    if reopened and market_state.is_producer():
+        order_book.load(trades_col.find({"_id": {"$in": reopened}, "status": "open"}).sort("created_at", 1))
+
+def release_stale_claims():
+    cutoff = datetime.utcnow() - timedelta(seconds=SETTLEMENT_CLAIM_TIMEOUT)
+    release_claims({"claimed_at": {"$lt": cutoff}})
+    # Records left behind when a finished job could not clear them
+    users_col.update_many(
+        {"settling_orders.at": {"$lt": cutoff}},
+        {"$pull": {"settling_orders": {"at": {"$lt": cutoff}}}}
+    )
+
+def initialize_order_book():
+    # Orders claimed by a settlement job that never finished go back on the book
+    global order_book_synced_at
+    order_book_synced_at = datetime.utcnow()
+    release_stale_claims()
+    skipped = order_book.load(trades_col.find({"status": "open"}).sort("created_at", 1))
+    if skipped:
+        app.logger.warning("Skipped %d open orders with an invalid trigger price", skipped)
+
+def sync_order_book():
+    # Picks up orders other workers placed since the last sync; the overlap
+    # absorbs clock skew between hosts and add() ignores orders already held
+    global order_book_synced_at
+    if not market_state.shared:
         return
+    now = datetime.utcnow()
+    since = order_book_synced_at - timedelta(seconds=ORDER_SYNC_OVERLAP)
+    order_book.load(trades_col.find({"status": "open", "created_at": {"$gte": since}}).sort("created_at", 1))
+    order_book_synced_at = now
+
+def claim_orders(orders, status: str, claimed_status: str):
+    # Moves orders out of `status` under a fresh claim_id before any money
+    # moves, so a concurrent cancel or a second settler (another worker, a
+    # lease failover) cannot settle them too; only the orders this call
+    # claimed are returned. claimed_at is cleared when the order completes or fails.
+    claim_id = ObjectId()
+    order_ids = [order["_id"] for order in orders]
+    now = datetime.utcnow()
+    trades_col.update_many(
+        {"_id": {"$in": order_ids}, "status": status},
+        {"$set": {"status": claimed_status, "claim_id": claim_id, "claimed_at": now}}
+    )
+    claimed = {doc["_id"] for doc in trades_col.find({"_id": {"$in": order_ids}, "claim_id": claim_id}, {"_id": 1})}
+    return [
+        {**order, "status": claimed_status, "claim_id": claim_id}
+        for order in orders if order["_id"] in claimed
+    ]
+
+def claim_triggered_orders(orders):
+    return claim_orders(orders, "open", "triggered")
+
+def parse_resting_order():
+    # (order_type, trigger_price) from the buy/sell form; trigger_price is None if invalid
+    order_type = request.form.get("order_type", "market").strip().lower()
+    if order_type not in ORDER_TYPES:
+        return "market", None
+    try:
+        trigger_price = round(float(request.form.get("trigger_price", "").strip()), 2)
+        if not math.isfinite(trigger_price) or trigger_price <= 0:
+            raise ValueError()
+    except ValueError:
+        return order_type, None
+    return order_type, trigger_price
+
+def place_resting_order(user_id, side, company, ticker, shares, order_type, trigger_price):
+    order = {
+        "user_id": user_id,
+        "type": side,
+        "company": company,
+        "ticker": ticker,
+        "shares": shares,
+        "price": trigger_price,
+        "order_type": order_type,
+        "trigger_price": trigger_price,
+        "requested_total": round(shares * trigger_price, 2),
+        "total_proceeds": round(shares * trigger_price, 2),
+        "status": "open",
+        "created_at": datetime.utcnow(),
+    }
+    order["_id"] = trades_col.insert_one(order).inserted_id
+    if market_state.is_producer():
+        order_book.add(order)
+    return order
+
+def match_open_orders():
+    # Checks only tickers that have resting orders; crossed orders are settled off this thread
+    prices = {t: p for t, p in market.get_prices(order_book.tickers()).items() if p is not None}
+    triggered = order_book.match(prices)
+    if triggered:
+        triggered.sort(key=lambda order: order["created_at"])
+        enqueue_settlement("triggered", triggered)
+    return triggered
+
+# ----------------------------
+# Order settlement worker
+# ----------------------------
+# The price thread only enqueues settlement jobs. A dedicated thread runs them,
+# fanning each batch out to a pool partitioned by user_id: different users settle
+# in parallel while one user's orders stay in created_at order in one partition.
+SETTLEMENT_WORKERS = int(os.getenv("SETTLEMENT_WORKERS", "4"))
+settlement_pool = ThreadPoolExecutor(max_workers=SETTLEMENT_WORKERS, thread_name_prefix="settlement")
+settlement_queue = queue.Queue()
+
+settlement_queue_depth = metrics.gauge(
+    "settlement_queue_depth", "Settlement jobs waiting to run", fn=settlement_queue.qsize)
+settlement_wait_seconds = metrics.histogram(
+    "settlement_wait_seconds", "Time a settlement job spent queued before starting")
+settlement_latency_seconds = metrics.histogram(
+    "settlement_latency_seconds", "Time from enqueueing a settlement job to its completion")
+settlement_partition_seconds = metrics.histogram(
+    "settlement_partition_seconds", "Time to settle one user partition")
+settlement_jobs_total = metrics.counter(
+    "settlement_jobs_total", "Settlement jobs run, by outcome")
+settlement_orders_total = metrics.counter(
+    "settlement_orders_total", "Orders settled, by outcome")
+
+def enqueue_settlement(reason: str, orders=None):
+    # orders=None settles everything pending in trades_col; otherwise settles the given open orders
+    settlement_queue.put((reason, time.monotonic(), orders))
+
+def settlement_loop():
+    # Between jobs the producer also sweeps claims left by jobs that died
+    # elsewhere; doing it on this thread keeps it clear of our own jobs
+    swept_at = time.monotonic()
+    while True:
+        try:
+            reason, enqueued_at, orders = settlement_queue.get(timeout=SETTLEMENT_CLAIM_TIMEOUT)
+        except queue.Empty:
+            reason = None
+        if time.monotonic() - swept_at >= SETTLEMENT_CLAIM_TIMEOUT:
+            swept_at = time.monotonic()
+            if market_state.is_producer():
+                try:
+                    release_stale_claims()
+                except Exception:
+                    app.logger.exception("Could not release stale settlement claims")
+        if reason is None:
+            continue
+
+        settlement_wait_seconds.observe(time.monotonic() - enqueued_at)
+        claimed = []
+        try:
+            claimed = claim_pending_orders() if orders is None else claim_triggered_orders(orders)
+            if claimed:
+                settle_batch(claimed, reason)
+            settlement_jobs_total.inc(status="ok")
+        except Exception:
+            app.logger.exception("Settlement job (%s) failed", reason)
+            settlement_jobs_total.inc(status="error")
+            if claimed:
+                # Resolve this job's orders now instead of leaving them claimed until the sweep
+                try:
+                    release_claims({"claim_id": claimed[0]["claim_id"]})
+                except Exception:
+                    app.logger.exception("Could not release the orders of settlement job (%s)", reason)
+        finally:
+            settlement_latency_seconds.observe(time.monotonic() - enqueued_at)
+            settlement_queue.task_done()
+
+def start_settlement_thread():
+    t = threading.Thread(target=settlement_loop, daemon=True, name="settlement")
+    t.start()
+
+def partition_orders(orders, partitions: int):
+    buckets = [[] for _ in range(partitions)]
+    for order in orders:
+        buckets[zlib.crc32(str(order["user_id"]).encode("utf-8")) % partitions].append(order)
+    return [bucket for bucket in buckets if bucket]
+
+def claim_pending_orders():
+    pending_orders = list(trades_col.find({"status": "pending"}).sort("created_at", 1))
+    return claim_orders(pending_orders, "pending", "settling") if pending_orders else []
+
+def process_pending_orders():
+    claimed = claim_pending_orders()
+    if not claimed:
+        return None
+    return settle_batch(claimed, "pending")
+
+def settle_batch(orders, reason: str):
+    # orders must already be in created_at order
+    started = time.perf_counter()
+    partitions = partition_orders(orders, SETTLEMENT_WORKERS)
+    futures = [settlement_pool.submit(settle_orders, part) for part in partitions]
+    # Every partition finishes before a failure is raised, so the job's claims
+    # are never released under a partition that is still writing
+    wait(futures)
+    results = [future.result() for future in futures]
+    completed = sum(result[0] for result in results)
+    failed = sum(result[1] for result in results)
+
+    elapsed = time.perf_counter() - started
+    stats = {
+        "orders": len(orders),
+        "completed": completed,
+        "failed": failed,
+        "partitions": len(partitions),
+        "seconds": round(elapsed, 4),
+        "orders_per_second": round(len(orders) / elapsed, 1) if elapsed > 0 else None,
+    }
+    app.logger.info(
+        "Settled %d %s orders (%d completed, %d failed) across %d partitions in %.3fs, %s orders/s",
+        stats["orders"], reason, completed, failed, len(partitions), elapsed, stats["orders_per_second"],
+    )
+    return stats
+
+def settle_orders(pending_orders):
+    # Settles one partition in a single pass: one $in for its users, in-memory
+    # settlement in created_at order, then a single bulk_write per collection.
+    # Triggered limit/stop orders carry the tick price that crossed their trigger
+    # as fill_price; market orders fill at the current price.
+    started = time.perf_counter()
+    user_ids = list({order["user_id"] for order in pending_orders})
+    accounts = {
+        user["_id"]: {"cash": float(user.get("cash", 0.0)), "holdings": dict(user.get("holdings") or {})}
+        for user in users_col.find({"_id": {"$in": user_ids}}, {"cash": 1, "holdings": 1})
+    }
+
+    tickers = {order.get("ticker") for order in pending_orders if not order.get("fill_price")}
+    prices = market.get_prices(tickers)
+    unpriced = [ticker for ticker, price in prices.items() if price is None]
+    for ticker in unpriced:
+        stock_doc = stock_catalog.get(ticker)
+        if stock_doc:
+            prices[ticker] = float(stock_doc.get("price", 0.0))
+
+    cash_deltas = {}
+    holding_deltas = {}
+    fills = {}
+    failures = []
 
     for order in pending_orders:
         user_id = order["user_id"]
-        user = users_col.find_one({"_id": user_id})
-        if not user:
-            trades_col.update_one(
-                {"_id": order["_id"]},
-                {"$set": {"status": "failed", "failed_reason": "User not found at execution", "executed_at": datetime.utcnow()}}
-            )
+        account = accounts.get(user_id)
+        if not account:
+            failures.append((order, "User not found at execution"))
             continue
 
         ticker = order.get("ticker")
         shares = int(order.get("shares", 0))
-        stock_state = ticker_state.get(ticker)
-        execution_price = None
-
-        if stock_state:
-            execution_price = float(stock_state.get("current_price", 0.0))
-        else:
-            stock_doc = stocks_col.find_one({"ticker": ticker})
-            execution_price = float(stock_doc.get("price", 0.0)) if stock_doc else None
-
+        execution_price = order.get("fill_price") or prices.get(ticker)
         if execution_price is None or execution_price <= 0:
-            trades_col.update_one(
-                {"_id": order["_id"]},
-                {"$set": {"status": "failed", "failed_reason": "Could not determine execution price", "executed_at": datetime.utcnow()}}
-            )
+            failures.append((order, "Could not determine execution price"))
             continue
 
+        total = round(execution_price * shares, 2)
         if order["type"] == "buy":
-            cash = float(user.get("cash", 0.0))
-            total_cost = round(execution_price * shares, 2)
-            if cash >= total_cost:
-                users_col.update_one(
-                    {"_id": user_id},
-                    {"$inc": {"cash": -total_cost, f"holdings.{ticker}": shares}}
-                )
-                trades_col.update_one(
-                    {"_id": order["_id"]},
-                    {"$set": {"status": "completed", "price": execution_price, "total_proceeds": total_cost, "executed_at": datetime.utcnow()}}
-                )
-            else:
-                trades_col.update_one(
-                    {"_id": order["_id"]},
-                    {"$set": {"status": "failed", "failed_reason": "Insufficient funds at market open", "executed_at": datetime.utcnow()}}
-                )
+            if account["cash"] < total:
+                failures.append((order, f"Insufficient funds {settlement_phase(order)}"))
+                continue
+            cash_change, share_change = -total, shares
+        else:
+            if account["holdings"].get(ticker, 0) < shares:
+                failures.append((order, f"Insufficient holdings {settlement_phase(order)}"))
+                continue
+            cash_change, share_change = total, -shares
+
+        account["cash"] += cash_change
+        account["holdings"][ticker] = account["holdings"].get(ticker, 0) + share_change
+        cash_deltas[user_id] = cash_deltas.get(user_id, 0.0) + cash_change
+        user_holdings = holding_deltas.setdefault(user_id, {})
+        user_holdings[ticker] = user_holdings.get(ticker, 0) + share_change
+        fills.setdefault(user_id, []).append((order, execution_price, total))
+
+    if transactions_supported():
+        # User and trade writes commit together; a failure leaves nothing to undo
+        with client.start_session() as mongo_session:
+            completed = mongo_session.with_transaction(
+                lambda s: write_settlement(cash_deltas, holding_deltas, fills, failures, s))
+    else:
+        completed = write_settlement(cash_deltas, holding_deltas, fills, failures)
+
+    for order, execution_price, total in completed:
+        shares = int(order["shares"])
+        if order["type"] == "buy":
+            record_trade(order["user_id"], order["ticker"], shares, -total)
         else:
-            holdings = user.get("holdings", {}) or {}
-            if holdings.get(ticker, 0) >= shares:
-                total_proceeds = round(execution_price * shares, 2)
-                users_col.update_one(
-                    {"_id": user_id},
-                    {"$inc": {"cash": total_proceeds, f"holdings.{ticker}": -shares}}
-                )
-                trades_col.update_one(
-                    {"_id": order["_id"]},
-                    {"$set": {"status": "completed", "price": execution_price, "total_proceeds": total_proceeds, "executed_at": datetime.utcnow()}}
-                )
+            record_trade(order["user_id"], order["ticker"], -shares, total)
+
+    failed = len(pending_orders) - len(completed)
+    settlement_partition_seconds.observe(time.perf_counter() - started)
+    settlement_orders_total.inc(len(completed), status="completed")
+    settlement_orders_total.inc(failed, status="failed")
+    return len(completed), failed
+
+def write_settlement(cash_deltas, holding_deltas, fills, failures, session=None):
+    # Applies one partition's planned fills and returns the (order, price,
+    # total) that completed. Without a transaction, every user update also
+    # lists its orders in the user's settling_orders (and skips any already
+    # listed) until the trade updates are written, so release_claims can tell
+    # an order whose money moved from one that never got that far.
+    settlement_id = ObjectId()
+    now = datetime.utcnow()
+    trade_ops = []
+    completed = []
+
+    def settling_record(order, execution_price, total):
+        return {"order_id": order["_id"], "price": execution_price, "total": total, "at": now}
+
+    def fail(order, reason):
+        trade_ops.append(UpdateOne(
+            {"_id": order["_id"], "claim_id": order["claim_id"]},
+            {"$set": {"status": "failed", "failed_reason": reason, "executed_at": now},
+             "$unset": {"claimed_at": ""}}
+        ))
+
+    def complete(order, execution_price, total):
+        trade_ops.append(UpdateOne(
+            {"_id": order["_id"], "claim_id": order["claim_id"]},
+            {"$set": {"status": "completed", "price": execution_price, "total_proceeds": total, "executed_at": now},
+             "$unset": {"claimed_at": ""}}
+        ))
+        completed.append((order, execution_price, total))
+
+    for order, reason in failures:
+        fail(order, reason)
+
+    # Net change per user, guarded so a concurrent trade that spent the same
+    # cash or shares makes the update miss instead of overdrawing the account
+    user_ops = []
+    op_user_ids = []
+    for user_id, user_fills in fills.items():
+        cash_change = round(cash_deltas[user_id], 2)
+        guard = {"_id": user_id}
+        inc = {}
+        if cash_change:
+            inc["cash"] = cash_change
+            if cash_change < 0:
+                guard["cash"] = {"$gte": -cash_change}
+        for ticker, n in holding_deltas[user_id].items():
+            if n:
+                inc[f"holdings.{ticker}"] = n
+            if n < 0:
+                guard[f"holdings.{ticker}"] = {"$gte": -n}
+        update = {"$set": {"last_settlement_id": settlement_id}}
+        if inc:
+            update["$inc"] = inc
+        if session is None:
+            guard["settling_orders.order_id"] = {"$nin": [order["_id"] for order, _, _ in user_fills]}
+            update["$push"] = {"settling_orders": {"$each": [settling_record(*fill) for fill in user_fills]}}
+        user_ops.append(UpdateOne(guard, update))
+        op_user_ids.append(user_id)
+
+    missed = set()
+    if user_ops:
+        result = users_col.bulk_write(user_ops, ordered=False, session=session)
+        if result.matched_count < len(user_ops):
+            applied = {
+                user["_id"]
+                for user in users_col.find(
+                    {"_id": {"$in": op_user_ids}, "last_settlement_id": settlement_id}, {"_id": 1}, session=session)
+            }
+            missed = set(op_user_ids) - applied
+
+    for user_id, user_fills in fills.items():
+        if user_id not in missed:
+            for fill in user_fills:
+                complete(*fill)
+            continue
+        # The account moved under us: fall back to one guarded update per order
+        for order, execution_price, total in user_fills:
+            guard, update = trade_guard(user_id, order["type"], order["ticker"], int(order["shares"]), total)
+            if session is None:
+                guard["settling_orders.order_id"] = {"$ne": order["_id"]}
+                update["$push"] = {"settling_orders": settling_record(order, execution_price, total)}
+            if users_col.update_one(guard, update, session=session).modified_count:
+                complete(order, execution_price, total)
+            elif session is None and users_col.find_one({"_id": user_id, "settling_orders.order_id": order["_id"]}, {"_id": 1}):
+                # An earlier attempt already moved the money for this order
+                complete(order, execution_price, total)
             else:
-                trades_col.update_one(
-                    {"_id": order["_id"]},
-                    {"$set": {"status": "failed", "failed_reason": "Insufficient holdings at market open", "executed_at": datetime.utcnow()}}
-                )
+                reason = "funds" if order["type"] == "buy" else "holdings"
+                fail(order, f"Insufficient {reason} {settlement_phase(order)}")
+
+    trades_col.bulk_write(trade_ops, ordered=False, session=session)
+
+    if session is None and completed:
+        order_ids = [order["_id"] for order, _, _ in completed]
+        users_col.update_many(
+            {"_id": {"$in": list(fills)}},
+            {"$pull": {"settling_orders": {"order_id": {"$in": order_ids}}}}
+        )
+    return completed
+
+def settlement_phase(order):
+    # Claimed market orders are "settling"; claimed limit/stop orders are "triggered"
+    return "at market open" if order["status"] == "settling" else "at execution"
+
+# ----------------------------
+# Trade execution
+# ----------------------------
+# Cash and holdings are only changed through a filter that re-checks them, so
+# concurrent requests for the same user (double submits, several tabs, API
+# clients) cannot overdraw cash or sell shares twice. Where the deployment
+# supports transactions the user update and the trade insert commit together.
+MONGO_TRANSACTIONS = os.getenv("MONGO_TRANSACTIONS", "auto").lower()
+_transactions_supported = None
+
+class TradeRejected(Exception):
+    pass
+
+def trade_guard(user_id, side, ticker, shares, total):
+    if side == "buy":
+        return (
+            {"_id": user_id, "cash": {"$gte": total}},
+            {"$inc": {"cash": -total, f"holdings.{ticker}": shares}},
+        )
+    return (
+        {"_id": user_id, f"holdings.{ticker}": {"$gte": shares}},
+        {"$inc": {"cash": total, f"holdings.{ticker}": -shares}},
+    )
+
+def transactions_supported():
+    global _transactions_supported
+    if MONGO_TRANSACTIONS in ("0", "false", "off"):
+        return False
+    if _transactions_supported is None:
+        try:
+            hello = client.admin.command("hello")
+            _transactions_supported = bool(hello.get("setName")) or hello.get("msg") == "isdbgrid"
+        except Exception:
+            _transactions_supported = False
+    return _transactions_supported
+
+def _apply_trade(guard, update, trade_doc, session=None):
+    result = users_col.update_one(guard, update, session=session)
+    if not result.modified_count:
+        raise TradeRejected()
+    try:
+        trades_col.insert_one(trade_doc, session=session)
+    except Exception:
+        if session is None:
+            # No transaction to roll back: undo the balance change by hand
+            users_col.update_one({"_id": guard["_id"]}, {"$inc": {k: -v for k, v in update["$inc"].items()}})
+        raise
+
+def execute_trade(user_id, side, ticker, shares, total, trade_doc):
+    # Raises TradeRejected when the user no longer has the cash / shares
+    guard, update = trade_guard(user_id, side, ticker, shares, total)
+    if transactions_supported():
+        with client.start_session() as mongo_session:
+            mongo_session.with_transaction(lambda s: _apply_trade(guard, update, trade_doc, s))
+    else:
+        _apply_trade(guard, update, trade_doc)
 
 
-def get_current_user():
+# The logged-in user's document is fetched at most once per request and kept on
+# flask.g. Callers can ask for a subset of fields; the trading pages only need
+# TRADING_FIELDS, so those are loaded together in one projected query.
+TRADING_FIELDS = ("cash", "holdings", "role")
+
+def get_current_user(fields=None):
     user_id = session.get("user_id")
     if not user_id:
         return None
-    return users_col.find_one({"_id": ObjectId(user_id)})
+
+    cached = g.get("current_user")
+    if cached is not None:
+        loaded = cached["fields"]
+        if loaded is None or (fields is not None and loaded.issuperset(fields)):
+            return cached["doc"]
+
+    if fields is None:
+        loaded, projection = None, None
+    else:
+        loaded = set(fields) | (cached["fields"] if cached else set())
+        projection = dict.fromkeys(loaded, 1)
+    user = users_col.find_one({"_id": ObjectId(user_id)}, projection)
+    g.current_user = {"doc": user, "fields": loaded}
+    return user
+
+def invalidate_current_user():
+    # Call after writing to the current user so later reads in the request see the change
+    g.pop("current_user", None)
 
 def get_current_cash(default: float = 0.0) -> float:
-    user = get_current_user()
+    user = get_current_user(TRADING_FIELDS)
     if not user:
         return default
     return float(user.get("cash", default))
 
 def get_current_holdings() -> dict:
-    user = get_current_user()
+    user = get_current_user(TRADING_FIELDS)
     if not user:
         return {}
     return user.get("holdings", {})
 
+# ----------------------------
+# Portfolio valuation
+# ----------------------------
+# Resolves every position in one pass: live prices from the price engine,
+# names from the stock catalog, and a single $in query for any ticker the
+# catalog does not know (e.g. added by another worker since its last reload).
+def value_portfolio(holdings: dict) -> dict:
+    tickers = sorted(t for t, shares in (holdings or {}).items() if shares > 0)
+    quotes = market.get_quotes(tickers)
+    docs = {ticker: stock_catalog.get(ticker) for ticker in tickers}
+    unknown = [ticker for ticker, doc in docs.items() if doc is None]
+    if unknown:
+        for doc in stocks_col.find({"ticker": {"$in": unknown}}, {"_id": 0, "ticker": 1, "name": 1, "price": 1}):
+            docs[doc["ticker"]] = doc
+
+    positions = {}
+    for ticker in tickers:
+        doc = docs.get(ticker)
+        quote = quotes.get(ticker)
+        if quote:
+            price, opening_price = quote
+        else:
+            price = float(doc.get("price", 0.0)) if doc else 0.0
+            opening_price = price
+        shares = holdings[ticker]
+        positions[ticker] = {
+            "company": doc.get("name", ticker) if doc else ticker,
+            "shares": shares,
+            "price": price,
+            "opening_price": opening_price,
+            "value": shares * price,
+            "opening_value": shares * opening_price,
+            "listed": doc is not None,
+        }
+    return positions
+
+def sellable_positions(holdings: dict) -> dict:
+    return {ticker: position for ticker, position in value_portfolio(holdings).items() if position["listed"]}
+
+# Per-user aggregates kept current by the price loop and by trades in this
+# process, so the dashboard and /api/portfolio do not walk every holding.
+PORTFOLIO_TTL_SECONDS = float(os.getenv("PORTFOLIO_TTL_SECONDS", "30"))
+portfolio_book = PortfolioBook(market.get_quotes, ttl=PORTFOLIO_TTL_SECONDS)
+
+def portfolio_quotes(holdings: dict) -> dict:
+    return {
+        ticker: (position["price"], position["opening_price"])
+        for ticker, position in value_portfolio(holdings).items()
+    }
+
+def load_portfolio_summary(user_id: str, user: dict):
+    holdings = user.get("holdings") or {}
+    return portfolio_book.load(user_id, float(user.get("cash", 0.0)), holdings, portfolio_quotes(holdings))
+
+def portfolio_totals(summary: dict) -> dict:
+    cash = summary["cash"]
+    total_value = cash + summary["market_value"]
+    opening_total = cash + summary["opening_value"]
+    change = summary["market_value"] - summary["opening_value"]
+    summary.update({
+        "total_value": total_value,
+        "daily_change": change,
+        "daily_change_percent": (change / opening_total) * 100 if opening_total > 0 else 0.0,
+    })
+    return summary
+
+def get_portfolio_summary():
+    user_id = session.get("user_id")
+    if not user_id:
+        return None
+    summary = portfolio_book.get(user_id)
+    if summary is None:
+        user = get_current_user(TRADING_FIELDS)
+        if not user:
+            return None
+        summary = load_portfolio_summary(user_id, user)
+    return portfolio_totals(summary)
+
+def record_trade(user_id, ticker=None, shares: int = 0, cash: float = 0.0):
+    portfolio_book.apply_trade(str(user_id), ticker, shares, cash)
+
 # ----------------------------
 # Classes (unused but kept)
 # ----------------------------
@@ -248,23 +1389,31 @@ def register():
     if len(password) < 6:
         return render_template("login.html", error="Password must be at least 6 characters.")
 
+    taken_error = "Username or email already exists. Try another."
     existing = users_col.find_one({"$or": [{"username": username}, {"email": email}]})
     if existing:
-        return render_template("login.html", error="Username or email already exists. Try another.")
+        return render_template("login.html", error=taken_error)
 
-    password_hash = bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt())
+    try:
+        password_hash = password_hasher.hash(password)
+    except HasherBusy:
+        return render_template("login.html", error=BUSY_MESSAGE), 503, {"Retry-After": "5"}
 
-    users_col.insert_one({
-        "full_name": full_name,
-        "username": username,
-        "email": email,
-        "phone": phone,
-        "password_hash": password_hash,
-        "created_at": datetime.utcnow(),
-        "role": "user",
-        "cash": 1000.42,
-        "holdings": {}
-    })
+    try:
+        users_col.insert_one({
+            "full_name": full_name,
+            "username": username,
+            "email": email,
+            "phone": phone,
+            "password_hash": password_hash,
+            "created_at": datetime.utcnow(),
+            "role": "user",
+            "cash": 1000.42,
+            "holdings": {}
+        })
+    except DuplicateKeyError:
+        # Lost a race with another registration for the same name or email
+        return render_template("login.html", error=taken_error)
 
     return redirect(url_for("login_page"))
 
@@ -288,9 +1437,19 @@ def login_page():
     if not stored_hash:
         return render_template("register.html", error="Account error: missing password hash.")
 
-    if not bcrypt.checkpw(password.encode("utf-8"), stored_hash):
+    try:
+        valid = password_hasher.verify(password, stored_hash)
+    except HasherBusy:
+        return render_template("register.html", error=BUSY_MESSAGE), 503, {"Retry-After": "5"}
+    if not valid:
         return render_template("register.html", error="Invalid username or password.")
 
+    if password_hasher.needs_rehash(stored_hash):
+        user_id = user["_id"]
+        password_hasher.rehash_later(password, lambda new_hash: users_col.update_one(
+            {"_id": user_id, "password_hash": stored_hash}, {"$set": {"password_hash": new_hash}}
+        ))
+
     session["user_id"] = str(user["_id"])
     session["username"] = user.get("username", "Explorer")
     session["full_name"] = user.get("full_name", "")
@@ -304,40 +1463,17 @@ def dashboard():
         return redirect(url_for("login_page"))
 
     username = session.get("username", "Explorer")
-    stocks = list(stocks_col.find({}, {"_id": 0}).sort("ticker", 1))
-    cash = get_current_cash(default=0.0)
-    holdings = get_current_holdings()
-
-    total_invested = 0.00
-    portfolio_value = cash
-    portfolio_stocks = {}
-    total_opening_value = cash
-    total_portfolio_change = 0.0
-
-    for ticker, shares in holdings.items():
-        if shares > 0:
-            with ticker_lock:
-                ticker_info = ticker_state.get(ticker)
-            if ticker_info:
-                current_price = float(ticker_info.get("current_price", 0.0))
-                opening_price = float(ticker_info.get("opening_price", 0.0))
-            else:
-                stock = stocks_col.find_one({"ticker": ticker})
-                current_price = float(stock.get("price", 0.0)) if stock else 0.0
-                opening_price = current_price
-
-            current_value = shares * current_price
-            opening_value = shares * opening_price
-            portfolio_value += current_value
-            total_invested += current_value
-            total_opening_value += opening_value
-            total_portfolio_change += current_value - opening_value
-            portfolio_stocks[ticker] = shares
-
-    if total_opening_value > 0:
-        total_portfolio_change_pct = (total_portfolio_change / total_opening_value) * 100
-    else:
-        total_portfolio_change_pct = 0.0
+    catalog_version, stocks = stock_catalog.snapshot()
+    summary = get_portfolio_summary() or {
+        "cash": 0.0, "holdings": {}, "market_value": 0.0, "total_value": 0.0,
+        "daily_change": 0.0, "daily_change_percent": 0.0,
+    }
+    cash = summary["cash"]
+    total_invested = summary["market_value"]
+    portfolio_value = summary["total_value"]
+    total_portfolio_change = summary["daily_change"]
+    total_portfolio_change_pct = summary["daily_change_percent"]
+    portfolio_stocks = summary["holdings"]
 
     portfolio = {"cash": cash, "stocks": portfolio_stocks}
     total_return = portfolio_value - total_invested
@@ -354,6 +1490,7 @@ def dashboard():
         total_portfolio_change_pct=total_portfolio_change_pct,
         trade_message=trade_message,
         stocks=stocks,
+        catalog_version=catalog_version,
         cash=cash
     )
 
@@ -370,14 +1507,127 @@ def test_db():
     return "✅ MongoDB connected (ping ok)"
 
 
+@app.route("/health/db")
+def health_db():
+    started = time.perf_counter()
+    try:
+        client.admin.command("ping")
+    except Exception as e:
+        return jsonify({"ok": False, "error": str(e), "pool": pool_metrics.stats()}), 503
+    return jsonify({
+        "ok": True,
+        "ping_ms": round((time.perf_counter() - started) * 1000, 2),
+        "max_pool_size": client.options.pool_options.max_pool_size,
+        "pool": pool_metrics.stats(),
+    })
+
+
+# ----------------------------
+# Trade history
+# ----------------------------
+# Pages are keyset-paginated on (created_at, _id), newest first, so each page
+# is one bounded index range scan no matter how far back the user goes.
+TRADE_HISTORY_PAGE_SIZE = int(os.getenv("TRADE_HISTORY_PAGE_SIZE", "50"))
+TRADE_HISTORY_SORT = [("created_at", -1), ("_id", -1)]
+TRADE_EXPORT_FIELDS = (
+    "created_at", "type", "company", "ticker", "shares", "price",
+    "total_proceeds", "status", "order_type", "trigger_price", "executed_at",
+)
+
+def encode_history_cursor(order) -> str:
+    return f"{order['created_at'].isoformat()}_{order['_id']}"
+
+def decode_history_cursor(cursor: str):
+    try:
+        created_at, order_id = cursor.rsplit("_", 1)
+        return datetime.fromisoformat(created_at), ObjectId(order_id)
+    except Exception:
+        return None
+
+def trade_history_page(user_id, cursor=None, limit: int = TRADE_HISTORY_PAGE_SIZE):
+    query = {"user_id": user_id}
+    position = decode_history_cursor(cursor) if cursor else None
+    if position:
+        created_at, order_id = position
+        query["$or"] = [
+            {"created_at": {"$lt": created_at}},
+            {"created_at": created_at, "_id": {"$lt": order_id}},
+        ]
+    orders = list(trades_col.find(query).sort(TRADE_HISTORY_SORT).limit(limit + 1))
+    next_cursor = encode_history_cursor(orders[limit - 1]) if len(orders) > limit else None
+    return orders[:limit], next_cursor
+
+def trade_counts(user_id) -> dict:
+    counts = {"total": 0, "buy": 0, "sell": 0}
+    for row in trades_col.aggregate([
+        {"$match": {"user_id": user_id}},
+        {"$group": {"_id": "$type", "count": {"$sum": 1}}},
+    ]):
+        counts["total"] += row["count"]
+        if row["_id"] in counts:
+            counts[row["_id"]] = row["count"]
+    return counts
+
+def export_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, ObjectId):
+        return str(value)
+    return value
+
+def export_trade_rows(user_id, fmt: str):
+    cursor = trades_col.find({"user_id": user_id}, {field: 1 for field in TRADE_EXPORT_FIELDS}).sort(TRADE_HISTORY_SORT).batch_size(500)
+    if fmt == "ndjson":
+        for order in cursor:
+            yield json.dumps({field: export_value(order.get(field)) for field in TRADE_EXPORT_FIELDS}) + "\n"
+        return
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(TRADE_EXPORT_FIELDS)
+    for order in cursor:
+        writer.writerow([export_value(order.get(field)) if order.get(field) is not None else "" for field in TRADE_EXPORT_FIELDS])
+        if buffer.tell() >= 16384:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
 @app.route("/trade-history")
 def trade_history():
     if "user_id" not in session:
         return redirect(url_for("login_page"))
 
     user_id = ObjectId(session["user_id"])
-    orders = list(trades_col.find({"user_id": user_id}).sort("created_at", -1))
-    return render_template("trade_history.html", orders=orders)
+    cursor = request.args.get("before")
+    orders, next_cursor = trade_history_page(user_id, cursor)
+    counts = trade_counts(user_id)
+    return render_template(
+        "trade_history.html",
+        orders=orders,
+        counts=counts,
+        next_cursor=next_cursor,
+        paged=bool(cursor),
+    )
+
+
+@app.route("/trade-history/export")
+def trade_history_export():
+    if "user_id" not in session:
+        return redirect(url_for("login_page"))
+
+    fmt = request.args.get("format", "csv").lower()
+    if fmt not in ("csv", "ndjson"):
+        return jsonify({"error": "format must be csv or ndjson"}), 400
+
+    user_id = ObjectId(session["user_id"])
+    mimetype = "text/csv" if fmt == "csv" else "application/x-ndjson"
+    return Response(
+        stream_with_context(export_trade_rows(user_id, fmt)),
+        mimetype=mimetype,
+        headers={"Content-Disposition": f"attachment; filename=trade-history.{fmt}"},
+    )
 
 
 @app.route("/buy", methods=["GET", "POST"])
@@ -397,17 +1647,29 @@ def buy():
         try:
             shares = int(shares_raw)
             price = float(price_raw)
-            if shares <= 0 or price <= 0:
+            if shares <= 0 or not math.isfinite(price) or price <= 0:
                 raise ValueError()
         except ValueError:
             return render_template("buy.html", cash=cash, error="Invalid shares or price.")
 
+        order_type, trigger_price = parse_resting_order()
+        if order_type != "market":
+            if trigger_price is None:
+                return render_template("buy.html", cash=cash, error="Invalid limit or stop price.")
+            if shares * trigger_price > cash:
+                return render_template("buy.html", cash=cash, error="Insufficient funds.")
+            stock = stock_catalog.get(ticker)
+            if not stock:
+                return render_template("buy.html", cash=cash, error="Stock not found.")
+            place_resting_order(ObjectId(session["user_id"]), "buy", company, ticker, shares, order_type, trigger_price)
+            return render_template("buy.html", cash=cash, success=True, resting=order_type)
+
         total_cost = shares * price
 
         if total_cost > cash:
             return render_template("buy.html", cash=cash, error="Insufficient funds.")
 
-        stock = stocks_col.find_one({"ticker": ticker})
+        stock = stock_catalog.get(ticker)
         if not stock:
             return render_template("buy.html", cash=cash, error="Stock not found.")
 
@@ -440,22 +1702,23 @@ def buy():
             })
             return render_template("buy.html", cash=cash, success=True, pending=True)
 
-        users_col.update_one(
-            {"_id": user_id},
-            {"$inc": {"cash": -total_cost, f"holdings.{ticker}": shares}}
-        )
-
-        trades_col.insert_one({
-            "user_id": user_id,
-            "type": "buy",
-            "company": company,
-            "ticker": ticker,
-            "shares": shares,
-            "price": price,
-            "total_proceeds": total_cost,
-            "status": "completed",
-            "created_at": datetime.utcnow()
-        })
+        try:
+            execute_trade(user_id, "buy", ticker, shares, total_cost, {
+                "user_id": user_id,
+                "type": "buy",
+                "company": company,
+                "ticker": ticker,
+                "shares": shares,
+                "price": price,
+                "total_proceeds": total_cost,
+                "status": "completed",
+                "created_at": datetime.utcnow()
+            })
+        except TradeRejected:
+            invalidate_current_user()
+            return render_template("buy.html", cash=get_current_cash(default=0.0), error="Insufficient funds.")
+        invalidate_current_user()
+        record_trade(user_id, ticker, shares, -total_cost)
 
         return render_template("buy.html", cash=cash - total_cost, success=True)
 
@@ -467,18 +1730,7 @@ def sell():
     if "user_id" not in session:
         return redirect(url_for("login_page"))
 
-    holdings = get_current_holdings()
-    portfolio = {}
-
-    for ticker, shares in holdings.items():
-        if shares > 0:
-            stock = stocks_col.find_one({"ticker": ticker})
-            if stock:
-                portfolio[ticker] = {
-                    "company": stock.get("name", ticker),
-                    "shares": shares
-                }
-
+    portfolio = sellable_positions(get_current_holdings())
     return render_template("sell.html", portfolio=portfolio)
 
 
@@ -496,7 +1748,7 @@ def sell_post():
     try:
         shares = int(shares_raw)
         price = float(price_raw)
-        if shares <= 0 or price <= 0:
+        if shares <= 0 or not math.isfinite(price) or price <= 0:
             raise ValueError()
     except ValueError:
         return redirect(url_for("sell"))
@@ -504,10 +1756,20 @@ def sell_post():
     if ticker not in holdings or holdings[ticker] < shares:
         return redirect(url_for("sell"))
 
-    stock = stocks_col.find_one({"ticker": ticker})
+    stock = stock_catalog.get(ticker)
     if not stock:
         return redirect(url_for("sell"))
 
+    order_type, trigger_price = parse_resting_order()
+    if order_type != "market":
+        if trigger_price is None:
+            return redirect(url_for("sell"))
+        place_resting_order(
+            ObjectId(session["user_id"]), "sell", stock.get("name", ticker), ticker, shares, order_type, trigger_price
+        )
+        portfolio = sellable_positions(holdings)
+        return render_template("sell.html", portfolio=portfolio, success=True, resting=order_type)
+
     total_proceeds = shares * price
 
     if not is_market_open() and not pending_confirm:
@@ -518,12 +1780,7 @@ def sell_post():
             "price": price,
             "total_proceeds": total_proceeds,
         }
-        portfolio = {}
-        for t, s in holdings.items():
-            if s > 0:
-                stock_info = stocks_col.find_one({"ticker": t})
-                if stock_info:
-                    portfolio[t] = {"company": stock_info.get("name", t), "shares": s}
+        portfolio = sellable_positions(holdings)
         return render_template("sell.html", portfolio=portfolio, market_closed=True, pending_data=pending_data)
 
     user_id = ObjectId(session["user_id"])
@@ -543,35 +1800,50 @@ def sell_post():
             "created_at": datetime.utcnow(),
             "pending_at": datetime.utcnow()
         })
-        portfolio = {}
-        for t, s in holdings.items():
-            if s > 0:
-                stock_info = stocks_col.find_one({"ticker": t})
-                if stock_info:
-                    portfolio[t] = {"company": stock_info.get("name", t), "shares": s}
+        portfolio = sellable_positions(holdings)
         return render_template("sell.html", portfolio=portfolio, success=True, pending=True)
 
     user_id = ObjectId(session["user_id"])
-    users_col.update_one(
-        {"_id": user_id},
-        {"$inc": {"cash": total_proceeds, f"holdings.{ticker}": -shares}}
-    )
-
-    trades_col.insert_one({
-        "user_id": user_id,
-        "type": "sell",
-        "company": stock.get("name", ticker),
-        "ticker": ticker,
-        "shares": shares,
-        "price": price,
-        "total_proceeds": total_proceeds,
-        "status": "completed",
-        "created_at": datetime.utcnow()
-    })
+    try:
+        execute_trade(user_id, "sell", ticker, shares, total_proceeds, {
+            "user_id": user_id,
+            "type": "sell",
+            "company": stock.get("name", ticker),
+            "ticker": ticker,
+            "shares": shares,
+            "price": price,
+            "total_proceeds": total_proceeds,
+            "status": "completed",
+            "created_at": datetime.utcnow()
+        })
+    except TradeRejected:
+        return redirect(url_for("sell"))
+    invalidate_current_user()
+    record_trade(user_id, ticker, -shares, total_proceeds)
 
     return redirect(url_for("sell"))
 
 
+@app.route("/orders/cancel", methods=["POST"])
+def cancel_order():
+    if "user_id" not in session:
+        return redirect(url_for("login_page"))
+
+    try:
+        order_id = ObjectId(request.form.get("order_id", ""))
+    except Exception:
+        return redirect(url_for("trade_history"))
+
+    result = trades_col.update_one(
+        {"_id": order_id, "user_id": ObjectId(session["user_id"]), "status": "open"},
+        {"$set": {"status": "cancelled", "cancelled_at": datetime.utcnow()}}
+    )
+    if result.modified_count:
+        order_book.cancel(order_id)
+
+    return redirect(url_for("trade_history"))
+
+
 @app.route("/wallet")
 def wallet():
     if "user_id" not in session:
@@ -580,12 +1852,8 @@ def wallet():
     cash = get_current_cash(default=0.0)
     holdings = get_current_holdings()
 
-    stock_value = 0.0
-    for ticker, shares in holdings.items():
-        if shares > 0:
-            stock = stocks_col.find_one({"ticker": ticker})
-            if stock:
-                stock_value += shares * stock.get("price", 0.0)
+    # Valued at live prices, same as the dashboard
+    stock_value = sum(position["value"] for position in value_portfolio(holdings).values())
 
     total_value = cash + stock_value
     return render_template("wallet.html", cash=cash, stock_value=stock_value, total_value=total_value)
@@ -609,6 +1877,8 @@ def wallet_deposit():
         {"_id": ObjectId(session["user_id"])},
         {"$inc": {"cash": amount}}
     )
+    invalidate_current_user()
+    record_trade(session["user_id"], cash=amount)
 
     return redirect(url_for("wallet"))
 
@@ -632,10 +1902,14 @@ def wallet_withdraw():
     if amount > cash:
         return redirect(url_for("wallet"))
 
-    users_col.update_one(
-        {"_id": ObjectId(session["user_id"])},
+    # Guarded so two concurrent withdrawals cannot both pass the check above
+    result = users_col.update_one(
+        {"_id": ObjectId(session["user_id"]), "cash": {"$gte": amount}},
         {"$inc": {"cash": -amount}}
     )
+    invalidate_current_user()
+    if result.modified_count:
+        record_trade(session["user_id"], cash=-amount)
 
     return redirect(url_for("wallet"))
 
@@ -647,6 +1921,10 @@ def help_page():
     return render_template("help.html")
 
 
+def render_admin(**context):
+    catalog_version, stocks = stock_catalog.snapshot()
+    return render_template("admin.html", stocks=stocks, catalog_version=catalog_version, **context)
+
 @app.route("/admin", methods=["GET", "POST"])
 def admin():
     if "user_id" not in session:
@@ -661,14 +1939,17 @@ def admin():
         price_raw = request.form.get("price", "").strip()
 
         if not ticker or not name or not price_raw:
-            return render_template("admin.html", error="All fields are required.")
+            return render_admin(error="All fields are required.")
+
+        if not TICKER_PATTERN.fullmatch(ticker):
+            return render_admin(error=f"Ticker must be 1-{TICKER_BYTES} letters, digits, dots or dashes.")
 
         try:
             price = float(price_raw)
             if price <= 0:
                 raise ValueError()
         except ValueError:
-            return render_template("admin.html", error="Price must be a positive number.")
+            return render_admin(error="Price must be a positive number.")
 
         stocks_col.update_one(
             {"ticker": ticker},
@@ -678,23 +1959,11 @@ def admin():
             },
             upsert=True
         )
-
-        with ticker_lock:
-            if ticker not in ticker_state:
-                ticker_state[ticker] = {
-                    "ticker": ticker,
-                    "current_price": price,
-                    "opening_price": price,
-                    "daily_high": price,
-                    "daily_low": price,
-                    "daily_change": 0.0,
-                    "daily_change_percent": 0.0,
-                }
+        refresh_market_catalog()
 
         return redirect(url_for("admin"))
 
-    stocks = list(stocks_col.find({}, {"_id": 0}).sort("ticker", 1))
-    return render_template("admin.html", stocks=stocks)
+    return render_admin()
 
 @app.route("/admin/delete", methods=["POST"])
 def delete_stock():
@@ -707,11 +1976,9 @@ def delete_stock():
     ticker = request.form.get("ticker", "").strip().upper()
     if ticker:
         stocks_col.delete_one({"ticker": ticker})
-        with ticker_lock:
-            ticker_state.pop(ticker, None)
+        refresh_market_catalog()
 
-    stocks = list(stocks_col.find({}, {"_id": 0}).sort("ticker", 1))
-    return render_template("admin.html", stocks=stocks, success=True)
+    return render_admin(success=True)
 
 
 # ----------------------------
@@ -720,14 +1987,121 @@ def delete_stock():
 
 @app.route("/api/ticker")
 def api_ticker():
-    data = get_ticker_data()
+    snapshot = get_ticker_snapshot()
+
+    since = request.args.get("since")
+    if since:
+        delta = get_ticker_delta(snapshot, since)
+        if delta is not None:
+            response = Response(delta, mimetype="application/json")
+            response.headers["Cache-Control"] = "no-store"
+            return response
+
+    gzipped = "gzip" in request.accept_encodings
+    etag = snapshot.gzip_etag if gzipped else snapshot.etag
+    if etag in request.if_none_match:
+        response = Response(status=304)
+    elif gzipped:
+        response = Response(snapshot.gzip_body, mimetype="application/json")
+        response.headers["Content-Encoding"] = "gzip"
+    else:
+        response = Response(snapshot.body, mimetype="application/json")
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["Vary"] = "Accept-Encoding"
+    return response
+
+
+@app.route("/api/quote/<ticker>")
+def api_quote(ticker):
+    quote = get_quote(ticker.strip().upper())
+    if quote is None:
+        return jsonify({"error": "Stock not found"}), 404
+    return jsonify(quote)
+
+
+@app.route("/api/history/<ticker>")
+def api_history(ticker):
+    ticker = ticker.strip().upper()
+    interval = request.args.get("interval", "1m")
+    if interval not in INTERVALS:
+        return jsonify({"error": f"interval must be one of {', '.join(INTERVALS)}"}), 400
+    try:
+        start = parse_history_time(request.args.get("start"))
+        end = parse_history_time(request.args.get("end"))
+    except ValueError:
+        return jsonify({"error": "start and end must be ISO 8601 times"}), 400
+    try:
+        limit = min(max(int(request.args.get("limit", "500")), 1), HISTORY_MAX_BARS)
+    except ValueError:
+        return jsonify({"error": "limit must be an integer"}), 400
+    if not stock_catalog.get(ticker):
+        return jsonify({"error": "Stock not found"}), 404
+
+    bars = get_price_bars(ticker, interval, start, end, limit)
     return jsonify({
-        "market_open": is_market_open(),
-        "stocks": data
+        "ticker": ticker,
+        "interval": interval,
+        "bars": [{**bar, "start": bar["start"].isoformat() + "Z"} for bar in bars],
     })
 
 
-if __name__ == "__main__":
+@app.route("/api/portfolio")
+def api_portfolio():
+    if "user_id" not in session:
+        return jsonify({"error": "Not logged in"}), 401
+    summary = get_portfolio_summary()
+    if summary is None:
+        return jsonify({"error": "User not found"}), 404
+    return jsonify(summary)
+
+
+@app.route("/metrics")
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+@app.route("/api/ticker/stream")
+def api_ticker_stream():
+    if ticker_broadcaster.latest is None:
+        get_ticker_snapshot()
+    subscriber = ticker_broadcaster.subscribe()
+
+    def generate():
+        try:
+            while True:
+                try:
+                    yield subscriber.get(timeout=STREAM_KEEPALIVE_SECONDS)
+                except queue.Empty:
+                    yield b": keepalive\n\n"
+        finally:
+            ticker_broadcaster.unsubscribe(subscriber)
+
+    return Response(
+        generate(),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+def start_background_services():
+    # Only processes that run the market save it on exit; the password hasher's
+    # spawned workers import this module too and must not
+    atexit.register(checkpoint_market, True)
+    atexit.register(price_history.flush, True)
+    ensure_indexes()
     initialize_ticker_state()
+    publish_ticker_update()
+    initialize_order_book()
+    start_catalog_watch()
+    start_settlement_thread()
     start_price_thread()
-    app.run(debug=True)
\ No newline at end of file
+
+
+if __name__ == "__main__":
+    # The debug reloader runs this file twice: a watcher process that only
+    # restarts the server and the child that serves. Only the child may run
+    # the market, or two of them would share the checkpoint and tick log.
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        start_background_services()
+    app.run(debug=True, use_reloader=True)
\ No newline at end of file
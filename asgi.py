@@ -0,0 +1,256 @@
+import asyncio
+import os
+import time
+from urllib.parse import parse_qs
+
+from a2wsgi import WSGIMiddleware
+from bson import ObjectId
+from bson.errors import InvalidId
+from itsdangerous import BadSignature
+from motor.motor_asyncio import AsyncIOMotorClient
+from werkzeug.http import parse_cookie
+
+import app as trading
+
+# ----------------------------
+# Async API tier
+# ----------------------------
+# ASGI entry point: uvicorn asgi:app. The read-heavy JSON endpoints and the
+# ticker stream are served by coroutines straight from this process's market
+# state (the same engine, snapshot and portfolio book the Flask routes use),
+# so thousands of pollers or SSE clients cost no threads. Portfolio cache
+# misses read the user through motor. Every other request goes to the Flask
+# app on a thread pool of WSGI_WORKERS.
+#
+# Each uvicorn worker runs its own price thread; with --workers > 1 set
+# MARKET_STATE_BACKEND=shm or mongo so only one of them produces prices.
+
+WSGI_WORKERS = int(os.getenv("WSGI_WORKERS", "32"))
+
+# Streams cost no threads here, so pages subscribe unless TICKER_STREAM is off
+if trading.TICKER_STREAM == "auto":
+    trading.app.jinja_env.globals["ticker_stream"] = True
+
+
+def header(scope, name: bytes):
+    for key, value in scope["headers"]:
+        if key == name:
+            return value.decode("latin-1")
+    return None
+
+
+def query_arg(scope, name: str, type=str):
+    values = parse_qs(scope["query_string"].decode("latin-1")).get(name)
+    if not values:
+        return None
+    try:
+        return type(values[0])
+    except ValueError:
+        return None
+
+
+def etag_matches(scope, etag: str) -> bool:
+    value = header(scope, b"if-none-match")
+    if not value:
+        return False
+    tags = [tag.strip().removeprefix("W/").strip('"') for tag in value.split(",")]
+    return "*" in tags or etag in tags
+
+
+def session_user_id(scope):
+    # Reads the user out of Flask's signed session cookie, as Flask itself would
+    cookies = parse_cookie(header(scope, b"cookie") or "")
+    value = cookies.get(trading.app.config["SESSION_COOKIE_NAME"])
+    serializer = trading.app.session_interface.get_signing_serializer(trading.app)
+    if not value or serializer is None:
+        return None
+    try:
+        data = serializer.loads(value, max_age=int(trading.app.permanent_session_lifetime.total_seconds()))
+    except BadSignature:
+        return None
+    return data.get("user_id")
+
+
+async def respond(send, status: int, body: bytes = b"", content_type=b"application/json", headers=()):
+    response_headers = [(b"content-length", str(len(body)).encode())]
+    if body:
+        response_headers.append((b"content-type", content_type))
+    await send({"type": "http.response.start", "status": status, "headers": response_headers + list(headers)})
+    await send({"type": "http.response.body", "body": body})
+    return status
+
+
+async def respond_json(send, status: int, payload):
+    return await respond(send, status, trading.app.json.dumps(payload).encode("utf-8"))
+
+
+async def ticker_snapshot():
+    # Building a snapshot takes the market lock and may read the price board
+    # or Mongo, so only that rare rebuild leaves the event loop
+    return trading.published_ticker_snapshot() or await asyncio.to_thread(trading.get_ticker_snapshot)
+
+
+class StreamSubscriber:
+    # Broadcaster subscriber for one SSE client. The price thread hands frames
+    # to the event loop, which keeps only the newest STREAM_QUEUE_SIZE.
+    def __init__(self, loop):
+        self.loop = loop
+        self.frames = asyncio.Queue(maxsize=trading.STREAM_QUEUE_SIZE)
+
+    def put_nowait(self, payload: bytes):
+        try:
+            self.loop.call_soon_threadsafe(self._offer, payload)
+        except RuntimeError:
+            # loop already closed; the stream's finally block unsubscribes us
+            pass
+
+    def _offer(self, payload: bytes):
+        if self.frames.full():
+            self.frames.get_nowait()
+        self.frames.put_nowait(payload)
+
+
+class AsyncAPI:
+    def __init__(self, fallback):
+        self.fallback = fallback
+        self.mongo = None
+        self.users = None
+        # path -> (handler, route label); /api/quote/<ticker> is matched by prefix
+        self.routes = {
+            "/api/ticker": (self.ticker, "/api/ticker"),
+            "/api/ticker/stream": (self.ticker_stream, "/api/ticker/stream"),
+            "/api/portfolio": (self.portfolio, "/api/portfolio"),
+        }
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            return await self.lifespan(receive, send)
+        if scope["type"] == "http" and scope["method"] == "GET":
+            path = scope["path"]
+            handler, route = self.routes.get(path, (None, None))
+            args = ()
+            if handler is None and path.startswith("/api/quote/") and "/" not in path[len("/api/quote/"):]:
+                handler, route, args = self.quote, "/api/quote/<ticker>", (path[len("/api/quote/"):],)
+            if handler is not None:
+                started = time.perf_counter()
+                status = await handler(scope, receive, send, *args)
+                trading.request_tracer.requests.inc(route=route, method="GET", status=status)
+                if handler is not self.ticker_stream:
+                    trading.request_tracer.duration.observe(time.perf_counter() - started, route=route)
+                return
+        await self.fallback(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                try:
+                    await asyncio.to_thread(trading.start_background_services)
+                    self.users_collection()
+                except Exception as exc:
+                    await send({"type": "lifespan.startup.failed", "message": str(exc)})
+                    return
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                if self.mongo is not None:
+                    self.mongo.close()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    def users_collection(self):
+        # Made at startup, or on first use when the server runs with lifespan off
+        if self.users is None:
+            self.mongo = AsyncIOMotorClient(
+                trading.MONGO_URI,
+                event_listeners=[trading.slow_queries, trading.command_metrics],
+                **trading.mongo_client_options(),
+            )
+            self.users = self.mongo[trading.db.name]["users"]
+        return self.users
+
+    async def ticker(self, scope, receive, send):
+        snapshot = await ticker_snapshot()
+
+        since = query_arg(scope, "since")
+        if since:
+            delta = trading.get_ticker_delta(snapshot, since)
+            if delta is not None:
+                return await respond(send, 200, delta, headers=[(b"cache-control", b"no-store")])
+
+        gzipped = "gzip" in (header(scope, b"accept-encoding") or "")
+        etag = snapshot.gzip_etag if gzipped else snapshot.etag
+        headers = [
+            (b"etag", f'"{etag}"'.encode()),
+            (b"cache-control", b"no-cache"),
+            (b"vary", b"Accept-Encoding"),
+        ]
+        if etag_matches(scope, etag):
+            return await respond(send, 304, headers=headers)
+        if gzipped:
+            return await respond(send, 200, snapshot.gzip_body, headers=headers + [(b"content-encoding", b"gzip")])
+        return await respond(send, 200, snapshot.body, headers=headers)
+
+    async def quote(self, scope, receive, send, ticker):
+        # Served from the published snapshot (at most a tick old) rather than
+        # get_quote, which takes the market lock or reads the board
+        snapshot = await ticker_snapshot()
+        row = snapshot.rows.get(ticker.strip().upper())
+        if row is None:
+            return await respond_json(send, 404, {"error": "Stock not found"})
+        return await respond_json(send, 200, {**row, "market_open": snapshot.market_open})
+
+    async def portfolio(self, scope, receive, send):
+        user_id = session_user_id(scope)
+        if not user_id:
+            return await respond_json(send, 401, {"error": "Not logged in"})
+
+        summary = trading.portfolio_book.get(user_id)
+        if summary is None:
+            try:
+                user = await self.users_collection().find_one(
+                    {"_id": ObjectId(user_id)}, dict.fromkeys(trading.TRADING_FIELDS, 1))
+            except InvalidId:
+                user = None
+            if not user:
+                return await respond_json(send, 404, {"error": "User not found"})
+            # Pricing may consult the stock catalog, which can block on a reload
+            summary = await asyncio.to_thread(trading.load_portfolio_summary, user_id, user)
+        return await respond_json(send, 200, trading.portfolio_totals(summary))
+
+    async def ticker_stream(self, scope, receive, send):
+        if trading.ticker_broadcaster.latest is None:
+            await ticker_snapshot()
+        subscriber = trading.ticker_broadcaster.attach(StreamSubscriber(asyncio.get_running_loop()))
+        disconnected = asyncio.ensure_future(self.wait_for_disconnect(receive))
+        try:
+            await send({"type": "http.response.start", "status": 200, "headers": [
+                (b"content-type", b"text/event-stream; charset=utf-8"),
+                (b"cache-control", b"no-cache"),
+                (b"x-accel-buffering", b"no"),
+            ]})
+            while True:
+                next_frame = asyncio.ensure_future(subscriber.frames.get())
+                await asyncio.wait(
+                    (next_frame, disconnected), timeout=trading.STREAM_KEEPALIVE_SECONDS,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                if disconnected.done():
+                    next_frame.cancel()
+                    break
+                if next_frame.done():
+                    frame = next_frame.result()
+                else:
+                    next_frame.cancel()
+                    frame = b": keepalive\n\n"
+                await send({"type": "http.response.body", "body": frame, "more_body": True})
+        finally:
+            trading.ticker_broadcaster.unsubscribe(subscriber)
+            disconnected.cancel()
+        return 200
+
+    async def wait_for_disconnect(self, receive):
+        while (await receive())["type"] != "http.disconnect":
+            pass
+
+
+app = AsyncAPI(WSGIMiddleware(trading.app, workers=WSGI_WORKERS))
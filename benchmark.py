@@ -0,0 +1,340 @@
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import bcrypt
+import pymongo
+from pymongo import monitoring
+
+# ----------------------------
+# Route benchmarks
+# ----------------------------
+# Seeds a throwaway database, drives the hot routes through Flask's test client
+# from a pool of threads and reports latency percentiles, throughput and Mongo
+# operations per request. Runs against mongomock by default (pip install -r
+# requirements-dev.txt) or a real server with --mongo mongodb://localhost:27017,
+# in its own --db. It refuses to wipe a database that holds data it did not
+# seed itself, unless --force.
+#
+#   python benchmark.py --users 200 --stocks 500 --trades 20000 --save-baseline
+#   python benchmark.py --compare          # exits 1 if a scenario regressed
+
+BASELINE_PATH = os.path.join("data", "benchmark_baseline.json")
+BENCHMARK_DB = "stock_trading_app_401_benchmark"
+SEEDED_COLLECTIONS = ("users", "stocks", "trades", "price_bars", "leases", "market_state")
+MOCK_OPS = (
+    "find", "find_one", "insert_one", "insert_many", "update_one", "update_many", "replace_one",
+    "delete_one", "delete_many", "bulk_write", "aggregate", "count_documents", "find_one_and_update",
+)
+
+# Per thread for routes; settlement fans out to a pool, so it reads the total
+op_counts = threading.local()
+total_ops = [0]
+total_ops_lock = threading.Lock()
+
+
+def count_op():
+    op_counts.value = getattr(op_counts, "value", 0) + 1
+    with total_ops_lock:
+        total_ops[0] += 1
+
+
+class OpCounter(monitoring.CommandListener):
+    # Command events fire on the thread that issued the command
+    def started(self, event):
+        if event.command_name not in ("hello", "isMaster", "ping", "endSessions"):
+            count_op()
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+def use_mongomock():
+    import mongomock
+
+    def counted(method):
+        def wrapper(*args, **kwargs):
+            count_op()
+            return method(*args, **kwargs)
+        return wrapper
+
+    for name in MOCK_OPS:
+        setattr(mongomock.collection.Collection, name, counted(getattr(mongomock.collection.Collection, name)))
+    pymongo.MongoClient = mongomock.MongoClient
+
+
+def load_app(mongo: str, db_name: str):
+    # The app connects at import time, so the stand-in has to be in place first
+    if mongo == "mock":
+        use_mongomock()
+        os.environ["MONGO_URI"] = "mongodb://localhost:27017"
+        os.environ.setdefault("MONGO_TRANSACTIONS", "off")
+    else:
+        monitoring.register(OpCounter())
+        os.environ["MONGO_URI"] = mongo
+    os.environ["MONGO_DB"] = db_name
+    os.environ["MARKET_CHECKPOINT_PATH"] = ""
+    os.environ["PRICE_HISTORY_DIR"] = ""
+    os.environ["SLOW_QUERY_MS"] = "0"
+    import app
+    return app
+
+
+def seed(app, users: int, stocks: int, trades: int, rng: random.Random):
+    db = app.db
+    for name in SEEDED_COLLECTIONS:
+        db[name].delete_many({})
+    db.benchmark_meta.replace_one({"_id": "seeded"}, {"at": datetime.utcnow()}, upsert=True)
+    app.ensure_indexes()
+
+    tickers = [f"T{i:04d}" for i in range(stocks)]
+    db.stocks.insert_many([
+        {"ticker": t, "name": f"{t} Corp", "price": round(rng.uniform(5, 500), 2)} for t in tickers
+    ])
+
+    password_hash = bcrypt.hashpw(b"benchmark", bcrypt.gensalt(4))
+    user_docs = []
+    for i in range(users):
+        holdings = {t: rng.randint(50, 500) for t in rng.sample(tickers, min(10, stocks))}
+        user_docs.append({
+            "username": f"bench{i}", "email": f"bench{i}@example.com", "full_name": f"Bench {i}",
+            "password_hash": password_hash, "role": "user", "cash": 1_000_000.0, "holdings": holdings,
+        })
+    user_ids = db.users.insert_many(user_docs).inserted_ids
+
+    start = datetime.utcnow() - timedelta(days=30)
+    batch = []
+    for i in range(trades):
+        ticker = rng.choice(tickers)
+        shares = rng.randint(1, 20)
+        price = round(rng.uniform(5, 500), 2)
+        batch.append({
+            "user_id": rng.choice(user_ids), "type": rng.choice(("buy", "sell")), "company": f"{ticker} Corp",
+            "ticker": ticker, "shares": shares, "price": price, "total_proceeds": round(shares * price, 2),
+            "status": "completed", "created_at": start + timedelta(seconds=i * 30),
+        })
+        if len(batch) == 5000:
+            db.trades.insert_many(batch)
+            batch = []
+    if batch:
+        db.trades.insert_many(batch)
+
+    app.is_market_open = lambda: True
+    app.initialize_ticker_state()
+    app.initialize_order_book()
+    app.publish_ticker_update()
+    return user_ids, tickers
+
+
+def seed_pending(app, user_ids, tickers, count: int, rng: random.Random):
+    now = datetime.utcnow()
+    docs = []
+    for i in range(count):
+        ticker = rng.choice(tickers)
+        docs.append({
+            "user_id": rng.choice(user_ids), "type": "buy", "company": f"{ticker} Corp", "ticker": ticker,
+            "shares": rng.randint(1, 5), "price": 1.0, "status": "pending", "created_at": now + timedelta(microseconds=i),
+        })
+    if docs:
+        app.trades_col.insert_many(docs)
+
+
+def route_scenarios(tickers):
+    # Each call gets the test client and the logged-in user's context
+    return {
+        "dashboard": lambda c, user: c.get("/dashboard"),
+        "api_ticker": lambda c, user: c.get("/api/ticker"),
+        "buy": lambda c, user: c.post("/buy", data={
+            "company": "Bench", "ticker": random.choice(tickers), "shares": "1", "price": "1"}),
+        "sell_post": lambda c, user: c.post("/sell_post", data={
+            "ticker": random.choice(user["tickers"]), "shares": "1", "price": "1"}),
+        "trade_history": lambda c, user: c.get("/trade-history"),
+    }
+
+
+def percentile(samples, pct: float) -> float:
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    k = min(len(ordered) - 1, max(0, int(round(pct / 100 * (len(ordered) - 1)))))
+    return ordered[k]
+
+
+def summarize(latencies, ops, errors, elapsed):
+    n = len(latencies)
+    return {
+        "requests": n,
+        "errors": errors,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+        "mean_ms": round(sum(latencies) / n * 1000, 3) if n else 0.0,
+        "throughput_rps": round(n / elapsed, 1) if elapsed else 0.0,
+        "mongo_ops_per_request": round(sum(ops) / n, 2) if n else 0.0,
+    }
+
+
+def run_route(app, name, call, user_ids, requests: int, concurrency: int):
+    latencies, ops = [], []
+    errors = 0
+    lock = threading.Lock()
+    local = threading.local()
+
+    def client():
+        c = getattr(local, "client", None)
+        if c is None:
+            uid = random.choice(user_ids)
+            c = app.app.test_client()
+            with c.session_transaction() as s:
+                s["user_id"] = str(uid)
+                s["username"] = "bench"
+            holdings = app.users_col.find_one({"_id": uid}, {"holdings": 1}).get("holdings") or {}
+            local.client, local.user = c, {"id": uid, "tickers": list(holdings)}
+        return c, local.user
+
+    def one(_):
+        nonlocal errors
+        c, user = client()
+        op_counts.value = 0
+        started = time.perf_counter()
+        try:
+            status = call(c, user).status_code
+        except Exception:
+            status = 500
+        elapsed = time.perf_counter() - started
+        with lock:
+            latencies.append(elapsed)
+            ops.append(op_counts.value)
+            if status >= 400:
+                errors += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(requests)))
+    return summarize(latencies, ops, errors, time.perf_counter() - started)
+
+
+def run_settlement(app, user_ids, tickers, orders: int, rounds: int, rng: random.Random):
+    latencies, ops = [], []
+    started = time.perf_counter()
+    for _ in range(rounds):
+        seed_pending(app, user_ids, tickers, orders, rng)
+        ops_before = total_ops[0]
+        t0 = time.perf_counter()
+        app.process_pending_orders()
+        latencies.append(time.perf_counter() - t0)
+        ops.append(total_ops[0] - ops_before)
+    result = summarize(latencies, ops, 0, time.perf_counter() - started)
+    result["orders_per_round"] = orders
+    return result
+
+
+def compare(results, baseline, tolerance: float):
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        if result["p99_ms"] > base["p99_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p99 {result['p99_ms']} ms vs baseline {base['p99_ms']} ms")
+        if result["throughput_rps"] < base["throughput_rps"] * (1 - tolerance):
+            regressions.append(f"{name}: {result['throughput_rps']} req/s vs baseline {base['throughput_rps']} req/s")
+        if result["mongo_ops_per_request"] > base["mongo_ops_per_request"] + 0.5:
+            regressions.append(
+                f"{name}: {result['mongo_ops_per_request']} Mongo ops/request vs baseline {base['mongo_ops_per_request']}")
+    return regressions
+
+
+def print_table(results):
+    columns = ("requests", "errors", "p50_ms", "p99_ms", "mean_ms", "throughput_rps", "mongo_ops_per_request")
+    print(f"{'scenario':<16}" + "".join(f"{c:>22}" for c in columns))
+    for name, result in results.items():
+        print(f"{name:<16}" + "".join(f"{result[c]:>22}" for c in columns))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the trading app's hot routes")
+    parser.add_argument("--mongo", default="mock", help="'mock' for mongomock, or a MongoDB URI")
+    parser.add_argument("--db", default=BENCHMARK_DB, help="database to seed; it is wiped on every run")
+    parser.add_argument("--force", action="store_true", help="wipe --db even if it holds data the benchmark did not seed")
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--stocks", type=int, default=200)
+    parser.add_argument("--trades", type=int, default=10000)
+    parser.add_argument("--requests", type=int, default=300, help="requests per route")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--settle-orders", type=int, default=200, help="pending orders per settlement round")
+    parser.add_argument("--settle-rounds", type=int, default=5)
+    parser.add_argument("--only", nargs="*", help="scenarios to run (default: all)")
+    parser.add_argument("--seed", type=int, default=401)
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--compare", action="store_true", help="exit 1 if a scenario regressed past --tolerance")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    random.seed(args.seed)
+    if args.mongo != "mock" and not args.force:
+        probe = pymongo.MongoClient(args.mongo, serverSelectionTimeoutMS=5000)
+        try:
+            existing = set(probe[args.db].list_collection_names()) & set(SEEDED_COLLECTIONS)
+            has_data = any(probe[args.db][name].estimated_document_count() for name in existing)
+            ours = probe[args.db].benchmark_meta.find_one({"_id": "seeded"}) is not None
+        finally:
+            probe.close()
+        if has_data and not ours:
+            print(f"Database {args.db!r} holds data the benchmark did not seed; pass --force or pick another --db")
+            return 2
+
+    app = load_app(args.mongo, args.db)
+    user_ids, tickers = seed(app, args.users, args.stocks, args.trades, rng)
+
+    results = {}
+    for name, call in route_scenarios(tickers).items():
+        if args.only and name not in args.only:
+            continue
+        results[name] = run_route(app, name, call, user_ids, args.requests, args.concurrency)
+    if not args.only or "settlement" in args.only:
+        results["settlement"] = run_settlement(app, user_ids, tickers, args.settle_orders, args.settle_rounds, rng)
+
+    meta = {
+        "mongo": "mock" if args.mongo == "mock" else "server",
+        "users": args.users, "stocks": args.stocks, "trades": args.trades,
+        "concurrency": args.concurrency, "recorded_at": datetime.utcnow().isoformat() + "Z",
+    }
+    if args.json:
+        print(json.dumps({"meta": meta, "results": results}, indent=2))
+    else:
+        print_table(results)
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline) or ".", exist_ok=True)
+        with open(args.baseline, "w") as f:
+            json.dump({"meta": meta, "results": results}, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+
+    if args.compare:
+        try:
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        except FileNotFoundError:
+            print(f"No baseline at {args.baseline}; run with --save-baseline first")
+            return 2
+        regressions = compare(results, baseline["results"], args.tolerance)
+        for line in regressions:
+            print("REGRESSION", line)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
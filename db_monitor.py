@@ -0,0 +1,211 @@
+import logging
+import queue
+import threading
+import time
+
+from pymongo import monitoring
+
+# ----------------------------
+# Mongo command and pool monitoring
+# ----------------------------
+# Listeners for the driver's event API. Command and connection pool events
+# feed the metrics registry (exported at /metrics). Reads and writes slower
+# than `slow_ms` are explained off the request path, and the ones whose
+# winning plan is a collection scan are logged once per (collection, command,
+# filter shape).
+
+logger = logging.getLogger("db_monitor")
+
+EXPLAINABLE = {"find", "aggregate", "count", "distinct", "update", "delete", "findAndModify"}
+DRIVER_FIELDS = {"lsid", "txnNumber", "autocommit", "startTransaction", "writeConcern"}
+COMMAND_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+def command_collection(event) -> str:
+    if event.command_name == "getMore":
+        return str(event.command.get("collection", ""))
+    target = event.command.get(event.command_name)
+    return target if isinstance(target, str) else ""
+
+
+def address_label(address) -> str:
+    return "%s:%s" % address if address else ""
+
+
+def query_shape(value):
+    # Field names without values, so repeated queries collapse into one key
+    if isinstance(value, dict):
+        return tuple(sorted((k, query_shape(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(query_shape(v) for v in value[:1])
+    return None
+
+
+def has_collscan(plan) -> bool:
+    if isinstance(plan, dict):
+        if plan.get("stage") == "COLLSCAN":
+            return True
+        return any(has_collscan(v) for v in plan.values())
+    if isinstance(plan, list):
+        return any(has_collscan(v) for v in plan)
+    return False
+
+
+def winning_plans(explain):
+    if isinstance(explain, dict):
+        for key, value in explain.items():
+            if key == "winningPlan":
+                yield value
+            else:
+                yield from winning_plans(value)
+    elif isinstance(explain, list):
+        for value in explain:
+            yield from winning_plans(value)
+
+
+class SlowQueryListener(monitoring.CommandListener):
+    def __init__(self, slow_ms: float = 100.0, max_pending: int = 100):
+        self.slow_ms = slow_ms
+        self._client = None
+        self._started = {}
+        self._seen = set()
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._thread = None
+
+    def bind(self, client):
+        self._client = client
+        if self.slow_ms > 0 and self._thread is None:
+            self._thread = threading.Thread(target=self._explain_loop, daemon=True)
+            self._thread.start()
+
+    def started(self, event):
+        if self.slow_ms <= 0 or event.command_name not in EXPLAINABLE:
+            return
+        self._started[event.request_id] = (event.database_name, event.command)
+
+    def succeeded(self, event):
+        started = self._started.pop(event.request_id, None)
+        if started is None or event.duration_micros < self.slow_ms * 1000:
+            return
+        database, command = started
+        collection = command.get(event.command_name)
+        body = {k: v for k, v in command.items() if not k.startswith("$") and k not in DRIVER_FIELDS}
+        shape = (database, collection, event.command_name, query_shape(body.get("filter") or body.get("q") or body.get("query") or body.get("pipeline") or body.get("updates") or body.get("deletes")))
+        if shape in self._seen:
+            return
+        self._seen.add(shape)
+        try:
+            self._queue.put_nowait((database, collection, event.command_name, body, event.duration_micros / 1000))
+        except queue.Full:
+            self._seen.discard(shape)
+
+    def failed(self, event):
+        self._started.pop(event.request_id, None)
+
+    def _explain_loop(self):
+        while True:
+            database, collection, name, body, duration_ms = self._queue.get()
+            try:
+                explain = self._client[database].command("explain", body, verbosity="queryPlanner")
+            except Exception as e:
+                logger.debug("Could not explain slow %s on %s: %s", name, collection, e)
+                continue
+            if any(has_collscan(plan) for plan in winning_plans(explain)):
+                logger.warning(
+                    "Slow %s on %s.%s (%.1f ms) used a collection scan: %s",
+                    name, database, collection, duration_ms, body,
+                )
+
+
+class CommandMetricsListener(monitoring.CommandListener):
+    def __init__(self, registry):
+        self.commands = registry.counter(
+            "mongo_commands_total", "MongoDB commands, by collection, command and outcome")
+        self.duration = registry.histogram(
+            "mongo_command_duration_seconds", "MongoDB command round trip time, by collection and command",
+            buckets=COMMAND_BUCKETS)
+        self._lock = threading.Lock()
+        self._started = {}
+
+    def started(self, event):
+        with self._lock:
+            self._started[(event.connection_id, event.request_id)] = command_collection(event)
+
+    def _finish(self, event, outcome):
+        with self._lock:
+            collection = self._started.pop((event.connection_id, event.request_id), "")
+        labels = {"collection": collection, "command": event.command_name}
+        self.commands.inc(outcome=outcome, **labels)
+        self.duration.observe(event.duration_micros / 1e6, **labels)
+
+    def succeeded(self, event):
+        self._finish(event, "ok")
+
+    def failed(self, event):
+        self._finish(event, "error")
+
+
+class PoolMetricsListener(monitoring.ConnectionPoolListener):
+    # Checkout wait is measured from check_out_started to checked_out, which
+    # the driver emits on the thread doing the checkout
+    def __init__(self, registry):
+        self.open = registry.gauge("mongo_pool_connections", "Open connections in the pool, by server")
+        self.in_use = registry.gauge("mongo_pool_checked_out", "Connections checked out of the pool, by server")
+        self.wait = registry.histogram(
+            "mongo_pool_checkout_wait_seconds", "Time spent waiting for a pooled connection",
+            buckets=COMMAND_BUCKETS)
+        self.checkout_failures = registry.counter(
+            "mongo_pool_checkout_failures_total", "Failed connection checkouts, by reason")
+        self.pool_cleared = registry.counter("mongo_pool_cleared_total", "Times a pool was cleared, by server")
+        self._lock = threading.Lock()
+        self._counts = {}
+        self._waiting = {}
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {address: dict(counts) for address, counts in self._counts.items()}
+
+    def _adjust(self, event, key, delta):
+        address = address_label(event.address)
+        with self._lock:
+            counts = self._counts.setdefault(address, {"open": 0, "checked_out": 0})
+            counts[key] += delta
+            value = counts[key]
+        (self.open if key == "open" else self.in_use).set(value, server=address)
+
+    def pool_created(self, event):
+        self._adjust(event, "open", 0)
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        self.pool_cleared.inc(server=address_label(event.address))
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self._adjust(event, "open", 1)
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self._adjust(event, "open", -1)
+
+    def connection_check_out_started(self, event):
+        self._waiting[threading.get_ident()] = time.perf_counter()
+
+    def connection_check_out_failed(self, event):
+        self._waiting.pop(threading.get_ident(), None)
+        self.checkout_failures.inc(reason=str(event.reason))
+
+    def connection_checked_out(self, event):
+        started = self._waiting.pop(threading.get_ident(), None)
+        if started is not None:
+            self.wait.observe(time.perf_counter() - started)
+        self._adjust(event, "checked_out", 1)
+
+    def connection_checked_in(self, event):
+        self._adjust(event, "checked_out", -1)
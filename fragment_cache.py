@@ -0,0 +1,62 @@
+import threading
+from collections import OrderedDict
+
+from jinja2 import nodes
+from jinja2.ext import Extension
+
+# ----------------------------
+# Template fragment cache
+# ----------------------------
+# {% cache "name", version %}...{% endcache %} renders its body once per key
+# and reuses the markup afterwards. Keys should carry whatever the body
+# depends on (e.g. the stock catalog version); entries for old keys simply age
+# out of the LRU. Only wrap markup that is identical for every user.
+
+
+class FragmentCache:
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_render(self, key: tuple, render):
+        with self._lock:
+            markup = self._entries.get(key)
+            if markup is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return markup
+            self.misses += 1
+        markup = render()
+        with self._lock:
+            self._entries[key] = markup
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return markup
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class FragmentCacheExtension(Extension):
+    tags = {"cache"}
+
+    def __init__(self, environment):
+        super().__init__(environment)
+        environment.extend(fragment_cache=FragmentCache())
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        args = [parser.parse_expression()]
+        while parser.stream.skip_if("comma"):
+            args.append(parser.parse_expression())
+        body = parser.parse_statements(("name:endcache",), drop_needle=True)
+        return nodes.CallBlock(
+            self.call_method("_render", [nodes.List(args)]), [], [], body
+        ).set_lineno(lineno)
+
+    def _render(self, key, caller):
+        return self.environment.fragment_cache.get_or_render(tuple(key), caller)
@@ -0,0 +1,167 @@
+import os
+import socket
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError, PyMongoError
+
+# ----------------------------
+# Shared market state
+# ----------------------------
+# With several workers only one of them, the producer, ticks prices, matches
+# resting orders and settles; the rest load the state it publishes. Across
+# hosts the producer is elected through a lease document it renews every tick
+# and any worker may take over once it expires; on one host the shared-memory
+# price board's file lock does the same job.
+
+
+class Lease:
+    def __init__(self, collection, name: str, ttl: float = 15.0):
+        self.collection = collection
+        self.name = name
+        self.ttl = ttl
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.held = False
+
+    def renew(self) -> bool:
+        now = datetime.utcnow()
+        try:
+            doc = self.collection.find_one_and_update(
+                {"_id": self.name, "$or": [{"owner": self.owner}, {"expires_at": {"$lt": now}}]},
+                {"$set": {"owner": self.owner, "expires_at": now + timedelta(seconds=self.ttl)}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+            )
+            self.held = doc is not None and doc.get("owner") == self.owner
+        except DuplicateKeyError:
+            # Someone else holds an unexpired lease, so the upsert collided with it
+            self.held = False
+        except PyMongoError:
+            self.held = False
+        return self.held
+
+    def release(self):
+        if self.held:
+            self.collection.delete_one({"_id": self.name, "owner": self.owner})
+            self.held = False
+
+
+class LocalMarketState:
+    # Single process: this worker always produces and there is nothing to share
+    name = "local"
+    shared = False
+
+    def elect(self) -> bool:
+        return True
+
+    def is_producer(self) -> bool:
+        return True
+
+    def publish(self, engine):
+        pass
+
+    def resign(self):
+        pass
+
+    def pull(self, engine) -> bool:
+        return False
+
+    def wait(self, timeout: float):
+        time.sleep(timeout)
+
+
+class MongoMarketState:
+    # The producer writes the whole market as one document of parallel arrays
+    # per tick; readers only fetch it when its state_id has changed.
+    name = "mongo"
+    shared = True
+
+    def __init__(self, collection, lease: Lease, doc_id: str = "market"):
+        self.collection = collection
+        self.lease = lease
+        self.doc_id = doc_id
+        self.state_id = None
+
+    def elect(self) -> bool:
+        return self.lease.renew()
+
+    def is_producer(self) -> bool:
+        return self.lease.held
+
+    def resign(self):
+        # A producer that cannot publish stops acting as one until it wins the lease again
+        self.lease.held = False
+
+    def publish(self, engine):
+        tickers, prices, opens, highs, lows = engine.export_state()
+        self.state_id = ObjectId()
+        self.collection.replace_one(
+            {"_id": self.doc_id},
+            {
+                "state_id": self.state_id,
+                "producer": self.lease.owner,
+                "updated_at": datetime.utcnow(),
+                "tickers": tickers,
+                "prices": prices,
+                "opens": opens,
+                "highs": highs,
+                "lows": lows,
+            },
+            upsert=True,
+        )
+
+    def pull(self, engine) -> bool:
+        doc = self.collection.find_one({"_id": self.doc_id, "state_id": {"$ne": self.state_id}})
+        if doc is None:
+            return False
+        engine.load_state(doc["tickers"], doc["prices"], doc["opens"], doc["highs"], doc["lows"])
+        self.state_id = doc["state_id"]
+        return True
+
+    def wait(self, timeout: float):
+        time.sleep(timeout)
+
+
+class ShmMarketState:
+    # Same-host workers share a memory-mapped price board; the producer is
+    # whichever process holds the board's file lock, and followers pick up a
+    # new tick within `poll` seconds instead of on their next loop.
+    name = "shm"
+    shared = True
+
+    def __init__(self, board, poll: float = 0.05):
+        self.board = board
+        self.poll = poll
+        self.sequence = None
+
+    def elect(self) -> bool:
+        return self.board.acquire()
+
+    def is_producer(self) -> bool:
+        return self.board.writer
+
+    def resign(self):
+        # The file lock lives as long as the process; a failed write to local
+        # memory is not a reason to hand the board to another worker
+        pass
+
+    def publish(self, engine):
+        self.board.write(*engine.export_state())
+
+    def pull(self, engine) -> bool:
+        state = self.board.read(since=self.sequence)
+        if state is None:
+            return False
+        self.sequence, tickers, prices, opens, highs, lows = state
+        engine.load_state(tickers, prices, opens, highs, lows)
+        return True
+
+    def wait(self, timeout: float):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.board.sequence() not in (None, self.sequence):
+                return
+            time.sleep(self.poll)
@@ -0,0 +1,92 @@
+import heapq
+import math
+import threading
+
+# ----------------------------
+# In-memory order book for limit / stop orders
+# ----------------------------
+# Open orders are indexed per ticker in two heaps keyed by trigger price:
+#   below: fires once price <= level (buy limit, sell stop), max-heap
+#   above: fires once price >= level (sell limit, buy stop), min-heap
+# Matching a tick only pops orders whose trigger was crossed, so its cost grows
+# with the number of fills, not with the size of the book. Cancelled orders are
+# dropped lazily when they reach the top of a heap.
+
+ORDER_TYPES = ("limit", "stop")
+
+
+def trigger_side(side: str, order_type: str) -> str:
+    if order_type == "limit":
+        return "below" if side == "buy" else "above"
+    return "above" if side == "buy" else "below"
+
+
+class OrderBook:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._below = {}
+        self._above = {}
+        self._orders = {}
+        self._seq = 0
+
+    def __len__(self):
+        return len(self._orders)
+
+    def __contains__(self, order_id):
+        return order_id in self._orders
+
+    def add(self, order: dict):
+        # A NaN level never compares as crossed and would block its heap for good
+        order_id = order["_id"]
+        level = float(order["trigger_price"])
+        if not math.isfinite(level) or level <= 0:
+            raise ValueError(f"Invalid trigger price {order['trigger_price']!r} for order {order_id}")
+        with self._lock:
+            if order_id in self._orders:
+                return
+            self._orders[order_id] = order
+            self._seq += 1
+            if trigger_side(order["type"], order["order_type"]) == "below":
+                heapq.heappush(self._below.setdefault(order["ticker"], []), (-level, self._seq, order_id))
+            else:
+                heapq.heappush(self._above.setdefault(order["ticker"], []), (level, self._seq, order_id))
+
+    def load(self, orders):
+        # Returns how many orders were skipped for an invalid trigger price
+        skipped = 0
+        for order in orders:
+            try:
+                self.add(order)
+            except (KeyError, TypeError, ValueError):
+                skipped += 1
+        return skipped
+
+    def cancel(self, order_id):
+        with self._lock:
+            return self._orders.pop(order_id, None)
+
+    def tickers(self):
+        with self._lock:
+            return set(self._below) | set(self._above)
+
+    def match(self, prices: dict):
+        # prices: ticker -> current price for the tickers that moved this tick
+        triggered = []
+        with self._lock:
+            for ticker, price in prices.items():
+                below = self._below.get(ticker)
+                while below and (below[0][2] not in self._orders or price <= -below[0][0]):
+                    order = self._orders.pop(heapq.heappop(below)[2], None)
+                    if order is not None:
+                        triggered.append({**order, "fill_price": price})
+                if below is not None and not below:
+                    del self._below[ticker]
+
+                above = self._above.get(ticker)
+                while above and (above[0][2] not in self._orders or price >= above[0][0]):
+                    order = self._orders.pop(heapq.heappop(above)[2], None)
+                    if order is not None:
+                        triggered.append({**order, "fill_price": price})
+                if above is not None and not above:
+                    del self._above[ticker]
+        return triggered
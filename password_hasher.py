@@ -0,0 +1,124 @@
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+import bcrypt
+
+# ----------------------------
+# Password hashing off the request threads
+# ----------------------------
+# bcrypt is deliberately slow, so hashing and checking run in a small process
+# pool. At most `max_pending` calls may be queued or running; past that, new
+# logins are rejected straight away with HasherBusy instead of piling up and
+# holding request threads that /buy and /sell_post need.
+
+
+class HasherBusy(Exception):
+    pass
+
+
+def _hash(password: bytes, rounds: int) -> bytes:
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds))
+
+
+def _check(password: bytes, stored_hash: bytes) -> bool:
+    return bcrypt.checkpw(password, stored_hash)
+
+
+def hash_rounds(stored_hash: bytes):
+    # "$2b$12$..." -> 12
+    try:
+        return int(stored_hash.split(b"$")[2])
+    except (IndexError, ValueError):
+        return None
+
+
+class PasswordHasher:
+    def __init__(self, registry, rounds: int = 12, workers: int = 2, max_pending: int = 16, timeout: float = 10.0):
+        self.rounds = rounds
+        self.workers = workers
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        self.duration = registry.histogram("password_hash_seconds", "Time to hash or check a password, by operation")
+        self.rejected = registry.counter("password_hash_rejected_total", "Hash / check calls turned away, by reason")
+
+    def _executor(self):
+        with self._pool_lock:
+            if self._pool is None:
+                # spawn: forking a process that already runs threads can deadlock the child
+                self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+            return self._pool
+
+    def _replace(self, pool):
+        # One dead worker (e.g. killed for memory) breaks the whole pool for
+        # good; drop it so the next call starts a fresh one
+        with self._pool_lock:
+            if self._pool is pool:
+                self._pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def _submit(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            self.rejected.inc(reason="busy")
+            raise HasherBusy()
+        if self.workers <= 0:
+            try:
+                return fn(*args)
+            finally:
+                self._slots.release()
+        try:
+            pool = self._executor()
+            try:
+                future = pool.submit(fn, *args)
+            except BrokenProcessPool:
+                self._replace(pool)
+                future = self._executor().submit(fn, *args)
+        except BaseException as e:
+            self._slots.release()
+            if isinstance(e, BrokenProcessPool):
+                self.rejected.inc(reason="broken")
+                raise HasherBusy() from e
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def _run(self, op, fn, *args):
+        started = time.perf_counter()
+        result = self._submit(fn, *args)
+        if self.workers > 0:
+            try:
+                result = result.result(self.timeout)
+            except TimeoutError:
+                self.rejected.inc(reason="timeout")
+                raise HasherBusy()
+            except BrokenProcessPool:
+                # The worker running this call died; the next submit replaces the pool
+                self.rejected.inc(reason="broken")
+                raise HasherBusy()
+        self.duration.observe(time.perf_counter() - started, op=op)
+        return result
+
+    def hash(self, password: str) -> bytes:
+        return self._run("hash", _hash, password.encode("utf-8"), self.rounds)
+
+    def verify(self, password: str, stored_hash: bytes) -> bool:
+        return self._run("check", _check, password.encode("utf-8"), stored_hash)
+
+    def needs_rehash(self, stored_hash: bytes) -> bool:
+        return hash_rounds(stored_hash) != self.rounds
+
+    def rehash_later(self, password: str, store):
+        # Hashes with the current cost in the background and hands the result
+        # to store(new_hash); skipped when the pool is saturated
+        try:
+            future = self._submit(_hash, password.encode("utf-8"), self.rounds)
+        except HasherBusy:
+            return
+        if self.workers <= 0:
+            store(future)
+        else:
+            future.add_done_callback(lambda f: f.exception() is None and store(f.result()))
@@ -0,0 +1,126 @@
+import threading
+import time
+from collections import OrderedDict
+
+# ----------------------------
+# Incremental portfolio valuation
+# ----------------------------
+# Keeps market value and opening value per tracked user and a ticker -> holders
+# reverse index. A price tick only touches the holders of tickers that moved,
+# and a settled trade adjusts a single account, so reading a portfolio is O(1).
+# Accounts are loaded lazily, expire after `ttl` seconds (another worker may
+# have traded for the user) and are evicted least-recently-used past `max_users`.
+
+
+class PortfolioBook:
+    def __init__(self, quote_fn, ttl: float = 30.0, max_users: int = 50000):
+        self._quote_fn = quote_fn
+        self._ttl = ttl
+        self._max_users = max_users
+        self._lock = threading.Lock()
+        self._accounts = OrderedDict()
+        self._holders = {}
+        self._quotes = {}
+
+    def __len__(self):
+        return len(self._accounts)
+
+    def tickers(self):
+        with self._lock:
+            return list(self._holders)
+
+    def _summary(self, account):
+        return {
+            "cash": account["cash"],
+            "holdings": dict(account["holdings"]),
+            "market_value": account["market_value"],
+            "opening_value": account["opening_value"],
+        }
+
+    def get(self, user_id):
+        with self._lock:
+            account = self._accounts.get(user_id)
+            if account is None:
+                return None
+            if self._ttl > 0 and time.monotonic() - account["loaded_at"] > self._ttl:
+                self._drop(user_id)
+                return None
+            self._accounts.move_to_end(user_id)
+            return self._summary(account)
+
+    def load(self, user_id, cash: float, holdings: dict, quotes: dict):
+        # quotes: ticker -> (price, opening price) for every held ticker
+        holdings = {t: n for t, n in (holdings or {}).items() if n > 0}
+        with self._lock:
+            self._drop(user_id)
+            account = {"cash": float(cash), "holdings": holdings, "loaded_at": time.monotonic()}
+            market_value = opening_value = 0.0
+            for ticker, shares in holdings.items():
+                price, opening = self._quotes.setdefault(ticker, quotes.get(ticker, (0.0, 0.0)))
+                market_value += shares * price
+                opening_value += shares * opening
+                self._holders.setdefault(ticker, {})[user_id] = shares
+            account["market_value"] = market_value
+            account["opening_value"] = opening_value
+            self._accounts[user_id] = account
+            while len(self._accounts) > self._max_users:
+                self._drop(next(iter(self._accounts)))
+            return self._summary(account)
+
+    def discard(self, user_id):
+        with self._lock:
+            self._drop(user_id)
+
+    def _drop(self, user_id):
+        account = self._accounts.pop(user_id, None)
+        if account is None:
+            return
+        for ticker in account["holdings"]:
+            holders = self._holders.get(ticker)
+            if holders is not None:
+                holders.pop(user_id, None)
+                if not holders:
+                    del self._holders[ticker]
+                    self._quotes.pop(ticker, None)
+
+    def apply_prices(self, quotes: dict):
+        # quotes: ticker -> (price, opening price); only moved tickers do any work
+        with self._lock:
+            for ticker, (price, opening) in quotes.items():
+                holders = self._holders.get(ticker)
+                last = self._quotes.get(ticker)
+                if not holders or last is None or last == (price, opening):
+                    continue
+                price_move = price - last[0]
+                opening_move = opening - last[1]
+                for user_id, shares in holders.items():
+                    account = self._accounts[user_id]
+                    account["market_value"] += shares * price_move
+                    account["opening_value"] += shares * opening_move
+                self._quotes[ticker] = (price, opening)
+
+    def apply_trade(self, user_id, ticker=None, shares: int = 0, cash: float = 0.0):
+        # shares > 0 bought, < 0 sold; cash is the signed change to the cash balance
+        with self._lock:
+            account = self._accounts.get(user_id)
+            if account is None:
+                return
+            account["cash"] += cash
+            if not ticker or not shares:
+                return
+            if ticker not in self._quotes:
+                self._quotes[ticker] = self._quote_fn([ticker]).get(ticker, (0.0, 0.0))
+            price, opening = self._quotes[ticker]
+            held = account["holdings"].get(ticker, 0) + shares
+            account["market_value"] += shares * price
+            account["opening_value"] += shares * opening
+            holders = self._holders.setdefault(ticker, {})
+            if held > 0:
+                account["holdings"][ticker] = held
+                holders[user_id] = held
+            else:
+                account["holdings"].pop(ticker, None)
+                holders.pop(user_id, None)
+                if not holders:
+                    del self._holders[ticker]
+                    self._quotes.pop(ticker, None)
@@ -0,0 +1,223 @@
+import mmap
+import os
+import time
+
+import numpy as np
+
+from price_engine import daily_changes
+
+# ----------------------------
+# Shared-memory price board
+# ----------------------------
+# A fixed-layout file mapped by every worker on the host:
+#   header   int64[5]  magic, capacity, sequence, count, layout
+#   tickers  S16[capacity]  (ASCII, at most TICKER_BYTES long)
+#   prices, opens, highs, lows  float64[capacity] each
+# One writer (the process holding an exclusive flock on the file) bumps the
+# sequence to odd, rewrites the rows and bumps it back to even. Readers copy
+# the rows and retry if the sequence was odd or moved meanwhile, so neither
+# side ever blocks the other. `layout` changes whenever the ticker list does,
+# so readers keep their ticker -> row index until it moves. A writer given
+# more tickers than fit grows the file and lays it out at a larger capacity;
+# readers remap when the capacity in the header no longer matches theirs.
+
+MAGIC = 0x32424F4543495250  # "PRICEBO2"
+HEADER_SIZE = 5 * 8
+TICKER_BYTES = 16
+COLUMNS = ("prices", "opens", "highs", "lows")
+READ_RETRIES = 1000
+
+
+def board_size(capacity: int) -> int:
+    return HEADER_SIZE + capacity * (TICKER_BYTES + 8 * len(COLUMNS))
+
+
+class PriceBoard:
+    def __init__(self, path: str, capacity: int = 4096):
+        self.path = path
+        self.capacity = capacity
+        self.writer = False
+        self._fd = None
+        self._map = None
+        self.header = None
+        self._written = None
+        # (layout, {ticker: row}) as of the last layout this process read
+        self._index = (None, {})
+
+    def _bind(self, fd, capacity: int):
+        if self._map is not None:
+            self._map.close()
+        self._map = mmap.mmap(fd, board_size(capacity))
+        self.header = np.ndarray(5, dtype=np.int64, buffer=self._map)
+        self._index = (None, {})
+        offset = HEADER_SIZE
+        self.names = np.ndarray(capacity, dtype=f"S{TICKER_BYTES}", buffer=self._map, offset=offset)
+        offset += capacity * TICKER_BYTES
+        for name in COLUMNS:
+            setattr(self, name, np.ndarray(capacity, dtype=np.float64, buffer=self._map, offset=offset))
+            offset += capacity * 8
+
+    def _attach(self) -> bool:
+        # Reader side: map the board once the producer has created it, and
+        # remap if a new producer laid it out with a different capacity
+        if self.header is not None and self.header[0] == MAGIC and self.header[1] == len(self.prices):
+            return True
+        if self._fd is None:
+            try:
+                self._fd = os.open(self.path, os.O_RDWR)
+            except FileNotFoundError:
+                return False
+        size = os.fstat(self._fd).st_size
+        if size < HEADER_SIZE:
+            return False
+        header = np.frombuffer(os.pread(self._fd, HEADER_SIZE, 0), dtype=np.int64)
+        if header[0] != MAGIC or size < board_size(int(header[1])):
+            return False
+        self._bind(self._fd, int(header[1]))
+        return True
+
+    def acquire(self) -> bool:
+        # Becomes the writer if no other process holds the board; kept until exit
+        if self.writer:
+            return True
+        import fcntl
+
+        if self._fd is None:
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(self._fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+        if os.fstat(self._fd).st_size < board_size(self.capacity):
+            os.ftruncate(self._fd, board_size(self.capacity))
+        self._bind(self._fd, self.capacity)
+        if self.header[0] != MAGIC or self.header[1] != self.capacity:
+            self.header[2] = 0
+            self.header[3] = 0
+            self.header[4] = 0
+            self.header[1] = self.capacity
+            self.header[0] = MAGIC
+        elif self.header[2] & 1:
+            # The previous writer died mid-update
+            self.header[2] += 1
+        self.writer = True
+        return True
+
+    def _grow(self, n: int):
+        # Called with the sequence odd; the file only ever grows, so readers'
+        # older, smaller mappings stay valid until they remap
+        capacity = max(n, 2 * self.capacity)
+        os.ftruncate(self._fd, board_size(capacity))
+        self._bind(self._fd, capacity)
+        self.capacity = capacity
+        self.header[1] = capacity
+
+    def write(self, tickers, prices, opens, highs, lows):
+        n = len(tickers)
+        relayout = tickers != self._written
+        if relayout:
+            # numpy would silently cut longer names to fit the column
+            for ticker in tickers:
+                if not ticker.isascii() or len(ticker) > TICKER_BYTES:
+                    raise ValueError(f"Ticker {ticker!r} does not fit the price board")
+        self.header[2] += 1
+        if n > self.capacity:
+            self._grow(n)
+            relayout = True
+        header = self.header
+        if relayout:
+            self.names[:n] = tickers
+            header[4] += 1
+        for name, values in zip(COLUMNS, (prices, opens, highs, lows)):
+            getattr(self, name)[:n] = values
+        header[3] = n
+        header[2] += 1
+        self._written = list(tickers)
+
+    def sequence(self):
+        if not self.writer and not self._attach():
+            return None
+        return int(self.header[2])
+
+    def _remapped(self) -> bool:
+        # Reader side, with an even sequence in hand: True if the board was
+        # laid out at another capacity and this process has just remapped it
+        if self.writer or int(self.header[1]) == len(self.prices):
+            return False
+        self._attach()
+        return True
+
+    def read(self, since=None):
+        # (sequence, tickers, prices, opens, highs, lows), or None if the board
+        # is missing or has not moved past `since`
+        if not self.writer and not self._attach():
+            return None
+        for _ in range(READ_RETRIES):
+            header = self.header
+            sequence = int(header[2])
+            if sequence == since:
+                return None
+            if sequence & 1:
+                time.sleep(0)
+                continue
+            if self._remapped():
+                continue
+            n = int(header[3])
+            names = self.names[:n].copy()
+            columns = [getattr(self, name)[:n].copy() for name in COLUMNS]
+            if int(header[2]) == sequence:
+                return (sequence, [t.decode("ascii") for t in names], *columns)
+        return None
+
+    def _rows(self, state):
+        _, tickers, prices, opens, highs, lows = state
+        change, pct = daily_changes(prices, opens)
+        return [
+            {
+                "ticker": ticker,
+                "current_price": price,
+                "opening_price": opening_price,
+                "daily_high": high,
+                "daily_low": low,
+                "daily_change": daily_change,
+                "daily_change_percent": daily_change_percent,
+            }
+            for ticker, price, opening_price, high, low, daily_change, daily_change_percent in zip(
+                tickers, prices.tolist(), opens.tolist(), highs.tolist(),
+                lows.tolist(), change.tolist(), pct.tolist(),
+            )
+        ]
+
+    def rows(self):
+        state = self.read()
+        return [] if state is None else self._rows(state)
+
+    def get(self, ticker: str):
+        # Reads one row; the ticker index is only rebuilt when the layout moves
+        if not self.writer and not self._attach():
+            return None
+        for _ in range(READ_RETRIES):
+            header = self.header
+            sequence = int(header[2])
+            if sequence & 1:
+                time.sleep(0)
+                continue
+            if self._remapped():
+                continue
+            layout, n = int(header[4]), int(header[3])
+            cached_layout, index = self._index
+            if layout != cached_layout:
+                names = self.names[:n].copy()
+                if int(header[2]) != sequence:
+                    continue
+                index = {t.decode("ascii"): row for row, t in enumerate(names.tolist())}
+                self._index = (layout, index)
+            row = index.get(ticker)
+            if row is None:
+                if int(header[2]) == sequence:
+                    return None
+                continue
+            columns = [getattr(self, name)[row:row + 1].copy() for name in COLUMNS]
+            if int(header[2]) == sequence:
+                return self._rows((sequence, [ticker], *columns))[0]
+        return None
@@ -0,0 +1,334 @@
+import os
+import tempfile
+import threading
+
+import numpy as np
+
+from price_models import ModelRegistry
+
+# ----------------------------
+# Vectorized price engine
+# ----------------------------
+# Prices, opens, highs and lows live in contiguous float64 arrays indexed by
+# row; `index` maps ticker -> row. Each tick is a handful of array operations,
+# so the time spent holding the lock stays flat as the catalog grows. Each
+# ticker is driven by one of the registry's price models.
+
+MIN_PRICE = 0.01
+
+
+def daily_changes(prices, opens):
+    change = np.round(prices - opens, 2)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        pct = np.where(opens > 0, np.round((prices - opens) / opens * 100, 2), 0.0)
+    return change, pct
+
+
+class PriceEngine:
+    def __init__(self, lock=None, capacity: int = 64, models=None):
+        self.lock = lock or threading.Lock()
+        self.models = models or ModelRegistry()
+        self.index = {}
+        self.tickers = []
+        self.row_models = []
+        # ticker -> (model name, params, anchor price) its row model was bound with
+        self.bindings = {}
+        self._groups = None
+        self.prices = np.zeros(capacity)
+        self.opens = np.zeros(capacity)
+        self.highs = np.zeros(capacity)
+        self.lows = np.zeros(capacity)
+        self.dirty = np.zeros(capacity, dtype=bool)
+        self.removed = set()
+
+    def __len__(self):
+        return len(self.tickers)
+
+    def __contains__(self, ticker):
+        return ticker in self.index
+
+    def _grow(self):
+        capacity = max(64, len(self.prices) * 2)
+        for name in ("prices", "opens", "highs", "lows", "dirty"):
+            old = getattr(self, name)
+            new = np.zeros(capacity, dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+
+    def _add_locked(self, ticker: str, price: float, opening_price=None, high=None, low=None, model=None, params=None):
+        if ticker in self.index:
+            return False
+        row = len(self.tickers)
+        if row == len(self.prices):
+            self._grow()
+        price_model = self.models.get(model)
+        price_model.bind(ticker, price, params)
+        self.index[ticker] = row
+        self.tickers.append(ticker)
+        self.row_models.append(price_model)
+        self.bindings[ticker] = (model, params, price)
+        self._groups = None
+        self.prices[row] = price
+        self.opens[row] = price if opening_price is None else opening_price
+        self.highs[row] = price if high is None else high
+        self.lows[row] = price if low is None else low
+        self.dirty[row] = True
+        self.removed.discard(ticker)
+        return True
+
+    def add(self, ticker: str, price: float, opening_price=None, high=None, low=None, model=None, params=None):
+        with self.lock:
+            return self._add_locked(ticker, price, opening_price, high, low, model, params)
+
+    def add_many(self, stocks):
+        # stocks: iterable of {"ticker", "price", optional "model" / "model_params"}
+        with self.lock:
+            for stock in stocks:
+                self._add_locked(
+                    stock["ticker"], stock["price"],
+                    model=stock.get("model"), params=stock.get("model_params"),
+                )
+
+    def sync(self, stocks):
+        # Makes the engine list exactly `stocks` (add_many format): adds the
+        # missing ones, drops the rest and keeps prices of tickers in both.
+        # Tickers in both are rebound when their model, params or anchor
+        # differ, e.g. rows a follower took from load_state with the default model.
+        with self.lock:
+            listed = {stock["ticker"] for stock in stocks}
+            removed = [t for t in self.tickers if t not in listed]
+            for ticker in removed:
+                self._remove_locked(ticker)
+            added = []
+            for stock in stocks:
+                ticker, price = stock["ticker"], stock["price"]
+                model, params = stock.get("model"), stock.get("model_params")
+                if self._add_locked(ticker, price, model=model, params=params):
+                    added.append(ticker)
+                elif self.bindings.get(ticker) != (model, params, price):
+                    self._rebind_locked(ticker, price, model, params)
+            return added, removed
+
+    def _rebind_locked(self, ticker: str, anchor: float, model=None, params=None):
+        row = self.index[ticker]
+        price_model = self.models.get(model)
+        self.row_models[row].unbind(ticker)
+        price_model.bind(ticker, anchor, params)
+        self.row_models[row] = price_model
+        self.bindings[ticker] = (model, params, anchor)
+        self._groups = None
+
+    def remove(self, ticker: str):
+        with self.lock:
+            return self._remove_locked(ticker)
+
+    def _remove_locked(self, ticker: str):
+        row = self.index.pop(ticker, None)
+        if row is None:
+            return False
+        self.row_models[row].unbind(ticker)
+        del self.bindings[ticker]
+        # Move the last row into the hole so the arrays stay contiguous
+        last = len(self.tickers) - 1
+        if row != last:
+            moved = self.tickers[last]
+            self.tickers[row] = moved
+            self.row_models[row] = self.row_models[last]
+            self.index[moved] = row
+            for array in (self.prices, self.opens, self.highs, self.lows, self.dirty):
+                array[row] = array[last]
+        self.tickers.pop()
+        self.row_models.pop()
+        self._groups = None
+        self.dirty[last] = False
+        self.removed.add(ticker)
+        return True
+
+    def _model_groups(self):
+        # (model, rows, tickers) per model in use; rebuilt only when rows are added or removed
+        if self._groups is None:
+            grouped = {}
+            for row, model in enumerate(self.row_models):
+                grouped.setdefault(id(model), (model, []))[1].append(row)
+            self._groups = [
+                (model, np.array(rows, dtype=np.intp), tuple(self.tickers[row] for row in rows))
+                for model, rows in grouped.values()
+            ]
+        return self._groups
+
+    def tick(self):
+        with self.lock:
+            n = len(self.tickers)
+            if n == 0:
+                return 0
+            prices = self.prices[:n]
+            groups = self._model_groups()
+            if len(groups) == 1:
+                model, _, tickers = groups[0]
+                raw = model.step(tickers, prices)
+            else:
+                raw = np.empty(n)
+                for model, rows, tickers in groups:
+                    raw[rows] = model.step(tickers, prices[rows])
+            new_prices = np.maximum(MIN_PRICE, np.round(raw, 2))
+            self.dirty[:n] |= new_prices != prices
+            prices[:] = new_prices
+            np.maximum(self.highs[:n], new_prices, out=self.highs[:n])
+            np.minimum(self.lows[:n], new_prices, out=self.lows[:n])
+            return n
+
+    def reset_opens(self):
+        with self.lock:
+            n = len(self.tickers)
+            self.opens[:n] = self.prices[:n]
+            self.highs[:n] = self.prices[:n]
+            self.lows[:n] = self.prices[:n]
+            self.dirty[:n] = True
+
+    def _copy_locked(self, rows):
+        # Plain copies of the selected rows, so the dicts can be built after the lock is released
+        tickers = [self.tickers[row] for row in rows] if not isinstance(rows, slice) else self.tickers[rows]
+        return tickers, self.prices[rows].copy(), self.opens[rows].copy(), self.highs[rows].copy(), self.lows[rows].copy()
+
+    @staticmethod
+    def _rows(tickers, prices, opens, highs, lows):
+        change, pct = daily_changes(prices, opens)
+        return [
+            {
+                "ticker": ticker,
+                "current_price": price,
+                "opening_price": opening_price,
+                "daily_high": high,
+                "daily_low": low,
+                "daily_change": daily_change,
+                "daily_change_percent": daily_change_percent,
+            }
+            for ticker, price, opening_price, high, low, daily_change, daily_change_percent in zip(
+                tickers, prices.tolist(), opens.tolist(), highs.tolist(),
+                lows.tolist(), change.tolist(), pct.tolist(),
+            )
+        ]
+
+    def rows(self):
+        with self.lock:
+            copied = self._copy_locked(slice(0, len(self.tickers)))
+        return self._rows(*copied)
+
+    def get(self, ticker: str):
+        with self.lock:
+            row = self.index.get(ticker)
+            if row is None:
+                return None
+            copied = self._copy_locked([row])
+        return self._rows(*copied)[0]
+
+    def get_price(self, ticker: str):
+        with self.lock:
+            row = self.index.get(ticker)
+            return None if row is None else float(self.prices[row])
+
+    def get_prices(self, tickers):
+        with self.lock:
+            index = self.index
+            return {t: float(self.prices[index[t]]) if t in index else None for t in tickers}
+
+    def get_quotes(self, tickers):
+        # ticker -> (current price, opening price) for the tickers the engine knows
+        with self.lock:
+            index = self.index
+            return {
+                t: (float(self.prices[index[t]]), float(self.opens[index[t]]))
+                for t in tickers
+                if t in index
+            }
+
+    def export_state(self):
+        # (tickers, prices, opens, highs, lows) as plain lists, for publishing to other workers
+        with self.lock:
+            n = len(self.tickers)
+            return (
+                list(self.tickers), self.prices[:n].tolist(), self.opens[:n].tolist(),
+                self.highs[:n].tolist(), self.lows[:n].tolist(),
+            )
+
+    def load_state(self, tickers, prices, opens, highs, lows):
+        # Replaces the local market with a published one; rows that differ are marked dirty
+        with self.lock:
+            listed = set(tickers)
+            for ticker in [t for t in self.tickers if t not in listed]:
+                self._remove_locked(ticker)
+            for ticker, price in zip(tickers, prices):
+                self._add_locked(ticker, price)
+            if not tickers:
+                return
+            rows = np.fromiter((self.index[t] for t in tickers), dtype=np.intp, count=len(tickers))
+            changed = np.zeros(len(rows), dtype=bool)
+            for name, values in (("prices", prices), ("opens", opens), ("highs", highs), ("lows", lows)):
+                array = getattr(self, name)
+                values = np.asarray(values, dtype=float)
+                changed |= array[rows] != values
+                array[rows] = values
+            self.dirty[rows] |= changed
+
+    def restore(self, tickers, prices, opens, highs, lows):
+        # Overwrites rows for tickers already in the engine; returns how many matched
+        with self.lock:
+            restored = 0
+            for ticker, price, opening_price, high, low in zip(tickers, prices, opens, highs, lows):
+                row = self.index.get(ticker)
+                if row is None:
+                    continue
+                self.prices[row] = price
+                self.opens[row] = opening_price
+                self.highs[row] = high
+                self.lows[row] = low
+                self.dirty[row] = True
+                restored += 1
+            return restored
+
+    def save(self, path: str, **meta):
+        # Written to a temp file of its own and renamed, so neither a crash nor
+        # a second writer can leave a torn checkpoint
+        tickers, prices, opens, highs, lows = self.export_state()
+        directory, name = os.path.split(path)
+        fd, tmp = tempfile.mkstemp(prefix=f"{name}.", suffix=".tmp", dir=directory or ".")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez(
+                    f, tickers=np.array(tickers, dtype=str), prices=prices, opens=opens, highs=highs, lows=lows,
+                    **{key: np.array(value) for key, value in meta.items()},
+                )
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    def snapshot(self):
+        # Rows plus the tickers changed/removed since the previous snapshot, taken atomically
+        # Only array copies happen under the lock; the row dicts are built after it
+        with self.lock:
+            n = len(self.tickers)
+            copied = self._copy_locked(slice(0, n))
+            dirty = np.flatnonzero(self.dirty[:n])
+            removed = self.removed
+            self.dirty[:n] = False
+            self.removed = set()
+        tickers = copied[0]
+        changed = {tickers[row] for row in dirty.tolist()}
+        return self._rows(*copied), changed, removed
+
+
+def load_checkpoint(path: str):
+    # {"tickers", "prices", "opens", "highs", "lows", plus saved meta} or None
+    try:
+        with np.load(path, allow_pickle=False) as checkpoint:
+            state = {key: checkpoint[key] for key in checkpoint.files}
+    except (OSError, ValueError):
+        return None
+    state["tickers"] = [str(t) for t in state["tickers"]]
+    for key in ("prices", "opens", "highs", "lows"):
+        state[key] = state[key].tolist()
+    for key, value in list(state.items()):
+        if isinstance(value, np.ndarray) and value.ndim == 0:
+            state[key] = value.item()
+    return state
@@ -0,0 +1,186 @@
+import logging
+import os
+import struct
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import numpy as np
+from pymongo import UpdateOne
+
+# ----------------------------
+# Intraday price history
+# ----------------------------
+# TickLog appends every tick to a compact binary file per UTC day. Each record
+# is a (timestamp ms, count) header followed by the ids and prices of the
+# tickers that moved; ids index the day's `.tickers` file (one name per line).
+# BarRecorder folds ticks into the current minute in memory and, when the
+# minute closes, upserts it into the 1m, 5m and 1d bars in one bulk_write on
+# a background thread.
+
+logger = logging.getLogger("price_history")
+
+RECORD_HEADER = struct.Struct("<qI")
+INTERVALS = {"1m": 60, "5m": 300, "1d": 86400}
+
+
+def bar_start(when: datetime, interval: str) -> datetime:
+    seconds = INTERVALS[interval]
+    if seconds >= 86400:
+        return when.replace(hour=0, minute=0, second=0, microsecond=0)
+    epoch = when.replace(hour=0, minute=0, second=0, microsecond=0)
+    offset = int((when - epoch).total_seconds()) // seconds * seconds
+    return epoch + timedelta(seconds=offset)
+
+
+class TickLog:
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._day = None
+        self._file = None
+        self._names = None
+        self._ids = {}
+        self._last = np.zeros(0)
+        os.makedirs(directory, exist_ok=True)
+
+    def _open_day(self, day: str):
+        if self._file is not None:
+            self._file.close()
+            self._names.close()
+        self._day = day
+        self._ids = {}
+        names_path = os.path.join(self.directory, f"{day}.tickers")
+        if os.path.exists(names_path):
+            with open(names_path) as f:
+                self._ids = {name: i for i, name in enumerate(f.read().splitlines())}
+        self._names = open(names_path, "a")
+        self._file = open(os.path.join(self.directory, f"{day}.ticks"), "ab")
+        self._last = np.full(len(self._ids), np.nan)
+
+    def append(self, when: datetime, tickers, prices):
+        day = when.strftime("%Y-%m-%d")
+        if day != self._day:
+            self._open_day(day)
+
+        new = [t for t in tickers if t not in self._ids]
+        if new:
+            for ticker in new:
+                self._ids[ticker] = len(self._ids)
+            self._names.write("".join(f"{t}\n" for t in new))
+            self._names.flush()
+            self._last = np.concatenate([self._last, np.full(len(new), np.nan)])
+
+        ids = np.fromiter((self._ids[t] for t in tickers), dtype=np.int32, count=len(tickers))
+        prices = np.asarray(prices, dtype=np.float64)
+        moved = self._last[ids] != prices
+        if not moved.any():
+            return
+        ids, prices = ids[moved], prices[moved]
+        self._last[ids] = prices
+        timestamp = int((when - datetime(1970, 1, 1)).total_seconds() * 1000)
+        self._file.write(RECORD_HEADER.pack(timestamp, len(ids)) + ids.tobytes() + prices.tobytes())
+        self._file.flush()
+
+
+def read_ticks(directory: str, day: str):
+    # Yields (timestamp, {ticker: price}) for the tickers that moved on each tick
+    with open(os.path.join(directory, f"{day}.tickers")) as f:
+        names = f.read().splitlines()
+    with open(os.path.join(directory, f"{day}.ticks"), "rb") as f:
+        data = f.read()
+    offset = 0
+    while offset + RECORD_HEADER.size <= len(data):
+        timestamp, n = RECORD_HEADER.unpack_from(data, offset)
+        offset += RECORD_HEADER.size
+        ids = np.frombuffer(data, dtype=np.int32, count=n, offset=offset)
+        offset += 4 * n
+        prices = np.frombuffer(data, dtype=np.float64, count=n, offset=offset)
+        offset += 8 * n
+        when = datetime(1970, 1, 1) + timedelta(milliseconds=timestamp)
+        yield when, {names[i]: float(p) for i, p in zip(ids.tolist(), prices.tolist())}
+
+
+class BarRecorder:
+    def __init__(self, collection, tick_log=None):
+        self.collection = collection
+        self.tick_log = tick_log
+        self._lock = threading.Lock()
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="price-history")
+        self._minute = None
+        self._index = {}
+        self._tickers = []
+        self._ohlc = np.zeros((4, 0))
+
+    def record(self, when: datetime, tickers, prices):
+        if self.tick_log is not None:
+            self.tick_log.append(when, tickers, prices)
+
+        prices = np.asarray(prices, dtype=np.float64)
+        minute = bar_start(when, "1m")
+        with self._lock:
+            if self._minute is not None and minute != self._minute:
+                self._flush_locked()
+            if self._minute is None:
+                self._minute = minute
+                self._tickers = list(tickers)
+                self._index = {t: i for i, t in enumerate(self._tickers)}
+                self._ohlc = np.vstack([prices, prices, prices, prices])
+                return
+            if list(tickers) != self._tickers:
+                self._realign(tickers, prices)
+            open_, high, low, close = self._ohlc
+            np.maximum(high, prices, out=high)
+            np.minimum(low, prices, out=low)
+            close[:] = prices
+
+    def _realign(self, tickers, prices):
+        # The engine's row order changed (a ticker was added or removed)
+        ohlc = np.vstack([prices, prices, prices, prices])
+        for row, ticker in enumerate(tickers):
+            old = self._index.get(ticker)
+            if old is not None:
+                ohlc[:, row] = self._ohlc[:, old]
+        self._tickers = list(tickers)
+        self._index = {t: i for i, t in enumerate(self._tickers)}
+        self._ohlc = ohlc
+
+    def _flush_locked(self, wait: bool = False):
+        minute, tickers, ohlc = self._minute, self._tickers, self._ohlc
+        self._minute = None
+        if not tickers:
+            return
+        ops = []
+        for interval in INTERVALS:
+            start = bar_start(minute, interval)
+            for ticker, (o, h, l, c) in zip(tickers, ohlc.T.tolist()):
+                ops.append(UpdateOne(
+                    {"ticker": ticker, "interval": interval, "start": start},
+                    {"$setOnInsert": {"open": o}, "$max": {"high": h}, "$min": {"low": l}, "$set": {"close": c}},
+                    upsert=True,
+                ))
+        if wait:
+            self._write(minute, ops)
+        else:
+            self._writer.submit(self._write, minute, ops)
+
+    def _write(self, minute, ops):
+        try:
+            self.collection.bulk_write(ops, ordered=False)
+        except Exception:
+            logger.exception("Could not write price bars for %s", minute)
+
+    def flush(self, wait: bool = False):
+        # wait=True writes on the calling thread, e.g. at exit, when the
+        # writer pool no longer accepts work
+        with self._lock:
+            if self._minute is not None:
+                self._flush_locked(wait)
+
+    def current(self, ticker: str):
+        # The minute still being built, as a 1m bar, or None
+        with self._lock:
+            row = self._index.get(ticker)
+            if self._minute is None or row is None:
+                return None
+            o, h, l, c = self._ohlc[:, row].tolist()
+            return {"start": self._minute, "open": o, "high": h, "low": l, "close": c}
@@ -0,0 +1,168 @@
+import csv
+import zlib
+
+import numpy as np
+
+# ----------------------------
+# Price models
+# ----------------------------
+# A model turns the current prices of the tickers assigned to it into the next
+# tick's prices (the engine rounds to cents and applies the price floor).
+# Per-ticker parameters come from the `model_params` field of the stock doc.
+
+TRADING_SECONDS_PER_YEAR = 252 * 6.5 * 3600
+
+
+class PriceModel:
+    name = "base"
+    defaults = {}
+
+    def __init__(self, seed=None, **options):
+        self.rng = np.random.default_rng(seed)
+        self.options = {**self.defaults, **{k: v for k, v in options.items() if v is not None}}
+        self.params = {}
+        self._cache_key = None
+        self._cache = {}
+
+    def bind(self, ticker: str, price: float, params=None):
+        self.params[ticker] = {"anchor": price, **(params or {})}
+        self._cache_key = None
+
+    def unbind(self, ticker: str):
+        self.params.pop(ticker, None)
+        self._cache_key = None
+
+    def group_cache(self, tickers: tuple) -> dict:
+        # Arrays derived from a ticker group are rebuilt only when the engine
+        # hands over a different group
+        if tickers is not self._cache_key:
+            self._cache_key = tickers
+            self._cache = {}
+        return self._cache
+
+    def param(self, tickers: tuple, name: str) -> np.ndarray:
+        cache = self.group_cache(tickers)
+        values = cache.get(name)
+        if values is None:
+            default = self.options.get(name)
+            values = np.array([float(self.params.get(t, {}).get(name, default)) for t in tickers])
+            cache[name] = values
+        return values
+
+    def step(self, tickers: tuple, prices: np.ndarray) -> np.ndarray:
+        raise NotImplementedError
+
+
+class UniformWalk(PriceModel):
+    # The original model: every tick moves uniformly within +/- max_pct percent
+    name = "uniform"
+    defaults = {"max_pct": 2.0}
+
+    def step(self, tickers, prices):
+        max_pct = self.param(tickers, "max_pct") / 100
+        return prices * (1 + self.rng.uniform(-1.0, 1.0, len(prices)) * max_pct)
+
+
+class GeometricBrownianMotion(PriceModel):
+    # mu and sigma are annualized; one tick is tick_seconds of trading time
+    name = "gbm"
+    defaults = {"mu": 0.05, "sigma": 0.25, "tick_seconds": 5}
+
+    def step(self, tickers, prices):
+        mu = self.param(tickers, "mu")
+        sigma = self.param(tickers, "sigma")
+        dt = self.options["tick_seconds"] / TRADING_SECONDS_PER_YEAR
+        shock = self.rng.standard_normal(len(prices))
+        return prices * np.exp((mu - 0.5 * sigma ** 2) * dt + sigma * np.sqrt(dt) * shock)
+
+
+class MeanReversion(PriceModel):
+    # Ornstein-Uhlenbeck pull towards `mean` (defaults to the price the ticker was loaded at)
+    name = "mean_reversion"
+    defaults = {"theta": 5.0, "sigma": 0.25, "tick_seconds": 5}
+
+    def bind(self, ticker, price, params=None):
+        super().bind(ticker, price, params)
+        self.params[ticker].setdefault("mean", price)
+
+    def step(self, tickers, prices):
+        theta = self.param(tickers, "theta")
+        mean = self.param(tickers, "mean")
+        sigma = self.param(tickers, "sigma")
+        dt = self.options["tick_seconds"] / TRADING_SECONDS_PER_YEAR
+        shock = self.rng.standard_normal(len(prices))
+        return prices + theta * (mean - prices) * dt + sigma * prices * np.sqrt(dt) * shock
+
+
+class ReplayModel(PriceModel):
+    # Plays back recorded prices, one row per tick. Accepts a wide CSV (header of
+    # tickers, one row of prices per tick) or an .npz with `tickers` and a
+    # (ticks x tickers) `prices` array. Tickers missing from the recording hold still.
+    name = "replay"
+    defaults = {"path": None, "loop": True}
+
+    def __init__(self, seed=None, **options):
+        super().__init__(seed, **options)
+        self.position = 0
+        self.columns = {}
+        self.prices = np.zeros((0, 0))
+        if self.options["path"]:
+            self.load(self.options["path"])
+
+    def load(self, path: str):
+        if path.endswith(".npz"):
+            with np.load(path, allow_pickle=False) as recording:
+                tickers = [str(t) for t in recording["tickers"]]
+                prices = np.asarray(recording["prices"], dtype=float)
+        else:
+            with open(path, newline="") as f:
+                reader = csv.reader(f)
+                tickers = [t.strip().upper() for t in next(reader)]
+                prices = np.array([[float(v) if v else np.nan for v in row] for row in reader if row])
+        self.columns = {ticker: i for i, ticker in enumerate(tickers)}
+        self.prices = prices.reshape(-1, len(tickers))
+        self.position = 0
+
+    def step(self, tickers, prices):
+        if len(self.prices) == 0:
+            return prices
+        if self.position >= len(self.prices):
+            if not self.options["loop"]:
+                return prices
+            self.position = 0
+        row = self.prices[self.position]
+        self.position += 1
+
+        cache = self.group_cache(tickers)
+        columns = cache.get("columns")
+        if columns is None:
+            columns = np.array([self.columns.get(t, -1) for t in tickers], dtype=int)
+            cache["columns"] = columns
+        recorded = np.where(columns >= 0, row[columns], np.nan)
+        return np.where(np.isnan(recorded), prices, recorded)
+
+
+MODELS = {model.name: model for model in (UniformWalk, GeometricBrownianMotion, MeanReversion, ReplayModel)}
+
+
+class ModelRegistry:
+    # One shared instance per model name. Each gets its own RNG stream derived
+    # from the base seed, so a seeded run is reproducible tick for tick.
+    def __init__(self, default: str = "uniform", seed=None, options=None):
+        if default not in MODELS:
+            raise ValueError(f"Unknown price model: {default}")
+        self.default = default
+        self.seed = seed
+        self.options = options or {}
+        self.instances = {}
+
+    def get(self, name=None) -> PriceModel:
+        name = name or self.default
+        model = self.instances.get(name)
+        if model is None:
+            if name not in MODELS:
+                raise ValueError(f"Unknown price model: {name}")
+            seed = None if self.seed is None else [self.seed, zlib.crc32(name.encode("utf-8"))]
+            model = MODELS[name](seed=seed, **self.options.get(name, {}))
+            self.instances[name] = model
+        return model
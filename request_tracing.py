@@ -0,0 +1,150 @@
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import threading
+import time
+
+from flask import request
+from pymongo import monitoring
+
+# ----------------------------
+# Request timing and tracing
+# ----------------------------
+# Every request gets a trace on its thread that counts Mongo commands and the
+# time spent waiting for instrumented locks. When the request ends the totals
+# go into per-route histograms, and a sample of requests (plus every slow one)
+# is logged as one JSON line through a queue, so a slow log sink never holds
+# up a worker thread.
+
+_current = threading.local()
+
+
+def current_trace():
+    return getattr(_current, "trace", None)
+
+
+class TimedLock:
+    # Drop-in for threading.Lock that charges contended waits to the current request
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    def acquire(self, blocking=True, timeout=-1):
+        if self._lock.acquire(False):
+            return True
+        if not blocking:
+            return False
+        started = time.perf_counter()
+        acquired = self._lock.acquire(True, timeout)
+        trace = current_trace()
+        if trace is not None:
+            trace["lock_wait"] += time.perf_counter() - started
+        return acquired
+
+    def release(self):
+        self._lock.release()
+
+    def locked(self):
+        return self._lock.locked()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class TraceMongoListener(monitoring.CommandListener):
+    # Command events fire on the thread that issued the command, i.e. the request's
+    def started(self, event):
+        trace = current_trace()
+        if trace is not None:
+            trace["mongo_calls"] += 1
+
+    def succeeded(self, event):
+        trace = current_trace()
+        if trace is not None:
+            trace["mongo_seconds"] += event.duration_micros / 1e6
+
+    def failed(self, event):
+        self.succeeded(event)
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    # Sheds log lines instead of blocking the request when the writer falls behind
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            pass
+
+
+class RequestTracer:
+    def __init__(self, registry, sample_rate: float = 0.01, slow_ms: float = 500.0, log_path=None):
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+        self.requests = registry.counter("http_requests_total", "HTTP requests, by route, method and status")
+        self.duration = registry.histogram(
+            "http_request_duration_seconds", "Time to produce a response, by route")
+        self.mongo_calls = registry.histogram(
+            "http_request_mongo_calls", "MongoDB commands issued per request, by route",
+            buckets=(0, 1, 2, 3, 5, 8, 13, 21, 50, 100))
+        self.lock_wait = registry.histogram(
+            "http_request_lock_wait_seconds", "Time a request spent waiting for the ticker lock, by route",
+            buckets=(0.00001, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5))
+
+        self.logger = logging.getLogger("request_trace")
+        self.logger.propagate = False
+        self.logger.setLevel(logging.INFO)
+        handler = logging.FileHandler(log_path) if log_path else logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        log_queue = queue.Queue(maxsize=10000)
+        self.logger.addHandler(DroppingQueueHandler(log_queue))
+        self._listener = logging.handlers.QueueListener(log_queue, handler)
+        self._listener.start()
+
+    def init_app(self, app):
+        app.before_request(self.start)
+        app.after_request(self.finish)
+        app.teardown_request(self.clear)
+
+    def start(self):
+        _current.trace = {
+            "started": time.perf_counter(),
+            "mongo_calls": 0,
+            "mongo_seconds": 0.0,
+            "lock_wait": 0.0,
+        }
+
+    def finish(self, response):
+        trace = current_trace()
+        if trace is None:
+            return response
+        elapsed = time.perf_counter() - trace["started"]
+        route = request.url_rule.rule if request.url_rule else "<unmatched>"
+        self.requests.inc(route=route, method=request.method, status=response.status_code)
+        self.duration.observe(elapsed, route=route)
+        self.mongo_calls.observe(trace["mongo_calls"], route=route)
+        self.lock_wait.observe(trace["lock_wait"], route=route)
+
+        slow = elapsed * 1000 >= self.slow_ms
+        if slow or random.random() < self.sample_rate:
+            self.logger.info(json.dumps({
+                "ts": time.time(),
+                "method": request.method,
+                "route": route,
+                "path": request.path,
+                "status": response.status_code,
+                "ms": round(elapsed * 1000, 3),
+                "mongo_calls": trace["mongo_calls"],
+                "mongo_ms": round(trace["mongo_seconds"] * 1000, 3),
+                "lock_wait_ms": round(trace["lock_wait"] * 1000, 3),
+                "slow": slow,
+            }, separators=(",", ":")))
+        return response
+
+    def clear(self, exc=None):
+        _current.trace = None
+
@@ -0,0 +1,45 @@
+import os
+
+import pytest
+
+# app connects and reads its settings at import time; the routes and
+# settlement tests run it against mongomock with every on-disk side effect off
+os.environ.setdefault("MONGO_URI", "mongodb://localhost:27017")
+os.environ.update({
+    "MONGO_DB": "stock_trading_app_401_test",
+    "MONGO_TRANSACTIONS": "off",
+    "MARKET_STATE_BACKEND": "local",
+    "MARKET_CHECKPOINT_PATH": "",
+    "PRICE_HISTORY_DIR": "",
+    "JINJA_CACHE_DIR": "",
+    "PASSWORD_HASH_WORKERS": "0",
+    "BCRYPT_ROUNDS": "4",
+    "REQUEST_LOG_SAMPLE": "0",
+    "SLOW_QUERY_MS": "0",
+})
+
+
+@pytest.fixture(scope="session")
+def trading():
+    mongomock = pytest.importorskip("mongomock")
+    import pymongo
+
+    pymongo.MongoClient = mongomock.MongoClient
+    import app
+
+    return app
+
+
+@pytest.fixture
+def app_db(trading, monkeypatch):
+    # A clean database, market, order book and portfolio cache for each test
+    from order_book import OrderBook
+    from portfolio_book import PortfolioBook
+
+    for name in trading.db.list_collection_names():
+        trading.db.drop_collection(name)
+    trading.stock_catalog.invalidate()
+    trading.market.sync([])
+    monkeypatch.setattr(trading, "order_book", OrderBook())
+    monkeypatch.setattr(trading, "portfolio_book", PortfolioBook(trading.market.get_quotes))
+    return trading
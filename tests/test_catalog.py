@@ -0,0 +1,19 @@
+import pytest
+
+
+@pytest.mark.parametrize("params, expected", [
+    ({"sigma": "0.3", "mu": 0}, {"sigma": 0.3, "mu": 0.0}),
+    ({"sigma": "wide"}, None),
+    ({"sigma": float("nan")}, None),
+    ([0.3], None),
+])
+def test_catalog_entries_validates_model_params(trading, params, expected):
+    entries = trading.catalog_entries([{"ticker": "AAA", "price": 10, "model": "gbm", "model_params": params}])
+
+    assert entries == [{"ticker": "AAA", "price": 10.0, "model": "gbm", "model_params": expected}]
+
+
+def test_catalog_entries_skips_unusable_prices(trading):
+    stocks = [{"ticker": "AAA", "price": "n/a"}, {"ticker": "BBB", "price": float("inf")}, {"ticker": "CCC", "price": 5}]
+
+    assert [entry["ticker"] for entry in trading.catalog_entries(stocks)] == ["CCC"]
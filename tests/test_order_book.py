@@ -0,0 +1,80 @@
+import pytest
+
+from order_book import OrderBook, trigger_side
+
+
+def order(order_id, side, order_type, trigger_price, ticker="AAA"):
+    return {"_id": order_id, "type": side, "order_type": order_type, "ticker": ticker, "trigger_price": trigger_price}
+
+
+def test_trigger_side():
+    assert trigger_side("buy", "limit") == "below"
+    assert trigger_side("sell", "stop") == "below"
+    assert trigger_side("sell", "limit") == "above"
+    assert trigger_side("buy", "stop") == "above"
+
+
+def test_match_fires_only_crossed_orders_at_the_tick_price():
+    book = OrderBook()
+    book.add(order(1, "buy", "limit", 100.0))
+    book.add(order(2, "buy", "limit", 90.0))
+    book.add(order(3, "sell", "limit", 110.0))
+
+    triggered = book.match({"AAA": 95.0})
+
+    assert [o["_id"] for o in triggered] == [1]
+    assert triggered[0]["fill_price"] == 95.0
+    assert 1 not in book and 2 in book and 3 in book
+
+
+def test_match_covers_both_heaps_and_stops():
+    book = OrderBook()
+    book.add(order(1, "sell", "limit", 110.0))
+    book.add(order(2, "buy", "stop", 105.0))
+    book.add(order(3, "sell", "stop", 90.0))
+
+    assert sorted(o["_id"] for o in book.match({"AAA": 110.0})) == [1, 2]
+    assert [o["_id"] for o in book.match({"AAA": 89.0})] == [3]
+    assert len(book) == 0
+    assert book.tickers() == set()
+
+
+def test_match_ignores_other_tickers_and_equal_levels_fire():
+    book = OrderBook()
+    book.add(order(1, "buy", "limit", 50.0, ticker="BBB"))
+
+    assert book.match({"AAA": 1.0}) == []
+    assert [o["_id"] for o in book.match({"BBB": 50.0})] == [1]
+
+
+def test_cancelled_orders_never_trigger():
+    book = OrderBook()
+    book.add(order(1, "buy", "limit", 100.0))
+    book.add(order(2, "buy", "limit", 100.0))
+
+    assert book.cancel(1)["_id"] == 1
+    assert book.cancel(1) is None
+    assert [o["_id"] for o in book.match({"AAA": 99.0})] == [2]
+
+
+def test_add_ignores_orders_already_held():
+    book = OrderBook()
+    book.load([order(1, "buy", "limit", 100.0), order(1, "buy", "limit", 100.0)])
+
+    assert len(book) == 1
+    assert len(book.match({"AAA": 1.0})) == 1
+
+
+def test_non_finite_trigger_prices_are_rejected():
+    book = OrderBook()
+    for level in (float("nan"), float("inf"), 0.0):
+        with pytest.raises(ValueError):
+            book.add(order(1, "buy", "limit", level))
+    assert len(book) == 0
+
+
+def test_load_skips_invalid_orders_and_matching_continues():
+    book = OrderBook()
+    assert book.load([order(1, "buy", "limit", float("nan")), order(2, "buy", "limit", 100.0)]) == 1
+
+    assert [o["_id"] for o in book.match({"AAA": 50.0})] == [2]
@@ -0,0 +1,41 @@
+import multiprocessing
+import os
+import signal
+
+import pytest
+
+from metrics import Registry
+from password_hasher import HasherBusy, PasswordHasher
+
+
+def test_a_dead_worker_does_not_break_later_calls():
+    hasher = PasswordHasher(Registry(), rounds=4, workers=1, max_pending=2, timeout=30)
+    stored = hasher.hash("secret1")
+    for child in multiprocessing.active_children():
+        os.kill(child.pid, signal.SIGKILL)
+
+    # The call that finds the pool broken may be turned away; after that it is replaced
+    outcomes = []
+    for _ in range(3):
+        try:
+            outcomes.append(hasher.verify("secret1", stored))
+        except HasherBusy:
+            outcomes.append("busy")
+    assert outcomes[-1] is True
+    assert outcomes.count("busy") <= 1
+    # Every slot was handed back
+    assert all(hasher._slots.acquire(blocking=False) for _ in range(2))
+
+
+def test_a_failed_submit_gives_its_slot_back(monkeypatch):
+    hasher = PasswordHasher(Registry(), rounds=4, workers=1, max_pending=1)
+
+    class ClosedPool:
+        def submit(self, fn, *args):
+            raise RuntimeError("cannot schedule new futures after shutdown")
+
+    monkeypatch.setattr(hasher, "_executor", lambda: ClosedPool())
+    for _ in range(3):
+        with pytest.raises(RuntimeError):
+            hasher.hash("secret1")
+    assert hasher._slots.acquire(blocking=False)
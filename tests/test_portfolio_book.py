@@ -0,0 +1,73 @@
+import pytest
+
+from portfolio_book import PortfolioBook
+
+
+@pytest.fixture
+def book():
+    quotes = {"AAA": (12.0, 10.0), "BBB": (50.0, 50.0), "CCC": (7.0, 5.0)}
+    book = PortfolioBook(lambda tickers: {t: quotes[t] for t in tickers if t in quotes}, ttl=0)
+    book.load("u1", 100.0, {"AAA": 10, "BBB": 2}, {"AAA": (12.0, 10.0), "BBB": (50.0, 50.0)})
+    book.load("u2", 0.0, {"AAA": 1, "ZERO": 0}, {"AAA": (12.0, 10.0)})
+    return book
+
+
+def test_load_values_holdings(book):
+    assert book.get("u1") == {
+        "cash": 100.0, "holdings": {"AAA": 10, "BBB": 2}, "market_value": 220.0, "opening_value": 200.0,
+    }
+    assert book.get("u2")["holdings"] == {"AAA": 1}
+    assert sorted(book.tickers()) == ["AAA", "BBB"]
+
+
+def test_apply_prices_moves_only_holders(book):
+    book.apply_prices({"AAA": (13.0, 10.0), "CCC": (1.0, 1.0)})
+
+    assert book.get("u1")["market_value"] == pytest.approx(230.0)
+    assert book.get("u1")["opening_value"] == pytest.approx(200.0)
+    assert book.get("u2")["market_value"] == pytest.approx(13.0)
+
+
+def test_apply_prices_tracks_opening_resets(book):
+    book.apply_prices({"AAA": (13.0, 13.0)})
+
+    assert book.get("u1")["opening_value"] == pytest.approx(230.0)
+
+
+def test_apply_trade_buy_new_ticker_uses_quote_fn(book):
+    book.apply_trade("u1", "CCC", 3, -21.0)
+
+    summary = book.get("u1")
+    assert summary["cash"] == pytest.approx(79.0)
+    assert summary["holdings"]["CCC"] == 3
+    assert summary["market_value"] == pytest.approx(241.0)
+    assert summary["opening_value"] == pytest.approx(215.0)
+
+    book.apply_prices({"CCC": (8.0, 5.0)})
+    assert book.get("u1")["market_value"] == pytest.approx(244.0)
+
+
+def test_apply_trade_selling_out_drops_the_holder(book):
+    book.apply_trade("u1", "BBB", -2, 100.0)
+
+    summary = book.get("u1")
+    assert "BBB" not in summary["holdings"]
+    assert summary["cash"] == pytest.approx(200.0)
+    assert summary["market_value"] == pytest.approx(120.0)
+    assert "BBB" not in book.tickers()
+
+
+def test_apply_trade_cash_only_and_unknown_user(book):
+    book.apply_trade("u2", cash=50.0)
+    book.apply_trade("nobody", "AAA", 1, -12.0)
+
+    assert book.get("u2")["cash"] == 50.0
+    assert book.get("nobody") is None
+
+
+def test_expired_accounts_are_reloaded():
+    book = PortfolioBook(lambda tickers: {}, ttl=1e-9)
+    book.load("u1", 1.0, {"AAA": 1}, {"AAA": (1.0, 1.0)})
+
+    assert book.get("u1") is None
+    assert book.tickers() == []
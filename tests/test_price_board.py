@@ -0,0 +1,73 @@
+import pytest
+
+from price_board import PriceBoard
+
+
+@pytest.fixture
+def boards(tmp_path):
+    path = str(tmp_path / "board")
+    writer = PriceBoard(path, capacity=8)
+    assert writer.acquire()
+    return writer, PriceBoard(path, capacity=8)
+
+
+def test_reader_sees_writes_and_skips_unchanged(boards):
+    writer, reader = boards
+    assert reader.read() is None or reader.read()[1] == []
+
+    writer.write(["AAA", "BBB"], [11.0, 20.0], [10.0, 20.0], [12.0, 21.0], [9.0, 19.0])
+    sequence, tickers, prices, *_ = reader.read()
+
+    assert tickers == ["AAA", "BBB"]
+    assert prices.tolist() == [11.0, 20.0]
+    assert sequence % 2 == 0
+    assert reader.read(since=sequence) is None
+
+
+def test_get_reads_one_row_and_follows_relayouts(boards):
+    writer, reader = boards
+    writer.write(["AAA", "BBB"], [11.0, 20.0], [10.0, 20.0], [12.0, 21.0], [9.0, 19.0])
+    assert reader.get("AAA") == {
+        "ticker": "AAA", "current_price": 11.0, "opening_price": 10.0, "daily_high": 12.0,
+        "daily_low": 9.0, "daily_change": 1.0, "daily_change_percent": 10.0,
+    }
+
+    writer.write(["BBB", "CCC"], [21.0, 5.0], [20.0, 5.0], [21.0, 5.0], [19.0, 5.0])
+    assert reader.get("AAA") is None
+    assert reader.get("BBB")["current_price"] == 21.0
+    assert reader.get("CCC")["current_price"] == 5.0
+    assert reader.get("CCC") == [row for row in reader.rows() if row["ticker"] == "CCC"][0]
+
+
+def test_only_one_writer(boards):
+    writer, reader = boards
+    assert not reader.acquire()
+    assert writer.acquire()
+
+
+@pytest.mark.parametrize("ticker", ["X" * 17, "ÄBC"])
+def test_write_rejects_tickers_that_do_not_fit(boards, ticker):
+    writer, _ = boards
+    with pytest.raises(ValueError):
+        writer.write([ticker], [1.0], [1.0], [1.0], [1.0])
+
+
+def test_board_grows_past_its_capacity_and_readers_follow(boards):
+    writer, reader = boards
+    writer.write(["AAA"], [1.0], [1.0], [1.0], [1.0])
+    assert reader.get("AAA")["current_price"] == 1.0
+
+    tickers = [f"T{i}" for i in range(20)]
+    prices = [float(i) for i in range(20)]
+    writer.write(tickers, prices, prices, prices, prices)
+
+    assert writer.capacity == 20
+    sequence, read_tickers, read_prices, *_ = reader.read()
+    assert sequence % 2 == 0
+    assert read_tickers == tickers and read_prices.tolist() == prices
+    assert reader.get("T19")["current_price"] == 19.0
+    assert reader.get("AAA") is None
+
+    # A reader that maps the board only now sees the grown layout too
+    late = PriceBoard(writer.path, capacity=8)
+    assert late.get("T7")["current_price"] == 7.0
@@ -0,0 +1,135 @@
+import threading
+
+import pytest
+
+from price_engine import PriceEngine, load_checkpoint
+from price_models import ModelRegistry
+
+
+class FixedModel:
+    # Leaves prices where they are, so tests control every value
+    def bind(self, ticker, price, params=None):
+        pass
+
+    def unbind(self, ticker):
+        pass
+
+    def step(self, tickers, prices):
+        return prices.copy()
+
+
+class FixedRegistry:
+    def get(self, name=None):
+        return FixedModel()
+
+
+@pytest.fixture
+def engine():
+    engine = PriceEngine(threading.Lock(), capacity=2, models=FixedRegistry())
+    engine.add_many([{"ticker": t, "price": p} for t, p in (("AAA", 10.0), ("BBB", 20.0), ("CCC", 30.0))])
+    engine.snapshot()
+    return engine
+
+
+def test_add_grows_past_capacity(engine):
+    assert len(engine) == 3
+    assert engine.get_prices(["AAA", "BBB", "CCC"]) == {"AAA": 10.0, "BBB": 20.0, "CCC": 30.0}
+    assert not engine.add("AAA", 99.0)
+
+
+def test_remove_swaps_last_row_into_the_hole(engine):
+    assert engine.remove("AAA")
+    assert not engine.remove("AAA")
+
+    assert engine.tickers == ["CCC", "BBB"]
+    assert engine.index == {"CCC": 0, "BBB": 1}
+    assert engine.get("CCC")["current_price"] == 30.0
+    assert engine.get("AAA") is None
+
+    rows, changed, removed = engine.snapshot()
+    assert [row["ticker"] for row in rows] == ["CCC", "BBB"]
+    # CCC moved rows but kept its values, so deltas need not resend it
+    assert changed == set() and removed == {"AAA"}
+
+
+def test_snapshot_reports_changes_once(engine):
+    engine.prices[engine.index["BBB"]] = 21.0
+    engine.dirty[engine.index["BBB"]] = True
+
+    _, changed, removed = engine.snapshot()
+    assert changed == {"BBB"} and removed == set()
+    _, changed, _ = engine.snapshot()
+    assert changed == set()
+
+
+def test_load_state_replaces_the_market(engine):
+    engine.load_state(["BBB", "DDD"], [25.0, 40.0], [20.0, 40.0], [26.0, 40.0], [19.0, 40.0])
+
+    assert sorted(engine.tickers) == ["BBB", "DDD"]
+    bbb = engine.get("BBB")
+    assert (bbb["current_price"], bbb["opening_price"], bbb["daily_high"], bbb["daily_low"]) == (25.0, 20.0, 26.0, 19.0)
+    assert bbb["daily_change"] == 5.0 and bbb["daily_change_percent"] == 25.0
+
+    _, changed, removed = engine.snapshot()
+    assert changed == {"BBB", "DDD"}
+    assert removed == {"AAA", "CCC"}
+
+
+def test_load_state_marks_only_moved_rows(engine):
+    engine.load_state(["AAA", "BBB", "CCC"], [10.0, 20.0, 31.0], [10.0, 20.0, 30.0], [10.0, 20.0, 31.0], [10.0, 20.0, 30.0])
+
+    _, changed, _ = engine.snapshot()
+    assert changed == {"CCC"}
+
+
+def test_sync_adds_and_removes_but_keeps_prices(engine):
+    engine.prices[engine.index["BBB"]] = 22.0
+
+    added, removed = engine.sync([{"ticker": "BBB", "price": 20.0}, {"ticker": "DDD", "price": 5.0}])
+
+    assert added == ["DDD"] and removed == ["AAA", "CCC"]
+    assert engine.get_prices(["BBB", "DDD"]) == {"BBB": 22.0, "DDD": 5.0}
+
+
+def test_export_and_restore_round_trip(engine):
+    state = engine.export_state()
+    other = PriceEngine(threading.Lock(), models=FixedRegistry())
+    other.add_many([{"ticker": "CCC", "price": 1.0}, {"ticker": "ZZZ", "price": 2.0}])
+
+    assert other.restore(*state) == 1
+    assert other.get_prices(["CCC", "ZZZ"]) == {"CCC": 30.0, "ZZZ": 2.0}
+
+
+def test_concurrent_saves_leave_one_whole_checkpoint(engine, tmp_path):
+    path = str(tmp_path / "market.npz")
+
+    threads = [threading.Thread(target=engine.save, args=(path,), kwargs={"trading_day": "2026-01-02"}) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    checkpoint = load_checkpoint(path)
+    assert checkpoint["tickers"] == ["AAA", "BBB", "CCC"]
+    assert checkpoint["prices"] == [10.0, 20.0, 30.0]
+    assert checkpoint["trading_day"] == "2026-01-02"
+    assert [p.name for p in tmp_path.iterdir()] == ["market.npz"]
+
+
+def test_sync_rebinds_rows_loaded_with_the_default_model():
+    # A follower taking over the lease starts from load_state, which knows no models
+    engine = PriceEngine(threading.Lock(), models=ModelRegistry())
+    engine.load_state(["AAA"], [12.0], [10.0], [12.0], [10.0])
+    assert engine.row_models[0] is engine.models.get()
+
+    catalog = [{"ticker": "AAA", "price": 10.0, "model": "mean_reversion", "model_params": {"theta": 2.0}}]
+    assert engine.sync(catalog) == ([], [])
+
+    reverting = engine.models.get("mean_reversion")
+    assert engine.row_models[0] is reverting
+    assert reverting.params["AAA"] == {"anchor": 10.0, "theta": 2.0, "mean": 10.0}
+    assert "AAA" not in engine.models.get().params
+    assert engine.get_price("AAA") == 12.0
+
+    engine.sync([{**catalog[0], "model_params": {"theta": 3.0}}])
+    assert reverting.params["AAA"]["theta"] == 3.0
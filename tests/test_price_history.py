@@ -0,0 +1,47 @@
+from datetime import datetime
+
+import pytest
+
+from price_history import BarRecorder
+
+
+def test_history_times_are_converted_to_utc(trading):
+    assert trading.parse_history_time("2026-01-02T09:30:00-04:00") == datetime(2026, 1, 2, 13, 30)
+    assert trading.parse_history_time("2026-01-02T13:30:00Z") == datetime(2026, 1, 2, 13, 30)
+    assert trading.parse_history_time("2026-01-02T13:30:00") == datetime(2026, 1, 2, 13, 30)
+    assert trading.parse_history_time("") is None
+    with pytest.raises(ValueError):
+        trading.parse_history_time("yesterday")
+
+
+def test_history_api_filters_in_utc_and_rejects_bad_times(app_db):
+    app_db.stocks_col.insert_one({"ticker": "AAA", "name": "AAA Inc", "price": 10.0})
+    app_db.price_bars_col.insert_many([
+        {"ticker": "AAA", "interval": "1m", "start": datetime(2026, 1, 2, hour, 30), "open": 1.0, "high": 1.0, "low": 1.0, "close": 1.0}
+        for hour in (9, 13)
+    ])
+    client = app_db.app.test_client()
+
+    response = client.get("/api/history/AAA?start=2026-01-02T09:30:00-04:00")
+    assert [bar["start"] for bar in response.get_json()["bars"]] == ["2026-01-02T13:30:00Z"]
+
+    for query in ("start=not-a-time", "end=2026-13-40"):
+        response = client.get(f"/api/history/AAA?{query}")
+        assert response.status_code == 400
+
+
+def test_flush_can_write_on_the_calling_thread():
+    written = []
+
+    class Collection:
+        def bulk_write(self, ops, ordered=True):
+            written.extend(ops)
+
+    recorder = BarRecorder(Collection())
+    recorder._writer.shutdown()
+    recorder.record(datetime(2026, 1, 2, 13, 30, 5), ["AAA"], [10.0])
+
+    recorder.flush(wait=True)
+
+    assert len(written) == 3
+    assert recorder.current("AAA") is None
@@ -0,0 +1,164 @@
+from datetime import datetime, timedelta
+
+import pytest
+from bson import ObjectId
+
+
+@pytest.fixture
+def market(app_db):
+    app_db.stocks_col.insert_one({"ticker": "AAA", "name": "AAA Inc", "price": 10.0})
+    app_db.market.sync([{"ticker": "AAA", "price": 10.0}])
+    return app_db
+
+
+def user(trading, cash=100.0, holdings=None):
+    return trading.users_col.insert_one({"cash": cash, "holdings": holdings or {}}).inserted_id
+
+
+def pending_order(trading, user_id, side="buy", shares=2, **fields):
+    order = {
+        "user_id": user_id, "type": side, "ticker": "AAA", "company": "AAA Inc", "shares": shares,
+        "price": 10.0, "status": "pending", "created_at": datetime.utcnow(), **fields,
+    }
+    order["_id"] = trading.trades_col.insert_one(order).inserted_id
+    return order
+
+
+def test_pending_orders_settle_once(market):
+    buyer = user(market)
+    seller = user(market, cash=0.0, holdings={"AAA": 5})
+    buy = pending_order(market, buyer)
+    sell = pending_order(market, seller, side="sell", shares=5)
+
+    assert market.process_pending_orders()["completed"] == 2
+    assert market.process_pending_orders() is None
+
+    assert market.users_col.find_one({"_id": buyer})["cash"] == 80.0
+    assert market.users_col.find_one({"_id": buyer})["holdings"] == {"AAA": 2}
+    assert market.users_col.find_one({"_id": seller})["cash"] == 50.0
+    for order in (buy, sell):
+        doc = market.trades_col.find_one({"_id": order["_id"]})
+        assert doc["status"] == "completed" and "claimed_at" not in doc
+    assert not market.users_col.find_one({"settling_orders.0": {"$exists": True}})
+
+
+def test_insufficient_funds_fails_the_order(market):
+    buyer = user(market, cash=5.0)
+    order = pending_order(market, buyer)
+
+    assert market.process_pending_orders()["failed"] == 1
+
+    doc = market.trades_col.find_one({"_id": order["_id"]})
+    assert doc["status"] == "failed"
+    assert doc["failed_reason"] == "Insufficient funds at market open"
+    assert market.users_col.find_one({"_id": buyer})["cash"] == 5.0
+
+
+def test_a_second_claim_gets_nothing(market):
+    order = pending_order(market, user(market))
+
+    first = market.claim_orders([order], "pending", "settling")
+    second = market.claim_orders([order], "pending", "settling")
+
+    assert [o["_id"] for o in first] == [order["_id"]]
+    assert second == []
+    assert market.trades_col.find_one({"_id": order["_id"]})["status"] == "settling"
+
+
+def test_job_that_died_after_charging_is_completed_not_resettled(market, monkeypatch):
+    buyer = user(market)
+    order = pending_order(market, buyer)
+    claimed = market.claim_pending_orders()
+
+    def lost(*args, **kwargs):
+        raise ConnectionError("trades write lost")
+
+    monkeypatch.setattr(market.trades_col, "bulk_write", lost)
+    with pytest.raises(ConnectionError):
+        market.settle_batch(claimed, "pending")
+    monkeypatch.undo()
+
+    account = market.users_col.find_one({"_id": buyer})
+    assert account["cash"] == 80.0
+    assert [record["order_id"] for record in account["settling_orders"]] == [order["_id"]]
+
+    market.release_claims({"claim_id": claimed[0]["claim_id"]})
+    assert market.process_pending_orders() is None
+
+    doc = market.trades_col.find_one({"_id": order["_id"]})
+    assert doc["status"] == "completed" and doc["total_proceeds"] == 20.0
+    account = market.users_col.find_one({"_id": buyer})
+    assert account["cash"] == 80.0 and account["settling_orders"] == []
+
+
+def test_job_that_died_before_charging_is_settled_again(market, monkeypatch):
+    buyer = user(market)
+    order = pending_order(market, buyer)
+    claimed = market.claim_pending_orders()
+
+    def lost(*args, **kwargs):
+        raise ConnectionError("users write lost")
+
+    monkeypatch.setattr(market.users_col, "bulk_write", lost)
+    with pytest.raises(ConnectionError):
+        market.settle_batch(claimed, "pending")
+    monkeypatch.undo()
+
+    market.release_claims({"claim_id": claimed[0]["claim_id"]})
+    doc = market.trades_col.find_one({"_id": order["_id"]})
+    assert doc["status"] == "pending" and "claim_id" not in doc
+
+    assert market.process_pending_orders()["completed"] == 1
+    assert market.users_col.find_one({"_id": buyer})["cash"] == 80.0
+
+
+def test_a_repeated_user_update_is_skipped(market):
+    # Orders already recorded on the account are not charged a second time
+    buyer = user(market)
+    order = pending_order(market, buyer)
+    claimed = market.claim_pending_orders()
+    market.users_col.update_one({"_id": buyer}, {"$push": {"settling_orders": {
+        "order_id": order["_id"], "price": 10.0, "total": 20.0, "at": datetime.utcnow()}}})
+
+    market.settle_batch(claimed, "pending")
+
+    assert market.users_col.find_one({"_id": buyer})["cash"] == 100.0
+    assert market.trades_col.find_one({"_id": order["_id"]})["status"] == "completed"
+
+
+def test_stale_triggered_orders_go_back_on_the_book(market):
+    buyer = user(market)
+    order = pending_order(
+        market, buyer, status="triggered", order_type="limit", trigger_price=9.0,
+        claim_id=ObjectId(), claimed_at=datetime.utcnow() - timedelta(seconds=market.SETTLEMENT_CLAIM_TIMEOUT + 1),
+    )
+    fresh = pending_order(market, buyer, status="settling", claim_id=ObjectId(), claimed_at=datetime.utcnow())
+
+    market.release_stale_claims()
+
+    assert market.trades_col.find_one({"_id": order["_id"]})["status"] == "open"
+    assert order["_id"] in market.order_book
+    assert market.trades_col.find_one({"_id": fresh["_id"]})["status"] == "settling"
+
+
+def test_partitions_keep_each_users_orders_together_and_in_order(market):
+    # Each buyer can afford only their first order; that holds only if one
+    # worker settles all of a user's orders in created_at order
+    start = datetime.utcnow()
+    buyers = [user(market, cash=20.0) for _ in range(12)]
+    for i, buyer in enumerate(buyers):
+        pending_order(market, buyer, created_at=start + timedelta(seconds=i))
+        pending_order(market, buyer, created_at=start + timedelta(seconds=100 + i))
+
+    partitions = market.partition_orders(list(market.trades_col.find()), market.SETTLEMENT_WORKERS)
+    assert sum(map(len, partitions)) == 24
+    assert all(len({o["user_id"] for o in part}) * 2 == len(part) for part in partitions)
+
+    stats = market.process_pending_orders()
+
+    assert (stats["completed"], stats["failed"]) == (12, 12)
+    assert stats["partitions"] == len(partitions) > 1
+    for buyer in buyers:
+        orders = list(market.trades_col.find({"user_id": buyer}).sort("created_at", 1))
+        assert [o["status"] for o in orders] == ["completed", "failed"]
+        assert market.users_col.find_one({"_id": buyer})["cash"] == 0.0
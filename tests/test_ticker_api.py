@@ -0,0 +1,101 @@
+import json
+
+import pytest
+
+
+@pytest.fixture
+def ticker(app_db):
+    app_db.market.sync([{"ticker": t, "price": p} for t, p in (("AAA", 10.0), ("BBB", 20.0))])
+    app_db.publish_ticker_update()
+    return app_db
+
+
+def move(trading, ticker, price):
+    trading.market.restore([ticker], [price], [price], [price], [price])
+    return trading.publish_ticker_update()
+
+
+def test_delta_lists_only_what_changed_since_the_cursor(ticker):
+    first = ticker.publish_ticker_update()
+    move(ticker, "AAA", 11.0)
+    latest = move(ticker, "AAA", 12.0)
+
+    delta = json.loads(ticker.get_ticker_delta(latest, first.cursor))
+
+    assert delta["full"] is False
+    assert delta["since"] == first.cursor and delta["cursor"] == latest.cursor
+    assert [(row["ticker"], row["current_price"]) for row in delta["stocks"]] == [("AAA", 12.0)]
+    assert ticker.get_ticker_delta(latest, latest.cursor) == json.dumps(
+        {"version": latest.version, "cursor": latest.cursor, "since": latest.cursor, "full": False,
+         "market_open": latest.market_open, "stocks": [], "removed": []}, separators=(",", ":")).encode()
+
+
+def test_removed_tickers_are_reported(ticker):
+    first = ticker.publish_ticker_update()
+    ticker.market.sync([{"ticker": "AAA", "price": 10.0}])
+    latest = ticker.publish_ticker_update()
+
+    assert json.loads(ticker.get_ticker_delta(latest, first.cursor))["removed"] == ["BBB"]
+
+
+@pytest.mark.parametrize("cursor", ["other-boot-{version}", "{version}", "{boot}-x", "junk"])
+def test_foreign_or_malformed_cursors_need_the_full_snapshot(ticker, cursor):
+    snapshot = ticker.publish_ticker_update()
+    latest = move(ticker, "AAA", 11.0)
+
+    cursor = cursor.format(version=snapshot.version, boot=ticker.BOOT_ID)
+    assert ticker.get_ticker_delta(latest, cursor) is None
+
+
+def test_cursors_older_than_the_change_log_need_the_full_snapshot(ticker):
+    oldest = ticker.publish_ticker_update()
+    for _ in range(ticker.TICKER_CHANGELOG_SIZE + 1):
+        latest = ticker.publish_ticker_update()
+
+    assert ticker.get_ticker_delta(latest, oldest.cursor) is None
+
+
+def test_api_falls_back_to_the_full_snapshot(ticker):
+    client = ticker.app.test_client()
+    full = client.get("/api/ticker").get_json()
+    assert full["full"] is True
+
+    move(ticker, "AAA", 11.0)
+    assert client.get(f"/api/ticker?since={full['cursor']}").get_json()["full"] is False
+    assert client.get(f"/api/ticker?since={full['version']}").get_json()["full"] is True
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_pages_stream_only_when_enabled(app_db, monkeypatch, stream):
+    monkeypatch.setitem(app_db.app.jinja_env.globals, "ticker_stream", stream)
+    user_id = app_db.users_col.insert_one({"username": "ann", "role": "user", "cash": 0.0, "holdings": {}}).inserted_id
+    client = app_db.app.test_client()
+    with client.session_transaction() as session:
+        session["user_id"] = str(user_id)
+
+    page = client.get("/buy").get_data(as_text=True)
+
+    assert f"if (window.EventSource && {str(stream).lower()})" in page
+
+
+def test_published_snapshot_is_none_once_stale(ticker, monkeypatch):
+    latest = ticker.publish_ticker_update()
+    assert ticker.published_ticker_snapshot() is latest
+
+    monkeypatch.setattr(latest, "created_at", latest.created_at - ticker.TICKER_SNAPSHOT_MAX_AGE - 1)
+    assert ticker.published_ticker_snapshot() is None
+    assert ticker.get_ticker_snapshot().version > latest.version
+
+
+def test_gzip_and_identity_bodies_carry_different_etags(ticker):
+    client = ticker.app.test_client()
+
+    gzipped = client.get("/api/ticker", headers={"Accept-Encoding": "gzip"})
+    plain = client.get("/api/ticker", headers={"Accept-Encoding": "identity"})
+
+    assert gzipped.headers["Content-Encoding"] == "gzip"
+    assert gzipped.get_etag()[0] == plain.get_etag()[0] + "-gz"
+    assert client.get("/api/ticker", headers={"Accept-Encoding": "gzip", "If-None-Match": gzipped.headers["ETag"]}).status_code == 304
+    # A cached gzip body must not be revalidated for a client that cannot decode it
+    revalidated = client.get("/api/ticker", headers={"Accept-Encoding": "identity", "If-None-Match": gzipped.headers["ETag"]})
+    assert revalidated.status_code == 200 and revalidated.data == plain.data
@@ -0,0 +1,60 @@
+import json
+from datetime import datetime, timedelta
+
+import pytest
+from bson import ObjectId
+
+
+@pytest.fixture
+def history(app_db):
+    # Seven trades for one user, three of them sharing a created_at, plus one of another user's
+    user_id, start = ObjectId(), datetime(2026, 3, 2, 14, 30)
+    times = [start, start + timedelta(minutes=1), *[start + timedelta(minutes=2)] * 3, start + timedelta(minutes=3), start + timedelta(minutes=4)]
+    app_db.trades_col.insert_many([{"user_id": user_id, "type": "buy", "ticker": "AAA", "created_at": t} for t in times])
+    app_db.trades_col.insert_one({"user_id": ObjectId(), "type": "buy", "ticker": "AAA", "created_at": start})
+    newest_first = sorted(app_db.trades_col.find({"user_id": user_id}), key=lambda o: (o["created_at"], o["_id"]), reverse=True)
+    return user_id, [order["_id"] for order in newest_first]
+
+
+def test_cursor_round_trips_and_rejects_garbage(app_db):
+    order = {"_id": ObjectId(), "created_at": datetime(2026, 3, 2, 14, 30, 0, 123000)}
+
+    assert app_db.decode_history_cursor(app_db.encode_history_cursor(order)) == (order["created_at"], order["_id"])
+    assert app_db.decode_history_cursor("yesterday") is None
+    assert app_db.decode_history_cursor("2026-03-02T14:30:00_nope") is None
+
+
+def test_pages_walk_the_history_once_across_created_at_ties(app_db, history):
+    user_id, expected = history
+    seen, cursor, pages = [], None, 0
+    while True:
+        orders, cursor = app_db.trade_history_page(user_id, cursor, limit=2)
+        seen += [order["_id"] for order in orders]
+        pages += 1
+        if cursor is None:
+            break
+
+    assert seen == expected
+    assert pages == 4
+
+
+def test_full_last_page_has_no_next_cursor(app_db, history):
+    user_id, expected = history
+    orders, cursor = app_db.trade_history_page(user_id, limit=len(expected))
+
+    assert [order["_id"] for order in orders] == expected and cursor is None
+
+
+def test_bad_cursor_starts_from_the_newest_trade(app_db, history):
+    user_id, expected = history
+    orders, _ = app_db.trade_history_page(user_id, "not-a-cursor", limit=3)
+
+    assert [order["_id"] for order in orders] == expected[:3]
+
+
+def test_ndjson_export_streams_every_trade_newest_first(app_db, history):
+    user_id, expected = history
+    rows = [json.loads(line) for line in app_db.export_trade_rows(user_id, "ndjson")]
+
+    assert len(rows) == len(expected)
+    assert rows[0]["created_at"] == "2026-03-02T14:34:00" and rows[-1]["created_at"] == "2026-03-02T14:30:00"
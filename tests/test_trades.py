@@ -0,0 +1,97 @@
+import pytest
+
+
+@pytest.fixture
+def client(app_db):
+    app_db.stocks_col.insert_one({"ticker": "AAA", "name": "AAA Inc", "price": 10.0})
+    app_db.market.sync([{"ticker": "AAA", "price": 10.0}])
+    user_id = app_db.users_col.insert_one({"username": "ann", "role": "user", "cash": 100.0, "holdings": {"AAA": 5}}).inserted_id
+    client = app_db.app.test_client()
+    with client.session_transaction() as session:
+        session["user_id"] = str(user_id)
+    client.user_id = user_id
+    return client
+
+
+@pytest.mark.parametrize("trigger_price", ["nan", "inf", "-1", "abc"])
+def test_resting_orders_need_a_finite_positive_trigger(app_db, client, trigger_price):
+    response = client.post("/buy", data={
+        "company": "AAA Inc", "ticker": "AAA", "shares": "1", "price": "10",
+        "order_type": "limit", "trigger_price": trigger_price,
+    })
+
+    assert b"Invalid limit or stop price." in response.data
+    assert app_db.trades_col.count_documents({}) == 0
+    assert len(app_db.order_book) == 0
+
+
+def test_market_sell_rejects_a_nan_price(app_db, client, monkeypatch):
+    monkeypatch.setattr(app_db, "is_market_open", lambda: True)
+    client.post("/sell_post", data={"ticker": "AAA", "shares": "1", "price": "nan"})
+
+    user = app_db.users_col.find_one({"_id": client.user_id})
+    assert user["cash"] == 100.0 and user["holdings"] == {"AAA": 5}
+
+
+def trade_doc(user_id, side, shares, total):
+    return {"user_id": user_id, "type": side, "ticker": "AAA", "shares": shares, "total_proceeds": total, "status": "completed"}
+
+
+def test_trade_guard_conditions_on_cash_for_buys_and_shares_for_sells(app_db):
+    assert app_db.trade_guard("u", "buy", "AAA", 3, 30.0) == (
+        {"_id": "u", "cash": {"$gte": 30.0}},
+        {"$inc": {"cash": -30.0, "holdings.AAA": 3}},
+    )
+    assert app_db.trade_guard("u", "sell", "AAA", 3, 30.0) == (
+        {"_id": "u", "holdings.AAA": {"$gte": 3}},
+        {"$inc": {"cash": 30.0, "holdings.AAA": -3}},
+    )
+
+
+@pytest.mark.parametrize("side, shares, total, cash, held", [("buy", 3, 30.0, 70.0, 8), ("sell", 5, 50.0, 150.0, 0)])
+def test_execute_trade_moves_cash_and_shares_once(app_db, client, side, shares, total, cash, held):
+    app_db.execute_trade(client.user_id, side, "AAA", shares, total, trade_doc(client.user_id, side, shares, total))
+
+    user = app_db.users_col.find_one({"_id": client.user_id})
+    assert user["cash"] == cash and user["holdings"]["AAA"] == held
+    assert app_db.trades_col.count_documents({"user_id": client.user_id, "type": side}) == 1
+
+
+@pytest.mark.parametrize("side, shares, total", [("buy", 20, 200.0), ("sell", 6, 60.0)])
+def test_execute_trade_rejects_what_the_account_cannot_cover(app_db, client, side, shares, total):
+    with pytest.raises(app_db.TradeRejected):
+        app_db.execute_trade(client.user_id, side, "AAA", shares, total, trade_doc(client.user_id, side, shares, total))
+
+    user = app_db.users_col.find_one({"_id": client.user_id})
+    assert user["cash"] == 100.0 and user["holdings"] == {"AAA": 5}
+    assert app_db.trades_col.count_documents({}) == 0
+
+
+def test_execute_trade_undoes_the_balance_change_when_the_insert_fails(app_db, client, monkeypatch):
+    def fail(*args, **kwargs):
+        raise RuntimeError("insert failed")
+
+    monkeypatch.setattr(app_db.trades_col, "insert_one", fail)
+    with pytest.raises(RuntimeError):
+        app_db.execute_trade(client.user_id, "buy", "AAA", 3, 30.0, trade_doc(client.user_id, "buy", 3, 30.0))
+
+    user = app_db.users_col.find_one({"_id": client.user_id})
+    assert user["cash"] == 100.0 and user["holdings"] == {"AAA": 5}
+
+
+def test_buy_that_lost_a_race_for_the_cash_is_rejected(app_db, client, monkeypatch):
+    # The page saw 100 in cash, but another request spent it before the update
+    monkeypatch.setattr(app_db, "is_market_open", lambda: True)
+    spend = app_db.execute_trade
+
+    def spent_first(user_id, *args):
+        app_db.users_col.update_one({"_id": user_id}, {"$set": {"cash": 10.0}})
+        return spend(user_id, *args)
+
+    monkeypatch.setattr(app_db, "execute_trade", spent_first)
+    response = client.post("/buy", data={"company": "AAA Inc", "ticker": "AAA", "shares": "3", "price": "10"})
+
+    assert b"Insufficient funds." in response.data
+    user = app_db.users_col.find_one({"_id": client.user_id})
+    assert user["cash"] == 10.0 and user["holdings"] == {"AAA": 5}
+    assert app_db.trades_col.count_documents({}) == 0